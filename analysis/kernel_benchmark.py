@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+#
+#
+"""@package kernel_benchmark
+
+Time the Euler kernels (Rusanov, Roe and Godunov fluxes, interior
+flux) of each backend (see dg1d/backends.py) as a function of the
+number of interfaces (or nodes). The speed-ups are relative to numpy.
+
+"""
+
+# ========================================================================
+#
+# Imports
+#
+# ========================================================================
+import argparse
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+import dg1d.constants as constants
+import dg1d.backends as backends
+
+# ========================================================================
+#
+# Parse arguments
+#
+# ========================================================================
+parser = argparse.ArgumentParser(
+    description='Time the Euler kernels of each backend')
+parser.add_argument('-n', '--interfaces', help='Numbers of interfaces',
+                    type=int, nargs='+', default=[100, 1000, 10000, 100000, 1000000])
+parser.add_argument('-r', '--repeat', help='Number of timing repeats',
+                    type=int, default=3)
+args = parser.parse_args()
+
+
+# ========================================================================
+#
+# Function definitions
+#
+# ========================================================================
+def random_states(N):
+    """Returns N random left and right states (conserved variables)"""
+    rho = np.random.uniform(0.1, 2.0, (2, N))
+    v = np.random.uniform(-1.0, 1.0, (2, N))
+    p = np.random.uniform(0.5, 2.0, (2, N))
+    u = np.zeros((2, 3 * N))
+    u[:, 0::3] = rho
+    u[:, 1::3] = rho * v
+    u[:, 2::3] = p / (constants.gamma - 1) + 0.5 * rho * v * v
+    return u[0], u[1]
+
+
+# ========================================================================
+def best_time(kernel, kargs, repeat):
+    """Returns the best time of a kernel call (averaged over enough calls)"""
+    number = max(1, 1000000 // kargs[0].size)
+    return min(timeit.repeat(lambda: kernel(*kargs),
+                             number=number, repeat=repeat)) / number
+
+
+# ========================================================================
+#
+# Main
+#
+# ========================================================================
+if __name__ == '__main__':
+
+    constants.init()
+    np.random.seed(0)
+
+    names = ['riemann_rusanov', 'riemann_roe', 'riemann_godunov',
+             'interior_flux']
+    others = [b for b in backends.registry if b != 'numpy']
+    kernels = {b: backends.get_kernels(b, 'euler') for b in backends.registry}
+
+    for name in names:
+        print(name)
+        print('{0:>10s}{1:>12s}'.format('interfaces', 'numpy') +
+              ''.join(['{0:>12s}'.format(b) for b in others]))
+
+        for N in args.interfaces:
+            ul, ur = random_states(N)
+            F = np.zeros(ul.shape)
+
+            # Interior flux on 4 nodes per element
+            ug = np.array([ul, ur, ul, ur])
+            G = np.zeros(ug.shape)
+            kargs = (ug, G) if name == 'interior_flux' else (ul, ur, F)
+
+            # Call each kernel once first (e.g. to compile it)
+            times = {}
+            for b in backends.registry:
+                kernels[b][name](*kargs)
+                times[b] = best_time(kernels[b][name], kargs, args.repeat)
+
+            print('{0:10d}{1:12.3e}'.format(N, times['numpy']) +
+                  ''.join(['{0:12.2f}'.format(times['numpy'] / times[b])
+                           for b in others]))
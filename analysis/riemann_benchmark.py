@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+#
+"""@package riemann_benchmark
+
+Time the Riemann solvers of the Euler equations as a function of the
+number of interfaces.
+
+"""
+
+# ========================================================================
+#
+# Imports
+#
+# ========================================================================
+import argparse
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+import dg1d.constants as constants
+import dg1d.euler_physics as euler_physics
+
+# ========================================================================
+#
+# Parse arguments
+#
+# ========================================================================
+parser = argparse.ArgumentParser(
+    description='Time the Riemann solvers of the Euler equations')
+parser.add_argument('-n', '--interfaces', help='Numbers of interfaces',
+                    type=int, nargs='+', default=[10, 100, 1000, 10000])
+parser.add_argument('-r', '--repeat', help='Number of timing repeats',
+                    type=int, default=3)
+args = parser.parse_args()
+
+
+# ========================================================================
+#
+# Function definitions
+#
+# ========================================================================
+def random_states(N):
+    """Returns N random left and right states (conserved variables)"""
+    rho = np.random.uniform(0.1, 2.0, (2, N))
+    v = np.random.uniform(-1.0, 1.0, (2, N))
+    p = np.random.uniform(0.5, 2.0, (2, N))
+    u = np.zeros((2, 3 * N))
+    u[:, 0::3] = rho
+    u[:, 1::3] = rho * v
+    u[:, 2::3] = p / (constants.gamma - 1) + 0.5 * rho * v * v
+    return u[0], u[1]
+
+
+# ========================================================================
+#
+# Main
+#
+# ========================================================================
+if __name__ == '__main__':
+
+    constants.init()
+    np.random.seed(0)
+
+    solvers = ['riemann_godunov_loop', 'riemann_godunov', 'riemann_roe',
+               'riemann_hll', 'riemann_hllc']
+    print('{0:>10s}'.format('interfaces') +
+          ''.join(['{0:>22s}'.format(s) for s in solvers]) +
+          '{0:>10s}'.format('speed-up'))
+
+    for N in args.interfaces:
+        ul, ur = random_states(N)
+        F = np.zeros(ul.shape)
+        times = []
+        for s in solvers:
+            solver = getattr(euler_physics, s)
+            times.append(min(timeit.repeat(lambda: solver(ul, ur, F),
+                                           number=1, repeat=args.repeat)))
+
+        print('{0:10d}'.format(N) +
+              ''.join(['{0:22.3e}'.format(t) for t in times]) +
+              '{0:10.1f}'.format(times[0] / times[1]))
@@ -14,22 +14,38 @@ import numpy as np
 # ========================================================================
 
 
-def max_wave_speed(u):
+def max_wave_speed(u, layout='interleaved'):
     """Returns the maximum wave speed for advection"""
     return 1
 
 # ========================================================================
 
 
-def riemann_upwinding(ul, ur):
-    """Returns the interface flux for the advection equation (simple upwinding)"""
-    return ul
+def riemann_upwinding(ul, ur, out=None, wl=None, wr=None, speeds=None,
+                      layout='interleaved'):
+    """Returns the interface flux for the advection equation (simple upwinding)
+
+    If out is given, the flux is stored in it. If speeds is given, the
+    wave speed at each interface is stored in it. The layout does not
+    matter with a single field, and there are no primitive variables
+    (wl, wr).
+    """
+    if speeds is not None:
+        speeds.fill(1)
+    if out is None:
+        return ul
+    out[...] = ul
+    return out
 
 # ========================================================================
 
 
-def interior_flux(ug):
-    """Returns the interior flux for the advection equation"""
+def interior_flux(ug, out=None, w=None, layout='interleaved'):
+    """Returns the interior flux for the advection equation
+
+    The flux is the solution itself so there is no need to fill out
+    (and there are no primitive variables w).
+    """
     return ug
 
 # ========================================================================
@@ -40,15 +56,16 @@ def sensing(sensors, thresholds, solution):
        left/right cell solutions for the advection equation.
     """
 
-    # left/right solution
-    ul = solution.u[0, :-solution.N_F]
-    ur = solution.u[0, solution.N_F:]
+    # left/right solution (cell averages)
+    u = solution.split_fields(solution.u)[0][..., 0, :]
+    ul = u[..., :-1]
+    ur = u[..., 1:]
 
     # Calculate the sensor
     phi = np.fabs(ur - ul)
     PHI = 2 * phi / ((1 + phi) * (1 + phi))
 
     # Find where the sensor exceeds the threshold value
-    idx = np.array(np.where(PHI > thresholds[0]))
-    sensors[idx] = 1
-    sensors[idx + 1] = 1
+    idx = PHI > thresholds[0]
+    sensors[..., :-1][idx] = 1
+    sensors[..., 1:][idx] = 1
@@ -0,0 +1,104 @@
+# ========================================================================
+#
+# Imports
+#
+# ========================================================================
+import dg1d.advection_physics as advection_physics
+import dg1d.euler_physics as euler_physics
+import dg1d.euler_fused as euler_fused
+import dg1d.numba_kernels as numba_kernels
+
+# ========================================================================
+#
+# Global variables
+#
+# ========================================================================
+
+# Kernels of each backend (numpy, fused, numba) for each system. The
+# kernels of the None system do not depend on the system (e.g. the
+# hierarchical reconstruction of the limiter). Each system has a
+# default Riemann solver ('riemann') and named ones ('riemann_roe',
+# etc.). The Riemann solvers and interior fluxes of the backends
+# with 'primitives' take the primitive variables of their states
+# (the others compute their own).
+registry = {}
+
+# ========================================================================
+#
+# Function definitions
+#
+# ========================================================================
+
+
+def register(backend, system, kernels):
+    """Adds kernels to a backend for a system"""
+    registry.setdefault(backend, {}).setdefault(system, {}).update(kernels)
+
+
+# ========================================================================
+def get_kernels(backend, system):
+    """Returns the kernels of a backend for a system
+
+    A backend only needs to provide some of the kernels, the others
+    are the numpy ones. An unknown (or unavailable) backend falls back
+    to numpy.
+    """
+    if backend not in registry:
+        print("\tKernel backend {0:s} is not available, using numpy.".format(backend))
+        backend = 'numpy'
+
+    kernels = {}
+    for b in ['numpy', backend]:
+        for s in [None, system]:
+            kernels.update(registry[b].get(s, {}))
+    return kernels
+
+
+# ========================================================================
+#
+# Registration of the backends
+#
+# ========================================================================
+register('numpy', 'advection', {
+    'riemann': advection_physics.riemann_upwinding,
+    'interior_flux': advection_physics.interior_flux,
+    'max_wave_speed': advection_physics.max_wave_speed,
+    'sensing': advection_physics.sensing,
+})
+register('numpy', 'euler', {
+    'riemann': euler_physics.riemann_roe,
+    'riemann_rusanov': euler_physics.riemann_rusanov,
+    'riemann_roe': euler_physics.riemann_roe,
+    'riemann_godunov': euler_physics.riemann_godunov,
+    'riemann_hll': euler_physics.riemann_hll,
+    'riemann_hllc': euler_physics.riemann_hllc,
+    'interior_flux': euler_physics.interior_flux,
+    'max_wave_speed': euler_physics.max_wave_speed,
+    'sensing': euler_physics.sensing,
+    'positivity': euler_physics.positivity,
+    'primitives': euler_physics.primitives,
+})
+
+# Blocked in-place evaluation, without full-length temporaries
+register('fused', 'euler', {
+    'riemann': euler_fused.riemann_roe,
+    'riemann_rusanov': euler_fused.riemann_rusanov,
+    'riemann_roe': euler_fused.riemann_roe,
+    'interior_flux': euler_fused.interior_flux,
+})
+
+# Compiled scalar loops (only if numba is installed)
+if numba_kernels.numba is not None:
+    register('numba', None, {
+        'hr': numba_kernels.hr,
+    })
+    register('numba', 'euler', {
+        'riemann': numba_kernels.riemann_roe,
+        'riemann_rusanov': numba_kernels.riemann_rusanov,
+        'riemann_roe': numba_kernels.riemann_roe,
+        'riemann_godunov': numba_kernels.riemann_godunov,
+        'interior_flux': numba_kernels.interior_flux,
+        'max_wave_speed': numba_kernels.max_wave_speed,
+        'sensing': numba_kernels.sensing,
+        'primitives': None,
+    })
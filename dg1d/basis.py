@@ -18,7 +18,7 @@ class Basis:
     'Generate the basis functions, gradients and Gaussian quadrature'
 
     # ========================================================================
-    def __init__(self, order):
+    def __init__(self, order, dtype=np.float64):
 
         print("Generating the basis functions.")
 
@@ -36,11 +36,14 @@ class Basis:
         self.x, self.w = leg.leggauss(self.p + 1)
         self.N_G = len(self.x)
 
-        # Construct useful basis matrices
+        # Construct useful basis matrices (in the precision of the
+        # solution they act on)
         self.phi, self.dphi_w = self.evaluate_basis_gauss()
+        self.phi = self.phi.astype(dtype)
+        self.dphi_w = self.dphi_w.astype(dtype)
 
         # Construct the matrix to evaluate a solution at the cell edges
-        self.psi = self.evaluate_basis_edges()
+        self.psi = self.evaluate_basis_edges().astype(dtype)
 
         # Construct the (unscaled) mass matrix and its inverse
         self.m, self.minv = self.mass_matrix()
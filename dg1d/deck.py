@@ -28,7 +28,20 @@ class Deck:
         self.order = 1
         self.limiting = ''
         self.enhance = ''
+        self.positivity = ''
+        self.filter = ''
         self.sensor_thresholds = []
+        self.sensing = 'stage'
+        self.layout = 'interleaved'
+        self.ensemble = []
+        self.ensemble_dt = 'shared'
+        self.residual = ''
+        self.precision = 'float64'
+        self.threads = 1
+        self.kernels = 'numpy'
+        self.wave_speed = ''
+        self.wave_speed_safety = 1.0
+        self.wave_speed_every = 0
 
     # ========================================================================
     def parser(self, fname):
@@ -56,11 +69,39 @@ class Deck:
                     self.order = int(next(f))
                 elif "#limiting" in line:
                     self.limiting = next(f).rstrip()
+                elif "#filter" in line:
+                    self.filter = next(f).rstrip()
+                elif "#positivity" in line:
+                    self.positivity = next(f).rstrip()
                 elif "#enhancement" in line:
                     self.enhance = next(f).rstrip()
                 elif "#sensor thresholds" in line:
                     line = next(f).rstrip()
                     self.sensor_thresholds = [float(i) for i in line.split()]
+                elif "#sensing" in line:
+                    self.sensing = next(f).rstrip()
+                elif "#storage layout" in line:
+                    self.layout = next(f).rstrip()
+                elif "#wave speed" in line:
+                    line = next(f).split()
+                    self.wave_speed = line[0]
+                    if len(line) > 1:
+                        self.wave_speed_safety = float(line[1])
+                    if len(line) > 2:
+                        self.wave_speed_every = int(line[2])
+                elif "#threads" in line:
+                    self.threads = int(next(f))
+                elif "#kernels" in line:
+                    self.kernels = next(f).rstrip()
+                elif "#precision" in line:
+                    self.precision = next(f).rstrip()
+                elif "#residual evaluation" in line:
+                    self.residual = next(f).rstrip()
+                elif "#ensemble time step" in line:
+                    self.ensemble_dt = next(f).rstrip()
+                elif "#ensemble" in line:
+                    N = int(next(f))
+                    self.ensemble = [next(f).rstrip() for i in range(N)]
 
 
 # ========================================================================
@@ -4,6 +4,19 @@
 #
 # ========================================================================
 import numpy as np
+import scipy.sparse as sparse
+from concurrent.futures import ThreadPoolExecutor
+import dg1d.parallel as parallel
+
+# ========================================================================
+#
+# Global variables
+#
+# ========================================================================
+
+# Target size (in bytes) of the solution in each chunk of elements for
+# the threaded residual
+CHUNK_BYTES = 2**18
 
 # ========================================================================
 #
@@ -16,25 +29,92 @@ class DG:
     'DG method solver'
 
     # ========================================================================
-    def __init__(self, solution):
+    def __init__(self, solution, method='', threads=1, limiting=''):
 
         print("Initializing the DG solver.")
 
-        # Initialize variables
-        self.ug = np.zeros((solution.u.shape))
-        self.uf = np.zeros((2, solution.u.shape[1]))
-        self.q = np.zeros((solution.N_E + 1) * solution.N_F)
-        self.F = np.zeros(solution.u.shape)
-        self.Q = np.zeros((self.F.shape[0], solution.N_E * solution.N_F))
+        # Initialize variables (the elements are always on the last
+        # axis, the modes on the one before). These are the work
+        # arrays that the residual writes into at every stage.
+        shape = solution.u.shape
+        s = solution.stride
+        dtype = solution.u.dtype
+        self.ug = np.zeros(shape, dtype=dtype)
+        self.uf = np.zeros(shape[:-2] + (2, shape[-1]), dtype=dtype)
+        self.Fg = np.zeros(shape, dtype=dtype)
+        self.q = np.zeros(shape[:-2] + (shape[-1] - s,), dtype=dtype)
+        self.F = np.zeros(shape, dtype=dtype)
+        self.Q = np.zeros(shape[:-1] + (shape[-1] - 2 * s,), dtype=dtype)
+
+        # Largest signal speed at each interface (found by the Riemann
+        # solver as a byproduct of the face fluxes)
+        self.speeds = [np.zeros(solution.split_fields(self.q)[0].shape,
+                                dtype=dtype)]
+        self.has_speeds = False
+
+        # Residual evaluation procedure
+        self.keywords = {'residual': self.matrix_free_residual}
+        self.L = None
+        self.Lhat = None
+        self.viscosity = None
+        self.cfl_scale = 1.0
+
+        # The assembled operators are built for the whole domain
+        if method in ('assembled', 'spectral') and solution.comm is not None:
+            print('\tThe {0:s} residual is not available in distributed runs.'.format(method))
+            method = ''
+
+        if method == 'assembled':
+            if solution.keywords['system'] == 'advection':
+                print('\tAssembling the residual operator.')
+                self.L = self.assemble(solution)
+                self.keywords['residual'] = self.assembled_residual
+            else:
+                print('\tThe assembled residual is only available for advection.')
+
+        elif method == 'spectral':
+            if (solution.keywords['system'] == 'advection' and
+                    solution.bc_l == 'periodic' and solution.bc_r == 'periodic'):
+                print('\tBlock diagonalizing the residual operator.')
+                self.L = self.assemble(solution)
+                self.Lhat = self.block_diagonalize(self.L, solution)
+                self.keywords['residual'] = self.spectral_residual
+            else:
+                print('\tThe spectral residual is only available for periodic advection.')
+
+        elif threads > 1 and limiting.startswith('artificial_viscosity'):
+            print('\tThe threaded residual is not available with artificial viscosity.')
+
+        elif threads > 1:
+            print('\tThreaded residual with {0:d} threads.'.format(threads))
+            self.setup_chunks(solution)
+            self.pool = ThreadPoolExecutor(max_workers=threads)
+            self.keywords['residual'] = self.threaded_residual
+
+        # Artificial viscosity (instead of limiting):
+        # artificial_viscosity [br1|ldg] [coefficient]
+        if limiting.startswith('artificial_viscosity'):
+            self.setup_viscosity(solution, limiting.split()[1:])
 
     # ========================================================================
     def residual(self, solution):
+        """Calculates the residual by calling the right procedure"""
+        return self.keywords['residual'](solution)
+
+    # ========================================================================
+    def matrix_free_residual(self, solution):
         """Calculates the residual for the DG method
 
         residual = Minv*(Q+F)
 
         where Minv is the inverse mass matrix, Q is the edge fluxes, F
-        is the interior flux.
+        is the interior flux. Minv is folded into the operators that
+        integrate the interior and edge fluxes so there is no separate
+        pass for it.
+
+        All the intermediate results are stored in the pre-allocated
+        work arrays so the returned array is overwritten at the next
+        call.
 
         """
 
@@ -42,53 +122,406 @@ class DG:
         solution.apply_bc()
 
         # Collocate the solution to the Gaussian nodes
-        self.ug = solution.collocate()
+        solution.collocate(out=self.ug)
 
         # Evaluate the solution at the cell face
-        self.uf = solution.evaluate_faces()
+        solution.evaluate_faces(out=self.uf)
 
         # Evaluate the interior fluxes
-        self.F = solution.interior_flux(self.ug)
+        Fg = solution.interior_flux(self.ug, out=self.Fg,
+                                    w=solution.node_primitives(self.ug))
 
         # Integrate the interior fluxes
-        self.integrate_interior_flux(solution.basis.dphi_w)
+        self.integrate_interior_flux(solution.scaled_dphi_w, Fg)
 
         # Evaluate the edge fluxes
-        self.q = solution.riemann(self.uf[1, :-solution.N_F],  # left
-                                  self.uf[0, solution.N_F:])  # right
+        wl, wr = solution.face_primitives(self.uf)
+        solution.riemann(self.uf[..., 1, :-solution.stride],  # left
+                         self.uf[..., 0, solution.stride:],  # right
+                         out=self.q, speeds=self.speeds[0], wl=wl, wr=wr)
+        self.has_speeds = True
+
+        # Add the viscous fluxes (if there is artificial viscosity)
+        if self.viscosity is not None:
+            self.add_viscous_fluxes(solution)
 
         # Add the interior and edge fluxes
-        self.add_interior_face_fluxes(solution.N_F)
+        self.add_interior_face_fluxes(solution.stride, solution.scaled_minv)
+
+        return self.F
+
+    # ========================================================================
+    def setup_viscosity(self, solution, params):
+        """Set up the sensor driven artificial viscosity
+
+        The viscosity is coefficient * (largest wave speed) * dx / p
+        in the elements flagged by the sensors (everywhere without
+        sensors), zero elsewhere. The gradient and the viscous fluxes
+        use the interface values of BR1 (both averaged) or LDG (the
+        solution from the left, the viscous flux from the right).
+        """
+
+        if self.keywords['residual'] != self.matrix_free_residual:
+            print('\tArtificial viscosity uses the matrix-free residual.')
+            self.keywords['residual'] = self.matrix_free_residual
+
+        self.viscous_scheme = 'ldg' if 'ldg' in params else 'br1'
+        numbers = [float(x) for x in params if x not in ('br1', 'ldg')]
+        self.viscosity = numbers[0] if numbers else 0.5
+        print('\tArtificial viscosity ({0:s}, coefficient {1:g}).'.format(
+            self.viscous_scheme.upper(), self.viscosity))
+
+        # Derivative of the solution at the Gaussian nodes, integrated
+        # against the basis gradients (it does not need the nodal
+        # values)
+        self.K = np.matmul(solution.scaled_dphi_w, solution.basis.phi)
+
+        # Work arrays: minus the gradient (and times the viscosity),
+        # their face values and the face gradients
+        shape = solution.u.shape
+        s = solution.stride
+        dtype = solution.u.dtype
+        self.G = np.zeros(shape, dtype=dtype)
+        self.W = np.zeros(shape, dtype=dtype)
+        self.wf = np.zeros(self.uf.shape, dtype=dtype)
+        self.g = np.zeros(self.q.shape, dtype=dtype)
+        self.nu = np.zeros(shape[:-2] + (shape[-1],), dtype=dtype)
 
-        # Multiply by the inverse mass matrix
-        self.inverse_mass_matrix_multiply(solution.scaled_minv)
+        # The viscosity adds (2p+1) nu/dx to the wave speed of the
+        # time step (twice that for the one-sided LDG fluxes), with nu
+        # at most coefficient * speed * dx / p
+        p = max(solution.basis.p, 1)
+        factor = 2 if self.viscous_scheme == 'ldg' else 1
+        self.cfl_scale = 1.0 / (1 + factor * self.viscosity * (2 * p + 1) / p)
+
+    # ========================================================================
+    def add_viscous_fluxes(self, solution):
+        """Adds the artificial viscosity fluxes to the interior and face fluxes
+
+        With G = -du/dx (from the weak form, like the interior and
+        edge fluxes) and the viscosity nu of each element, the flux of
+        the viscous term d/dx(nu du/dx) is nu G.
+        """
+
+        s = solution.stride
+        ul = self.uf[..., 1, :-s]
+        ur = self.uf[..., 0, s:]
+
+        # Viscosity of each element
+        self.element_viscosity(solution)
+
+        # Minus the gradient in the elements: G = K u - lift(u_hat)
+        np.matmul(self.K, solution.u, out=self.G)
+        if self.viscous_scheme == 'br1':
+            np.add(ul, ur, out=self.g)
+            self.g *= 0.5
+        else:
+            self.g[...] = ul
+        lift_face_fluxes(self.G[..., s:-s], self.g, self.Q, s,
+                         solution.scaled_minv)
+
+        # Viscous flux (the ghost cells get it from the boundary
+        # conditions). Loop on the modes so that numpy does not need
+        # temporary buffers for the broadcast viscosity.
+        for i in range(self.W.shape[-2]):
+            np.multiply(self.G[..., i, :], self.nu, out=self.W[..., i, :])
+        solution.fill_ghosts(self.W)
+
+        # Add it to the interior and face fluxes (the gradient storage
+        # is free again)
+        np.matmul(self.K, self.W, out=self.G)
+        self.F += self.G
+        np.matmul(solution.basis.psi, self.W, out=self.wf)
+        if self.viscous_scheme == 'br1':
+            np.add(self.wf[..., 1, :-s], self.wf[..., 0, s:], out=self.g)
+            self.g *= 0.5
+            self.q += self.g
+        else:
+            self.q += self.wf[..., 0, s:]
+
+    # ========================================================================
+    def element_viscosity(self, solution):
+        """Sets the artificial viscosity of each element from the sensors"""
+
+        # The largest wave speed over the whole domain (all the ranks)
+        fields = solution.split_fields(self.nu)
+        speed = np.asarray(parallel.global_max(
+            solution.comm, solution.max_wave_speed()))[..., np.newaxis]
+        fields[0][...] = self.viscosity * speed * solution.dx / max(solution.basis.p, 1)
+        if solution.issensing:
+            solution.sensors.sensing(solution)
+            np.copyto(fields[0], 0, where=solution.sensors.sensors == 0)
+
+        for f in fields[1:]:
+            f[...] = fields[0]
+
+    # ========================================================================
+    def max_speed(self):
+        """Returns the largest signal speed of the last residual evaluation
+
+        There is one for each ensemble member. Returns None if no
+        residual evaluation went through the Riemann solver yet.
+        """
+        if not self.has_speeds:
+            return None
+        return np.max([np.max(speeds, axis=-1) for speeds in self.speeds],
+                      axis=0)
+
+    # ========================================================================
+    def setup_chunks(self, solution):
+        """Split the elements into chunks for the threaded residual
+
+        Each chunk holds the columns (last axis) of its elements for
+        the volume work. Its face fluxes go in its own storage, with
+        one face of overlap with the previous chunk, so that the
+        chunks never write to the same memory.
+        """
+
+        s = solution.stride
+        M = solution.u.shape[-1]
+        element_bytes = solution.u.nbytes // (solution.N_E + 2)
+        size = max(1, CHUNK_BYTES // element_bytes)
+
+        self.chunks = []
+        for a in range(1, solution.N_E + 1, size):
+            b = min(a + size, solution.N_E + 1)
+
+            # Interior columns of the chunk and columns for the
+            # volume work (the ghost cells go with the end chunks)
+            cols = slice(a * s, b * s)
+            volume = slice(0 if a == 1 else a * s,
+                           M if b == solution.N_E + 1 else b * s)
+            q = np.zeros(self.q.shape[:-1] + ((b - a + 1) * s,),
+                         dtype=self.q.dtype)
+            Q = np.zeros(self.Q.shape[:-1] + ((b - a) * s,),
+                         dtype=self.Q.dtype)
+            speeds = np.zeros(solution.split_fields(q)[0].shape,
+                              dtype=self.q.dtype)
+            self.chunks.append((cols, volume, q, Q, speeds))
+        self.speeds = [chunk[-1] for chunk in self.chunks]
+
+    # ========================================================================
+    def threaded_residual(self, solution):
+        """Calculates the residual for the DG method with threads
+
+        Same as the matrix-free residual but each step works on chunks
+        of elements in parallel (numpy releases the GIL in its
+        kernels). The face values are needed by the neighboring chunks
+        so the face fluxes only start once all the volume work is done.
+        """
+
+        # Apply boundary conditions
+        solution.apply_bc()
+
+        # The enhanced face values need the neighbors (and the
+        # enhancement scratch storage is shared)
+        enhanced = solution.keywords['evaluate_face_solution'] == solution.enhanced_faces
+        if enhanced:
+            solution.evaluate_faces(out=self.uf)
+
+        def volume(chunk):
+            cols, v, q, Q, speeds = chunk
+            np.matmul(solution.basis.phi, solution.u[..., v], out=self.ug[..., v])
+            if not enhanced:
+                np.matmul(solution.basis.psi, solution.u[..., v],
+                          out=self.uf[..., v])
+            # (the advection flux is the solution itself, so use the
+            # returned array rather than the storage)
+            ug = self.ug[..., v]
+            w = solution.node_primitives(ug, ('nodes', v.start))
+            Fg = solution.interior_flux(ug, out=self.Fg[..., v], w=w)
+            np.matmul(solution.scaled_dphi_w, Fg, out=self.F[..., v])
+
+        def faces(chunk):
+            cols, v, q, Q, speeds = chunk
+            s = solution.stride
+            uf = self.uf[..., cols.start - s:cols.stop + s]
+            wl, wr = solution.face_primitives(uf, ('faces', cols.start))
+            solution.riemann(uf[..., 1, :-s], uf[..., 0, s:], out=q,
+                             first=cols.start // s - 1, speeds=speeds,
+                             wl=wl, wr=wr)
+            lift_face_fluxes(self.F[..., cols], q, Q, s, solution.scaled_minv)
+
+        list(self.pool.map(volume, self.chunks))
+        list(self.pool.map(faces, self.chunks))
+        self.has_speeds = True
 
         return self.F
 
     # ========================================================================
-    def integrate_interior_flux(self, D):
-        """Integrates the interior fluxes F, given the basis gradients, D"""
-        self.F = np.dot(D, self.F)
+    def assembled_residual(self, solution):
+        """Calculates the residual with the assembled operator
+
+        One sparse matrix product for the whole domain (one column
+        per ensemble member).
+        """
+
+        # Keep the ghost cells up to date (the operator does not need
+        # them but the limiter does)
+        solution.apply_bc()
+
+        U = np.reshape(solution.u, (-1, self.L.shape[1])).T
+        self.F[...] = np.reshape((self.L @ U).T, self.F.shape)
+
+        return self.F
 
     # ========================================================================
-    def add_interior_face_fluxes(self, N_F):
-        """Adds the face flux contributions to the interior fluxes.
+    def spectral_residual(self, solution):
+        """Calculates the residual with the block diagonalized operator"""
+
+        # Keep the ghost cells up to date (for the limiter)
+        solution.apply_bc()
+
+        self.spectral_multiply(solution, self.Lhat, self.F)
+        return self.F
+
+    # ========================================================================
+    def spectral_multiply(self, solution, blocks, out):
+        """Multiplies the solution by a block circulant operator
+
+        The operator is given by its (N_s x N_s) blocks for each
+        wavenumber of the FFT along the elements. The result is
+        stored in out (ghost cells are set to zero).
+        """
+
+        N_s = solution.basis.N_s
+        N_E = solution.N_E
+        u = np.reshape(solution.u, (-1, N_s, N_E + 2))[..., 1:-1]
+        uhat = np.fft.rfft(u, axis=-1)
+        Fhat = np.einsum('kmi,...ik->...mk', blocks, uhat)
+
+        F = np.reshape(out, (-1, N_s, N_E + 2))
+        F[..., 1:-1] = np.fft.irfft(Fhat, n=N_E, axis=-1)
+        F[..., 0] = 0.0
+        F[..., -1] = 0.0
+
+    # ========================================================================
+    def block_diagonalize(self, L, solution):
+        """Returns the (N_s x N_s) blocks of a block circulant operator
 
+        On a periodic uniform mesh, the residual operator is the same
+        for each element and its neighbors. The FFT along the elements
+        therefore decouples it into one block per wavenumber (only the
+        non-negative wavenumbers of a real FFT are kept).
         """
 
-        # The edge flux matrix alternates the difference and sum (because
-        # of that (A-1)^m factor)
-        self.Q[::2, ] = self.q[N_F:] - self.q[:-N_F]
-        self.Q[1::2, ] = self.q[:-N_F] + self.q[N_F:]
+        N_s = solution.basis.N_s
+        N_E = solution.N_E
+        shape = (N_s, N_E + 2)
+        modes = np.arange(N_s)
+        k = np.arange(N_E // 2 + 1)
+
+        # Response of the first element to the modes of each element
+        rows = np.ravel_multi_index((modes, np.ones(N_s, dtype=int)), shape)
+        Lhat = np.zeros((len(k), N_s, N_s), dtype=complex)
+        for c in np.unique([0, 1 % N_E, N_E - 1]):
+            cols = np.ravel_multi_index((modes, np.full(N_s, 1 + c)), shape)
+            block = L[rows, :][:, cols].toarray()
+            Lhat += block * np.exp(2j * np.pi * c * k / N_E)[:, None, None]
 
-        # Only add to the inside of the flux matrices (ignore the ghost
-        # fluxes)
-        self.F[:, N_F:-N_F] -= self.Q
+        return Lhat
 
     # ========================================================================
-    def inverse_mass_matrix_multiply(self, minv):
-        """Returns the multiplication of the total fluxes by the inverse mass matrix
+    def assemble(self, solution):
+        """Returns the residual operator of a linear problem as a sparse matrix
 
-        Implementation idea from http://stackoverflow.com/questions/18522216/multiplying-across-in-a-numpy-array        
+        The matrix acts on the raveled solution of one ensemble member
+        (ghost cells included, though their columns and rows are
+        empty: the boundary conditions are built into the matrix).
+
+        It is obtained by probing the matrix-free residual. An element
+        only interacts with its neighbors so we can perturb a mode in
+        every third element at once and still know which perturbation
+        caused each response. The leftover elements, when N_E is not a
+        multiple of 3, get their own colors to account for periodicity.
         """
-        self.F = np.einsum('ij,i->ij', self.F, minv)
+
+        N_s = solution.basis.N_s
+        N_E = solution.N_E
+        shape = (N_s, N_E + 2)
+
+        # Color the elements
+        color = np.arange(N_E) % 3
+        r = N_E % 3
+        if r:
+            color[-r:] = 3 + np.arange(r)
+
+        # Left neighbor, self, right neighbor of each element
+        e = np.arange(N_E)
+        neighbors = np.array([np.roll(e, 1), e, np.roll(e, -1)])
+
+        probe = solution.copy()
+        u = probe.split_fields(probe.u)[0]
+        rows, cols, vals = [], [], []
+        for c in range(np.max(color) + 1):
+
+            # For each element, the neighbor which has this color
+            match = color[neighbors] == c
+            j = np.nonzero(np.any(match, axis=0))[0]
+            src = neighbors[np.argmax(match, axis=0), e][j]
+
+            for i in range(N_s):
+
+                # Perturb mode i in all the elements of this color
+                u[...] = 0
+                u[..., i, 1 + np.nonzero(color == c)[0]] = 1.0
+                res = np.reshape(self.matrix_free_residual(probe),
+                                 (-1,) + shape)[0]
+
+                # Store the response of each mode in each element
+                for m in range(N_s):
+                    rows.append(np.ravel_multi_index((m, 1 + j), shape))
+                    cols.append(np.ravel_multi_index((i, 1 + src), shape))
+                    vals.append(res[m, 1 + j])
+
+        n = N_s * (N_E + 2)
+        L = sparse.csr_matrix((np.concatenate(vals),
+                               (np.concatenate(rows), np.concatenate(cols))),
+                              shape=(n, n))
+        L.eliminate_zeros()
+        return L
+
+    # ========================================================================
+    def integrate_interior_flux(self, D, Fg):
+        """Integrates the interior fluxes Fg, given the basis gradients, D"""
+        np.matmul(D, Fg, out=self.F)
+
+    # ========================================================================
+    def add_interior_face_fluxes(self, N_F, lift):
+        """Adds the face flux contributions to the interior fluxes.
+
+        N_F is the offset between neighboring elements along the last
+        axis of the fluxes. The contribution to each mode is scaled by
+        lift (the scaled inverse mass matrix).
+        """
+
+        # Only add to the inside of the flux matrices (ignore the
+        # ghost fluxes)
+        lift_face_fluxes(self.F[..., N_F:-N_F], self.q, self.Q, N_F, lift)
+
+
+# ========================================================================
+def lift_face_fluxes(F, q, Q, N_F, lift):
+    """Adds the face fluxes q to the fluxes F of the elements between them
+
+    q holds one more face than there are elements in F. Q is a work
+    array of the same shape as F.
+    """
+
+    N_s = Q.shape[-2]
+    ql = q[..., :-N_F]
+    qr = q[..., N_F:]
+
+    # The edge flux matrix alternates the difference and sum
+    # (because of that (A-1)^m factor). Compute them once in the
+    # first two modes.
+    np.subtract(qr, ql, out=Q[..., 0, :])
+    if N_s > 1:
+        np.add(ql, qr, out=Q[..., 1, :])
+
+    # Loop on the modes (so that numpy operates on rows and does
+    # not need temporary buffers). Go backwards so the difference
+    # and sum are only overwritten at the end.
+    for i in reversed(range(N_s)):
+        np.multiply(Q[..., i % 2, :], lift[i], out=Q[..., i, :])
+        F[..., i, :] -= Q[..., i, :]
@@ -18,7 +18,8 @@ class Enhance:
     'Generate enhancement procedures'
 
     # ========================================================================
-    def __init__(self, solution_order, method, solution_size):
+    def __init__(self, solution_order, method, solution_size, leading_shape=(),
+                 dtype=np.float64):
 
         print("Generating the enhancement procedure.")
 
@@ -39,23 +40,44 @@ class Enhance:
         A, Ainv, B, Binv = enhancement_matrices(solution_order, self.modes)
         self.alphaL, self.alphaR, self.betaL, self.betaR = left_enhancement_vectors(
             Ainv, Binv, solution_order, self.modes, self.basis.psi)
+        self.alphaL, self.alphaR, self.betaL, self.betaR = [
+            v.astype(dtype) for v in (self.alphaL, self.alphaR, self.betaL, self.betaR)]
 
-        # Pre-allocated storage of the face values
-        self.uf_tmp = np.zeros((2, solution_size))
+        # Pre-allocated storage of the face values (leading_shape
+        # holds any axes in front of the modes, e.g. the fields in a
+        # field_major layout)
+        self.uf_tmp = np.zeros(tuple(leading_shape) + (2, solution_size),
+                               dtype=dtype)
+
+        # Scratch storage for the contribution of the neighbors
+        # (allocated on the first call to face_value)
+        self.neighbors = None
 
     # ========================================================================
-    def face_value(self, u, N_F):
-        """Calculates the value of the enhanced solution at the faces"""
+    def face_value(self, u, N_F, out=None):
+        """Calculates the value of the enhanced solution at the faces
+
+        N_F is the offset between neighboring elements along the last
+        axis of u. If out is given, the face values are stored in it.
+        """
+        uf = self.uf_tmp if out is None else out
+        ul = u[..., :-N_F]
+        ur = u[..., N_F:]
+        shape = ul.shape[:-2] + ul.shape[-1:]
+        if self.neighbors is None or self.neighbors.shape != shape:
+            self.neighbors = np.zeros(shape, dtype=uf.dtype)
 
         # Faces at j-1/2
-        self.uf_tmp[0, N_F:] = np.dot(
-            self.betaL, u[:, :-N_F]) + np.dot(self.betaR, u[:, N_F:])
+        np.matmul(self.betaL, ul, out=uf[..., 0, N_F:])
+        np.matmul(self.betaR, ur, out=self.neighbors)
+        uf[..., 0, N_F:] += self.neighbors
 
         # Faces at j+1/2
-        self.uf_tmp[
-            1, :-N_F] = np.dot(self.alphaL, u[:, :-N_F]) + np.dot(self.alphaR, u[:, N_F:])
+        np.matmul(self.alphaL, ul, out=uf[..., 1, :-N_F])
+        np.matmul(self.alphaR, ur, out=self.neighbors)
+        uf[..., 1, :-N_F] += self.neighbors
 
-        return self.uf_tmp
+        return uf
 
 
 # ========================================================================
@@ -0,0 +1,96 @@
+# ========================================================================
+#
+# Imports
+#
+# ========================================================================
+import numpy as np
+import dg1d.helpers as helpers
+import dg1d.euler_physics as euler_physics
+
+# ========================================================================
+#
+# Global variables
+#
+# ========================================================================
+
+# Number of interfaces (or nodes) evaluated at once. The scratch
+# arrays of a block stay in cache.
+BLOCK = 2048
+
+# ========================================================================
+#
+# Function definitions
+#
+# ========================================================================
+
+
+def blocks(n):
+    """Returns the slices of the blocks of the last axis"""
+    return [slice(i, min(i + BLOCK, n)) for i in range(0, n, BLOCK)]
+
+
+# ========================================================================
+def blocked(kernel, fl, fr, fF, wl, wr, speeds):
+    """Calls an in-place interface flux kernel of euler_physics on each block"""
+    for b in blocks(fl[0].shape[-1]):
+        kernel([f[..., b] for f in fl], [f[..., b] for f in fr],
+               [f[..., b] for f in fF],
+               None if wl is None else [w[..., b] for w in wl],
+               None if wr is None else [w[..., b] for w in wr],
+               None if speeds is None else speeds[..., b])
+
+
+# ========================================================================
+def riemann_rusanov(ul, ur, out=None, wl=None, wr=None, speeds=None,
+                    layout='interleaved'):
+    """Returns the Rusanov interface flux for the Euler equations
+
+    Same as euler_physics.riemann_rusanov (same operations in the same
+    order) but one cache-sized block at a time.
+    """
+
+    # Initialize (unless we were given storage)
+    F = np.zeros(ul.shape) if out is None else out
+    blocked(euler_physics.rusanov_flux, helpers.split_fields(ul, 3, layout),
+            helpers.split_fields(ur, 3, layout),
+            helpers.split_fields(F, 3, layout), wl, wr, speeds)
+    return F
+
+
+# ========================================================================
+def riemann_roe(ul, ur, out=None, wl=None, wr=None, speeds=None,
+                layout='interleaved'):
+    """Returns the Roe interface flux for the Euler equations
+
+    Same as euler_physics.riemann_roe (same operations in the same
+    order) but one cache-sized block at a time.
+    """
+
+    # Initialize (unless we were given storage)
+    F = np.zeros(ul.shape) if out is None else out
+    blocked(euler_physics.roe_flux, helpers.split_fields(ul, 3, layout),
+            helpers.split_fields(ur, 3, layout),
+            helpers.split_fields(F, 3, layout), wl, wr, speeds)
+    return F
+
+
+# ========================================================================
+def interior_flux(ug, out=None, w=None, layout='interleaved'):
+    """Returns the interior flux for the Euler equations
+
+    Same as euler_physics.interior_flux (same operations in the same
+    order) but one cache-sized block at a time.
+    """
+
+    # Initialize (unless we were given storage)
+    F = np.zeros(ug.shape) if out is None else out
+
+    fg = helpers.split_fields(ug, 3, layout)
+    fF = helpers.split_fields(F, 3, layout)
+    for b in blocks(fg[0].shape[-1]):
+        euler_physics.physical_flux([f[..., b] for f in fg],
+                                    [f[..., b] for f in fF],
+                                    None if w is None else
+                                    [x[..., b] for x in w[:3]])
+
+    return F
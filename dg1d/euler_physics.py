@@ -4,8 +4,11 @@
 #
 # ========================================================================
 import sys
+import threading
+import weakref
 import numpy as np
 import dg1d.constants as constants
+import dg1d.helpers as helpers
 
 # ========================================================================
 #
@@ -16,67 +19,432 @@ import dg1d.constants as constants
 # ========================================================================
 
 
-def max_wave_speed(u):
-    """Returns the maximum wave speed for the Euler system"""
+def primitives(fields, out=None, enthalpy=True):
+    """Returns the density, velocity, pressure, sound speed and enthalpy
 
-    # Primitive variables
-    rho = u[0, 0::3]
-    v = u[0, 1::3] / rho
-    E = u[0, 2::3]
-    p = (constants.gamma - 1) * (E - 0.5 * rho * v * v)
+    fields are the density, momentum and energy arrays. If out is
+    given (the list returned by a previous call on fields of the same
+    shape), its storage is reused. The density is the one in
+    fields. The enthalpy is None unless requested. The Riemann solvers
+    take them as wl and wr so that kernels working on the same states
+    can share them.
+    """
+
+    rho, rhou, E = fields
+    dtype = np.result_type(rho, np.float32)
+    if out is None or out[1].shape != rho.shape or out[1].dtype != dtype:
+        out = [None] + [np.empty(rho.shape, dtype=dtype)
+                        for _ in range(3)] + [None]
+    if enthalpy and out[4] is None:
+        out[4] = np.empty(rho.shape, dtype=dtype)
+    out[0] = rho
+    r, v, p, a, H = out
+
+    np.divide(rhou, rho, out=v)
+
+    # p = (gamma-1) * (E - 0.5 * rho * v * v)
+    np.multiply(rho, 0.5, out=p)
+    p *= v
+    p *= v
+    np.subtract(E, p, out=p)
+    p *= constants.gamma - 1
+
+    # a = sqrt(gamma * p / rho)
+    np.multiply(p, constants.gamma, out=a)
+    a /= rho
+    np.sqrt(a, out=a)
+
+    # H = (E + p) / rho
+    if enthalpy:
+        np.add(E, p, out=H)
+        H /= rho
+    else:
+        out[4] = None
+
+    return out
+
+# ========================================================================
+
+
+def max_wave_speed(u, w=None, layout='interleaved'):
+    """Returns the maximum wave speed for the Euler system
+
+    w, if given, are the primitive variables of the cell averages.
+    """
+
+    # Primitive variables (from the cell averages)
+    if w is None:
+        w = primitives([f[..., 0, :] for f in helpers.split_fields(u, 3, layout)],
+                       enthalpy=False)
+    rho, v, p, a, H = w
 
     # Get the wave speed
-    wave_speed = np.fabs(v) + np.sqrt(constants.gamma * p / rho)
+    wave_speed = np.fabs(v) + a
 
-    return np.max(wave_speed)
+    # (for each member if this is an ensemble)
+    return np.max(wave_speed, axis=-1)
 
 # ========================================================================
 
 
-def riemann_rusanov(ul, ur):
+def riemann_rusanov(ul, ur, out=None, wl=None, wr=None, speeds=None,
+                    layout='interleaved'):
     """Returns the Rusanov interface flux for the Euler equations
 
     V. V. Rusanov, Calculation of Interaction of Non-Steady Shock Waves with Obstacles, J. Comput. Math. Phys. USSR, 1, pp. 267-279, 1961.
 
     Heavily inspired/taken from "I Do Like CFD" website: http://ossanworld.com/cfdbooks/cfdcodes/oned_euler_fluxes_v5.f90
 
+    If speeds is given, the largest signal speed at each interface
+    is stored in it. layout is the storage layout of the arrays
+    (interleaved or field_major, see helpers.split_fields). The same
+    goes for the other Riemann solvers.
+
     """
 
-    # Initialize
-    F = np.zeros(ul.shape)
+    # Initialize (unless we were given storage)
+    F = np.zeros(ul.shape) if out is None else out
+    rusanov_flux(helpers.split_fields(ul, 3, layout),
+                 helpers.split_fields(ur, 3, layout),
+                 helpers.split_fields(F, 3, layout), wl, wr, speeds)
+    return F
 
-    # Primitive variables and sound speeds
-    rhoL = ul[0::3]
-    vL = ul[1::3] / rhoL
-    EL = ul[2::3]
-    pL = (constants.gamma - 1) * (EL - 0.5 * rhoL * vL * vL)
-    aL = np.sqrt(constants.gamma * pL / rhoL)
 
-    rhoR = ur[0::3]
-    vR = ur[1::3] / rhoR
-    ER = ur[2::3]
-    pR = (constants.gamma - 1) * (ER - 0.5 * rhoR * vR * vR)
-    aR = np.sqrt(constants.gamma * pR / rhoR)
+# ========================================================================
+def rusanov_flux(fl, fr, fF, wl=None, wr=None, speeds=None):
+    """Stores the Rusanov interface flux of the fields fl, fr in fF
+
+    The operations are done in place in scratch storage, so there are
+    no temporaries. The primitive variables are computed in it unless
+    they are given.
+    """
 
-    # Find the maximum eigenvalue for each interface
-    maxvap = np.maximum(np.fabs(vL) + aL, np.fabs(vR) + aR)
+    EL = fl[2]
+    ER = fr[2]
+    F0, F1, F2 = fF
+    t = helpers.scratch(EL.shape, 12, np.result_type(EL, np.float32))
+
+    # Primitive variables and sound speeds (unless we were given them)
+    rhoL, vL, pL, aL, HL = wl if wl is not None else primitives(fl, [None] + t[0:4], False)
+    rhoR, vR, pR, aR, HR = wr if wr is not None else primitives(fr, [None] + t[4:8], False)
+    maxvap, t1, t2, t3 = t[8:12]
+
+    # Maximum eigenvalue: max(|vL| + aL, |vR| + aR)
+    np.fabs(vL, out=t1)
+    t1 += aL
+    np.fabs(vR, out=t2)
+    t2 += aR
+    np.maximum(t1, t2, out=maxvap)
+    if speeds is not None:
+        speeds[...] = maxvap
 
     # first: fx = rho*u
-    F[0::3] = 0.5 * (rhoL * vL + rhoR * vR - maxvap * (rhoR - rhoL))
+    #   0.5 * (rhoL * vL + rhoR * vR - maxvap * (rhoR - rhoL))
+    np.multiply(rhoL, vL, out=t1)
+    np.multiply(rhoR, vR, out=t2)
+    t1 += t2
+    np.subtract(rhoR, rhoL, out=t2)
+    t2 *= maxvap
+    t1 -= t2
+    np.multiply(t1, 0.5, out=F0)
 
     # second: fx = rho*u*u+p
-    F[1::3] = 0.5 * (rhoL * vL * vL + pL + rhoR * vR * vR +
-                     pR - maxvap * (rhoR * vR - rhoL * vL))
+    #   0.5 * (rhoL * vL * vL + pL + rhoR * vR * vR + pR
+    #          - maxvap * (rhoR * vR - rhoL * vL))
+    np.multiply(rhoL, vL, out=t3)
+    np.multiply(t3, vL, out=t1)
+    t1 += pL
+    np.multiply(rhoR, vR, out=t2)
+    t2 *= vR
+    t1 += t2
+    t1 += pR
+    np.multiply(rhoR, vR, out=t2)
+    t2 -= t3
+    t2 *= maxvap
+    t1 -= t2
+    np.multiply(t1, 0.5, out=F1)
 
     # third: fx = (E+p)*u
-    F[2::3] = 0.5 * ((EL + pL) * vL + (ER + pR) * vR - maxvap * (ER - EL))
+    #   0.5 * ((EL + pL) * vL + (ER + pR) * vR - maxvap * (ER - EL))
+    np.add(EL, pL, out=t1)
+    t1 *= vL
+    np.add(ER, pR, out=t2)
+    t2 *= vR
+    t1 += t2
+    np.subtract(ER, EL, out=t2)
+    t2 *= maxvap
+    t1 -= t2
+    np.multiply(t1, 0.5, out=F2)
+
+
+# ========================================================================
+def riemann_godunov(ul, ur, out=None, wl=None, wr=None, speeds=None,
+                    layout='interleaved'):
+    """Returns the Godunov interface flux for the Euler equations
+
+    S. K. Godunov, A Difference Scheme for Numerical Computation of Discontinuous Solution of Hydrodynamic Equations, Math. Sbornik, 47, pp. 271-306, 1959 (in Russian). Translated US Joint Publ. Res. Service, JPRS 7226 (1969)
+
+    Taken from "I Do Like CFD" website: http://ossanworld.com/cfdbooks/cfdcodes/oned_euler_fluxes_v5.f90
+
+    All the interfaces are handled at once: each of them iterates on
+    the star pressure until it converges, and the wave configurations
+    are selected with masks.
+    """
 
+    # Initialize (unless we were given storage)
+    F = np.zeros(ul.shape) if out is None else out
+    godunov_flux(ul, ur, F, wl=wl, wr=wr, speeds=speeds, layout=layout)
     return F
 
 
 # ========================================================================
-def riemann_godunov(ul, ur):
-    """Returns the Godunov interface flux for the Euler equations
+def godunov_flux(ul, ur, F, guess=None, wl=None, wr=None, speeds=None,
+                 layout='interleaved'):
+    """Stores the Godunov interface flux in F
+
+    guess, if given, holds an initial guess of the star pressure at
+    each interface (NaN where there is none). It is only used where
+    the pressure jump is strong: elsewhere the linearized initial
+    solution is already very close. Returns the star pressure at each
+    interface (NaN for the supersonic ones), the number of iterations
+    at each interface and where the guess was used.
+    """
+
+    # Primitive variables and sound speeds (unless we were given them)
+    rhouL, EL = helpers.split_fields(ul, 3, layout)[1:]
+    if wl is None:
+        wl = primitives(helpers.split_fields(ul, 3, layout), enthalpy=False)
+    rhoL, vL, pL, aL, HL = wl
+
+    rhouR, ER = helpers.split_fields(ur, 3, layout)[1:]
+    if wr is None:
+        wr = primitives(helpers.split_fields(ur, 3, layout), enthalpy=False)
+    rhoR, vR, pR, aR, HR = wr
+
+    # Largest signal speed (if requested)
+    if speeds is not None:
+        np.maximum(np.fabs(vL) + aL, np.fabs(vR) + aR, out=speeds)
+
+    # Fluxes for each field
+    F0, F1, F2 = helpers.split_fields(F, 3, layout)
+
+    # Supersonic flow to the right
+    right = vL / aL >= 1.0
+    F0[right] = rhoL[right] * vL[right]
+    F1[right] = rhoL[right] * vL[right] * vL[right] + pL[right]
+    F2[right] = (EL[right] + pL[right]) * vL[right]
+
+    # Supersonic flow to the left
+    left = ~right & (vR / aR <= -1.0)
+    F0[left] = rhoR[left] * vR[left]
+    F1[left] = rhoR[left] * vR[left] * vR[left] + pR[left]
+    F2[left] = (ER[left] + pR[left]) * vR[left]
+
+    # For the other cases, work on the subset of interfaces
+    sub = ~(right | left)
+    rhoL, vL, pL, aL, EL = rhoL[sub], vL[sub], pL[sub], aL[sub], EL[sub]
+    rhoR, vR, pR, aR, ER = rhoR[sub], vR[sub], pR[sub], aR[sub], ER[sub]
+
+    # Initial guess of the pressure in the middle
+    warm = np.zeros(sub.shape, dtype=bool)
+    if guess is not None:
+        warm[sub] = (np.fabs(pL - pR) > 0.1 * (pL + pR)) & ~np.isnan(guess[sub])
+        guess = np.where(warm[sub], guess[sub], np.nan)
+
+    # Pressure and velocity in the middle
+    pm, k = star_pressure(rhoL, vL, pL, aL, rhoR, vR, pR, aR, guess)
+    pstar = np.full(sub.shape, np.nan)
+    pstar[sub] = pm
+    iterations = np.zeros(sub.shape, dtype=int)
+    iterations[sub] = k
+    mL = massflux(rhoL, aL, pL, pm)
+    mR = massflux(rhoR, aR, pR, pm)
+    vm = (mL * vL + mR * vR - (pR - pL)) / (mL + mR)
+
+    # Density in the middle
+    gam = (constants.gamma + 1) / (constants.gamma - 1)
+    rm = []
+    for r, P in [(rhoL, pL), (rhoR, pR)]:
+        shock = pm / P >= 1
+        rm.append(np.where(shock,
+                           r * (1 + gam * pm / P) / (gam + pm / P),
+                           r * (pm / P)**(1.0 / constants.gamma)))
+
+    # Contact wave to the right or left?
+    rmI = np.where(vm >= 0, rm[0], rm[1])
+
+    # Wave speeds at the interface, x/t = 0
+    amL = np.sqrt(constants.gamma * pm / rm[0])
+    amR = np.sqrt(constants.gamma * pm / rm[1])
+    SmL = vm - amL
+    SmR = vm + amR
+
+    # Sonic case
+    Um2 = rmI * vm
+    Um3 = pm / (constants.gamma - 1) + 0.5 * rmI * vm * vm
+
+    # Left and right rarefaction fans through the interface
+    sonic_case = (SmL <= 0) & (SmR >= 0)
+    fanL = ~sonic_case & (SmL > 0) & (vL - aL < 0)
+    fanR = ~sonic_case & ~fanL & (SmR < 0) & (vR + aR > 0)
+    for fan, v, a, p, am, Sm, S in [(fanL, vL, aL, pL, amL, SmL, vL - aL),
+                                    (fanR, vR, aR, pR, amR, SmR, vR + aR)]:
+        rmI[fan], Um2[fan], Um3[fan] = sonic(v[fan], a[fan], p[fan], vm[fan],
+                                             am[fan], S[fan], Sm[fan])
+
+    # Compute the flux: evaluate the physical flux at the interface
+    # (middle)
+    pm = (constants.gamma - 1) * (Um3 - 0.5 * Um2 * Um2 / rmI)
+    F0[sub] = Um2                        # first: fx = rho*u
+    F1[sub] = Um2 * Um2 / rmI + pm       # second: fx = rho*u*u+p
+    F2[sub] = (Um3 + pm) * Um2 / rmI     # third: fx = (E+p)*u
+
+    return pstar, iterations, warm
+
+
+# ========================================================================
+def star_pressure(rhoL, vL, pL, aL, rhoR, vR, pR, aR, guess=None):
+    """Returns the pressure in the middle of the Riemann problems
+
+    Fixed point iteration on the mass fluxes (i.e., find the
+    intersection of the two nonlinear integral curves). Each interface
+    stops iterating once it has converged. The iteration starts from
+    guess where it is given (and not NaN). Also returns the number of
+    iterations of each interface.
+    """
+
+    # Fixed point iteration tolerance
+    tol = 1e-6
+    kmax = 100
+
+    # Initial solution: (intersection of two linearized integral curves,
+    # which is actually the upper bound of the solution.)
+    pm1 = ((0.5 * (vL - vR) * (constants.gamma - 1) + aL + aR) /
+           (aL * pL**((1 - constants.gamma) / constants.gamma * 0.5) +
+            aR * pR**((1 - constants.gamma) / constants.gamma * 0.5)))**(2 * constants.gamma / (constants.gamma - 1))
+    if guess is not None:
+        pm1 = np.where(np.isnan(guess), pm1, guess)
+
+    # Always iterate in double precision
+    pm1 = pm1.astype(np.float64)
+    pm2 = np.copy(pm1)
+
+    # Interfaces that are still iterating
+    idx = np.arange(pm1.size)
+    iterations = np.zeros(pm1.shape, dtype=int)
+    for k in range(kmax + 2):
+        iterations[idx] += 1
+
+        mL = massflux(rhoL[idx], aL[idx], pL[idx], pm1[idx])
+        mR = massflux(rhoR[idx], aR[idx], pR[idx], pm1[idx])
+        pm2[idx] = (mL * pR[idx] + mR * pL[idx] - mL *
+                    mR * (vR[idx] - vL[idx])) / (mL + mR)
+
+        # Test for fixed point convergence
+        converged = np.fabs(pm2[idx] - pm1[idx]) < tol
+        idx = idx[~converged]
+        if idx.size == 0:
+            break
+
+        # Test for max iterations
+        if (k + 1 > kmax):
+            sys.exit(
+                "Godunov fixed-point iteration did not converge. Exiting.")
+
+        # Set old value to new value
+        pm1[idx] = pm2[idx]
+
+    return pm2, iterations
+
+
+# ========================================================================
+class WarmGodunov:
+    'Godunov interface flux warm started from the previous star pressures'
+
+    # ========================================================================
+    def __init__(self):
+
+        # Last converged star pressures for each set of interfaces,
+        # identified by the flux storage (out) of the caller: id(out)
+        # -> (weak reference to out, star pressures). The entries go
+        # away with the storage.
+        self.guesses = {}
+
+        # Number of interfaces and iterations with and without the
+        # warm start (reentrant: a freed storage can drop its guesses
+        # from a garbage collection while the lock is held)
+        self.lock = threading.RLock()
+        self.counts = {'cold': [0, 0], 'warm': [0, 0]}
+
+    # ========================================================================
+    def __call__(self, ul, ur, out=None, wl=None, wr=None, speeds=None,
+                 layout='interleaved'):
+        """Returns the Godunov interface flux (same as riemann_godunov)
+
+        The warm start needs the caller to keep the same flux storage
+        (out) for the same interfaces. Without it, the iteration starts
+        cold. The guesses are dropped when the number of interfaces
+        changes.
+        """
+
+        F = np.zeros(ul.shape) if out is None else out
+        guess = self.guess(out, helpers.split_fields(F, 3, layout)[0].shape)
+        pstar, iterations, warm = godunov_flux(ul, ur, F, guess, wl, wr, speeds,
+                                              layout)
+        if out is not None:
+            with self.lock:
+                entry = self.guesses.get(id(out))
+                if entry is None or entry[0]() is not out:
+                    key = id(out)
+                    ref = weakref.ref(out, lambda r: self.forget(key, r))
+                else:
+                    ref = entry[0]
+                self.guesses[id(out)] = (ref, pstar)
+
+        cold = ~warm & ~np.isnan(pstar)
+        with self.lock:
+            for name, mask in [('warm', warm), ('cold', cold)]:
+                self.counts[name][0] += np.count_nonzero(mask)
+                self.counts[name][1] += np.sum(iterations[mask])
+
+        return F
+
+    # ========================================================================
+    def guess(self, out, shape):
+        """Returns the star pressures of the last call with the same storage
+
+        None if there are none (or the number of interfaces changed).
+        """
+        if out is None:
+            return None
+        with self.lock:
+            entry = self.guesses.get(id(out))
+        if entry is None or entry[0]() is not out or entry[1].shape != shape:
+            return None
+        return entry[1]
+
+    # ========================================================================
+    def forget(self, key, ref):
+        """Drops the guesses of a flux storage which was freed"""
+        with self.lock:
+            entry = self.guesses.get(key)
+            if entry is not None and entry[0] is ref:
+                del self.guesses[key]
+
+    # ========================================================================
+    def report(self):
+        """Prints the average number of star pressure iterations"""
+        (nw, kw), (nc, kc) = self.counts['warm'], self.counts['cold']
+        print("\tGodunov star pressure iterations per interface: {0:.2f} for {1:d} warm starts, {2:.2f} for {3:d} cold starts".format(
+            kw / max(nw, 1), nw, kc / max(nc, 1), nc))
+
+
+# ========================================================================
+def riemann_godunov_loop(ul, ur, out=None, layout='interleaved'):
+    """Returns the Godunov interface flux, one interface at a time
+
+    Reference implementation of riemann_godunov (slow, kept for
+    testing and benchmarking).
 
     S. K. Godunov, A Difference Scheme for Numerical Computation of Discontinuous Solution of Hydrodynamic Equations, Math. Sbornik, 47, pp. 271-306, 1959 (in Russian). Translated US Joint Publ. Res. Service, JPRS 7226 (1969)
 
@@ -84,43 +452,44 @@ def riemann_godunov(ul, ur):
 
     """
 
-    # Initialize
-    F = np.zeros(ul.shape)
+    # Initialize (unless we were given storage)
+    F = np.zeros(ul.shape) if out is None else out
 
     # Primitive variables and sound speeds
-    rhoL = ul[0::3]
-    vL = ul[1::3] / rhoL
-    EL = ul[2::3]
+    rhoL, rhouL, EL = helpers.split_fields(ul, 3, layout)
+    vL = rhouL / rhoL
     pL = (constants.gamma - 1) * (EL - 0.5 * rhoL * vL * vL)
     aL = np.sqrt(constants.gamma * pL / rhoL)
 
-    rhoR = ur[0::3]
-    vR = ur[1::3] / rhoR
-    ER = ur[2::3]
+    rhoR, rhouR, ER = helpers.split_fields(ur, 3, layout)
+    vR = rhouR / rhoR
     pR = (constants.gamma - 1) * (ER - 0.5 * rhoR * vR * vR)
     aR = np.sqrt(constants.gamma * pR / rhoR)
 
+    # Fluxes for each field
+    F0, F1, F2 = helpers.split_fields(F, 3, layout)
+
     # Fixed point iteration tolerance
     tol = 1e-6
 
-    # Loop over each interface
-    for i in range(len(rhoL)):
+    # Loop over each interface (of each ensemble member)
+    for i in np.ndindex(rhoL.shape):
 
         # Supersonic flow to the right
         if (vL[i] / aL[i] >= 1.0):
-            F[i * 3 + 0] = rhoL[i] * vL[i]                 # first: fx = rho*u
-            F[i * 3 + 1] = rhoL[i] * vL[i] * vL[i] + \
+            F0[i] = rhoL[i] * vL[i]                 # first: fx = rho*u
+            F1[i] = rhoL[i] * vL[i] * vL[i] + \
                 pL[i]     # second: fx = rho*u*u+p
             # third: fx = (E+p)*u
-            F[i * 3 + 2] = (EL[i] + pL[i]) * vL[i]
+            F2[i] = (EL[i] + pL[i]) * vL[i]
 
         # Supersonic flow to the left
         elif (vR[i] / aR[i] <= -1.0):
-            F[i * 3 + 0] = rhoR[i] * vR[i]                 # first: fx = rho*u
-            F[i * 3 + 1] = rhoR[i] * vR[i] * vR[i] + \
+            F0[i] = rhoR[i] * vR[i]                 # first: fx = rho*u
+            F1[i] = rhoR[i] * vR[i] * vR[i] + \
                 pR[i]     # second: fx = rho*u*u+p
             # third: fx = (E+p)*u
-            F[i * 3 + 2] = (ER[i] + pR[i]) * vR[i]
+            F2[i] = (ER[i] + pR[i]) * vR[i]
 
         # for the other cases
         else:
@@ -198,9 +567,9 @@ def riemann_godunov(ul, ur):
             # Compute the flux: evaluate the physical flux at the interface
             # (middle)
             pm = (constants.gamma - 1) * (Um3 - 0.5 * Um2 * Um2 / rmI)
-            F[i * 3 + 0] = Um2                  # first: fx = rho*u
-            F[i * 3 + 1] = Um2 * Um2 / rmI + pm     # second: fx = rho*u*u+p
-            F[i * 3 + 2] = (Um3 + pm) * Um2 / rmI  # third: fx = (E+p)*u
+            F0[i] = Um2                  # first: fx = rho*u
+            F1[i] = Um2 * Um2 / rmI + pm     # second: fx = rho*u*u+p
+            F2[i] = (Um3 + pm) * Um2 / rmI  # third: fx = (E+p)*u
 
     return F
 
@@ -218,10 +587,11 @@ def massflux(r, c, pQ, pm):
     gam1 = 0.5 * (constants.gamma + 1) / constants.gamma
     gam2 = 0.5 * (constants.gamma - 1) / constants.gamma
 
-    if pm / pQ >= 1 - eps:  # eps to avoid zero-division
-        massflux = r * c * np.sqrt(1 + gam1 * (pm / pQ - 1))
-    else:
-        massflux = r * c * gam2 * (1 - pm / pQ) / (1 - (pm / pQ)**gam2)
+    # Works on scalars and arrays (only the relevant branch is kept)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        massflux = np.where(pm / pQ >= 1 - eps,  # eps to avoid zero-division
+                            r * c * np.sqrt(1 + gam1 * (pm / pQ - 1)),
+                            r * c * gam2 * (1 - pm / pQ) / (1 - (pm / pQ)**gam2))
 
     return massflux
 
@@ -248,7 +618,8 @@ def sonic(u1, c1, P1, u2, c2, a1, a2):
 
 
 # ========================================================================
-def riemann_roe(ul, ur):
+def riemann_roe(ul, ur, out=None, wl=None, wr=None, speeds=None,
+                layout='interleaved'):
     """Returns the Roe interface flux for the Euler equations
 
     P. L. Roe, Approximate Riemann Solvers, Parameter Vectors and Difference Schemes, Journal of Computational Physics, 43, pp. 357-372.
@@ -257,104 +628,476 @@ def riemann_roe(ul, ur):
 
     """
 
-    # Initialize
-    F = np.zeros(ul.shape)
+    # Initialize (unless we were given storage)
+    F = np.zeros(ul.shape) if out is None else out
+    roe_flux(helpers.split_fields(ul, 3, layout),
+             helpers.split_fields(ur, 3, layout),
+             helpers.split_fields(F, 3, layout), wl, wr, speeds)
+    return F
 
-    # Primitive variables and sound speeds
-    rhoL = ul[0::3]
-    vL = ul[1::3] / rhoL
-    EL = ul[2::3]
-    pL = (constants.gamma - 1) * (EL - 0.5 * rhoL * vL * vL)
-    aL = np.sqrt(constants.gamma * pL / rhoL)
-    HL = (EL + pL) / rhoL
 
-    rhoR = ur[0::3]
-    vR = ur[1::3] / rhoR
-    ER = ur[2::3]
-    pR = (constants.gamma - 1) * (ER - 0.5 * rhoR * vR * vR)
-    aR = np.sqrt(constants.gamma * pR / rhoR)
-    HR = (ER + pR) / rhoR
+# ========================================================================
+def roe_flux(fl, fr, fF, wl=None, wr=None, speeds=None):
+    """Stores the Roe interface flux of the fields fl, fr in fF
+
+    The operations are done in place in scratch storage, so there are
+    no temporaries. The primitive variables are computed in it unless
+    they are given.
+    """
+
+    EL = fl[2]
+    ER = fr[2]
+    F0, F1, F2 = fF
+    t = helpers.scratch(EL.shape, 22, np.result_type(EL, np.float32))
+    g = constants.gamma
+
+    # Primitive variables and sound speeds (unless we were given them)
+    rhoL, vL, pL, aL, HL = wl if wl is not None else primitives(fl, [None] + t[0:4])
+    rhoR, vR, pR, aR, HR = wr if wr is not None else primitives(fr, [None] + t[4:8])
+    RT, rho, v, H, a, dp, ws0, ws1, ws2, t1, t2, t3, t4, t5 = t[8:22]
+
+    # Roe averages
+    #   RT = sqrt(rhoR / rhoL), rho = RT * rhoL
+    #   v = (vL + RT * vR) / (1 + RT), H = (HL + RT * HR) / (1 + RT)
+    #   a = sqrt((gamma - 1) * (H - 0.5 * v * v)), dp = pR - pL
+    np.divide(rhoR, rhoL, out=RT)
+    np.sqrt(RT, out=RT)
+    np.multiply(RT, rhoL, out=rho)
+    np.add(RT, 1, out=t1)
+    np.multiply(RT, vR, out=v)
+    v += vL
+    v /= t1
+    np.multiply(RT, HR, out=H)
+    H += HL
+    H /= t1
+    np.multiply(v, 0.5, out=a)
+    a *= v
+    np.subtract(H, a, out=a)
+    a *= g - 1
+    np.sqrt(a, out=a)
+    np.subtract(pR, pL, out=dp)
+
+    # Absolute value of Roe eigenvalues: |v - a|, |v|, |v + a|
+    np.subtract(v, a, out=ws0)
+    np.fabs(ws0, out=ws0)
+    np.fabs(v, out=ws1)
+    np.add(v, a, out=ws2)
+    np.fabs(ws2, out=ws2)
+    if speeds is not None:
+        np.maximum(ws0, ws2, out=speeds)
+
+    # Entropy fix: where ws < 0.5 * Da, ws = ws * ws / Da + 0.25 * Da
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for ws, sign in [(ws0, -1), (ws2, 1)]:
+            # Da = max(0, 4 * ((vR + sign * aR) - (vL + sign * aL)))
+            if sign < 0:
+                np.subtract(vR, aR, out=t1)
+                np.subtract(vL, aL, out=t2)
+            else:
+                np.add(vR, aR, out=t1)
+                np.add(vL, aL, out=t2)
+            t1 -= t2
+            t1 *= 4
+            np.maximum(t1, 0, out=t1)
+            np.multiply(ws, ws, out=t2)
+            t2 /= t1
+            np.multiply(t1, 0.25, out=t3)
+            t2 += t3
+            np.multiply(t1, 0.5, out=t3)
+            np.copyto(ws, t2, where=ws < t3)
+
+    # Absolute value of Roe eigenvalues * Roe waves strengths
+    #   ws0 * (dp - rho * a * (vR - vL)) / (2 * a * a)
+    #   ws1 * ((rhoR - rhoL) - dp / (a * a))
+    #   ws2 * (dp + rho * a * (vR - vL)) / (2 * a * a)
+    np.subtract(vR, vL, out=t1)
+    np.multiply(rho, a, out=t2)
+    t2 *= t1
+    np.multiply(a, 2, out=t3)
+    t3 *= a
+    np.subtract(dp, t2, out=t4)
+    ws0 *= t4
+    ws0 /= t3
+    np.add(dp, t2, out=t4)
+    ws2 *= t4
+    ws2 /= t3
+    np.multiply(a, a, out=t3)
+    np.divide(dp, t3, out=t3)
+    np.subtract(rhoR, rhoL, out=t4)
+    t4 -= t3
+    ws1 *= t4
+
+    # The Roe right eigenvectors are (1, v - a, H - v * a), (1, v,
+    # 0.5 * v * v) and (1, v + a, H + v * a)
+
+    # first: fx = rho*u
+    #   0.5 * (rhoL * vL + rhoR * vR) - 0.5 * (ws0_dV0 + ws1_dV1 + ws2_dV2)
+    np.multiply(rhoL, vL, out=t1)
+    np.multiply(rhoR, vR, out=t2)
+    t1 += t2
+    t1 *= 0.5
+    np.add(ws0, ws1, out=t2)
+    t2 += ws2
+    t2 *= 0.5
+    np.subtract(t1, t2, out=F0)
+
+    # second: fx = rho*u*u+p
+    #   0.5 * (rhoL * vL * vL + pL  + rhoR * vR * vR + pR)
+    #   - 0.5 * (ws0_dV0 * (v - a) + ws1_dV1 * v + ws2_dV2 * (v + a))
+    np.multiply(rhoL, vL, out=t1)
+    t1 *= vL
+    t1 += pL
+    np.multiply(rhoR, vR, out=t2)
+    t2 *= vR
+    t1 += t2
+    t1 += pR
+    t1 *= 0.5
+    np.subtract(v, a, out=t2)
+    t2 *= ws0
+    np.multiply(ws1, v, out=t3)
+    t2 += t3
+    np.add(v, a, out=t3)
+    t3 *= ws2
+    t2 += t3
+    t2 *= 0.5
+    np.subtract(t1, t2, out=F1)
+
+    # third: fx = (E+p)*u
+    #   0.5 * ((EL + pL) * vL + (ER + pR) * vR)
+    #   - 0.5 * (ws0_dV0 * (H - v * a) + ws1_dV1 * 0.5 * v * v
+    #            + ws2_dV2 * (H + v * a))
+    np.add(EL, pL, out=t1)
+    t1 *= vL
+    np.add(ER, pR, out=t2)
+    t2 *= vR
+    t1 += t2
+    t1 *= 0.5
+    np.multiply(v, a, out=t5)
+    np.subtract(H, t5, out=t2)
+    t2 *= ws0
+    np.multiply(v, 0.5, out=t3)
+    t3 *= v
+    t3 *= ws1
+    t2 += t3
+    np.add(H, t5, out=t3)
+    t3 *= ws2
+    t2 += t3
+    t2 *= 0.5
+    np.subtract(t1, t2, out=F2)
+
+
+# ========================================================================
+def wave_speed_estimates(rhoL, vL, aL, HL, rhoR, vR, aR, HR):
+    """Returns the smallest and largest signal speeds for HLL-type fluxes
 
-    # Compute Roe averages
+    B. Einfeldt, On Godunov-type methods for gas dynamics, SIAM Journal on Numerical Analysis, 25, pp. 294-318, 1988.
+
+    """
+
+    # Roe averages
     RT = np.sqrt(rhoR / rhoL)
-    rho = RT * rhoL
     v = (vL + RT * vR) / (1 + RT)
     H = (HL + RT * HR) / (1 + RT)
     a = np.sqrt((constants.gamma - 1) * (H - 0.5 * v * v))
-    dp = pR - pL
 
-    # Absolute value of Roe eigenvalues
-    ws0 = np.fabs(v - a)
-    ws1 = np.fabs(v)
-    ws2 = np.fabs(v + a)
+    return np.minimum(vL - aL, v - a), np.maximum(vR + aR, v + a)
 
-    # Entropy fix
-    Da = np.maximum(0, 4 * ((vR - aR) - (vL - aL)))
-    idx = ws0 < 0.5 * Da
-    ws0[idx] = ws0[idx] * ws0[idx] / Da[idx] + 0.25 * Da[idx]
-    Da = np.maximum(0, 4 * ((vR + aR) - (vL + aL)))
-    idx = ws2 < 0.5 * Da
-    ws2[idx] = ws2[idx] * ws2[idx] / Da[idx] + 0.25 * Da[idx]
 
-    # Absolute value of Roe eigenvalues * Roe waves strengths
-    ws0_dV0 = ws0 * (dp - rho * a * (vR - vL)) / (2 * a * a)
-    ws1_dV1 = ws1 * ((rhoR - rhoL) - dp / (a * a))
-    ws2_dV2 = ws2 * (dp + rho * a * (vR - vL)) / (2 * a * a)
+# ========================================================================
+def riemann_hll(ul, ur, out=None, wl=None, wr=None, speeds=None,
+                layout='interleaved'):
+    """Returns the HLL interface flux for the Euler equations
+
+    A. Harten, P. D. Lax, B. van Leer, On Upstream Differencing and Godunov-Type Schemes for Hyperbolic Conservation Laws, SIAM Review, 25, pp. 35-61, 1983.
+
+    """
+
+    # Initialize (unless we were given storage)
+    F = np.zeros(ul.shape) if out is None else out
+
+    # Primitive variables and sound speeds (unless we were given them)
+    rhouL, EL = helpers.split_fields(ul, 3, layout)[1:]
+    if wl is None:
+        wl = primitives(helpers.split_fields(ul, 3, layout))
+    rhoL, vL, pL, aL, HL = wl
 
-    # Roe Right eigenvectors
-    R00 = 1
-    R01 = v - a
-    R02 = H - v * a
+    rhouR, ER = helpers.split_fields(ur, 3, layout)[1:]
+    if wr is None:
+        wr = primitives(helpers.split_fields(ur, 3, layout))
+    rhoR, vR, pR, aR, HR = wr
 
-    R10 = 1
-    R11 = v
-    R12 = 0.5 * v * v
+    # Signal speeds (clipped so that the supersonic cases reduce to
+    # the upwind flux)
+    SL, SR = wave_speed_estimates(rhoL, vL, aL, HL, rhoR, vR, aR, HR)
+    if speeds is not None:
+        np.maximum(-SL, SR, out=speeds)
+    SL = np.minimum(SL, 0)
+    SR = np.maximum(SR, 0)
+    idS = 1.0 / (SR - SL)
 
-    R20 = 1
-    R21 = v + a
-    R22 = H + v * a
+    # Fluxes for each field
+    F0, F1, F2 = helpers.split_fields(F, 3, layout)
 
     # first: fx = rho*u
-    F[0::3] = 0.5 * (rhoL * vL + rhoR * vR) \
-        - 0.5 * (ws0_dV0 * R00 +
-                 ws1_dV1 * R10 +
-                 ws2_dV2 * R20)
+    F0[...] = (SR * rhouL - SL * rhouR + SL * SR * (rhoR - rhoL)) * idS
 
     # second: fx = rho*u*u+p
-    F[1::3] = 0.5 * (rhoL * vL * vL + pL  + rhoR * vR * vR + pR) \
-        - 0.5 * (ws0_dV0 * R01 +
-                 ws1_dV1 * R11 +
-                 ws2_dV2 * R21)
+    F1[...] = (SR * (rhouL * vL + pL) - SL * (rhouR * vR + pR) +
+               SL * SR * (rhouR - rhouL)) * idS
 
     # third: fx = (E+p)*u
-    F[2::3] =  0.5 * ((EL + pL) * vL + (ER + pR) * vR) \
-        - 0.5 * (ws0_dV0 * R02 +
-                 ws1_dV1 * R12 +
-                 ws2_dV2 * R22)
+    F2[...] = (SR * (EL + pL) * vL - SL * (ER + pR) * vR +
+               SL * SR * (ER - EL)) * idS
 
     return F
 
 
 # ========================================================================
-def interior_flux(ug):
-    """Returns the interior flux for the Euler equations"""
+def riemann_hllc(ul, ur, out=None, wl=None, wr=None, speeds=None,
+                 layout='interleaved'):
+    """Returns the HLLC interface flux for the Euler equations
 
-    # Initialize
-    F = np.zeros(ug.shape)
+    E. F. Toro, M. Spruce, W. Speares, Restoration of the contact surface in the HLL-Riemann solver, Shock Waves, 4, pp. 25-34, 1994.
+
+    """
+
+    # Initialize (unless we were given storage)
+    F = np.zeros(ul.shape) if out is None else out
+
+    # Primitive variables and sound speeds (unless we were given them)
+    rhouL, EL = helpers.split_fields(ul, 3, layout)[1:]
+    if wl is None:
+        wl = primitives(helpers.split_fields(ul, 3, layout))
+    rhoL, vL, pL, aL, HL = wl
+
+    rhouR, ER = helpers.split_fields(ur, 3, layout)[1:]
+    if wr is None:
+        wr = primitives(helpers.split_fields(ur, 3, layout))
+    rhoR, vR, pR, aR, HR = wr
+
+    # Signal speeds and speed of the contact
+    SL, SR = wave_speed_estimates(rhoL, vL, aL, HL, rhoR, vR, aR, HR)
+    if speeds is not None:
+        np.maximum(-SL, SR, out=speeds)
+    mL = rhoL * (SL - vL)
+    mR = rhoR * (SR - vR)
+    Sm = (pR - pL + rhouL * (SL - vL) - rhouR * (SR - vR)) / (mL - mR)
+
+    # Flux on each side of the contact: F* = F + S (U* - U)
+    def star_flux(rho, rhou, E, v, p, S, m):
+        c = m / (S - Sm)
+        return (rhou + S * (c - rho),
+                rhou * v + p + S * (c * Sm - rhou),
+                (E + p) * v + S * (c * (E / rho + (Sm - v) * (Sm + p / m)) - E))
+
+    FL = star_flux(rhoL, rhouL, EL, vL, pL, SL, mL)
+    FR = star_flux(rhoR, rhouR, ER, vR, pR, SR, mR)
+
+    # Pick the flux depending on where the interface is in the fan
+    # (the star fluxes reduce to the physical ones for S = 0)
+    left = Sm >= 0
+    FL = [np.where(SL >= 0, f, fs) for f, fs in
+          zip([rhouL, rhouL * vL + pL, (EL + pL) * vL], FL)]
+    FR = [np.where(SR <= 0, f, fs) for f, fs in
+          zip([rhouR, rhouR * vR + pR, (ER + pR) * vR], FR)]
+
+    # Fluxes for each field
+    for f, fl, fr in zip(helpers.split_fields(F, 3, layout), FL, FR):
+        f[...] = np.where(left, fl, fr)
+
+    return F
+
+
+# ========================================================================
+class HybridRiemann:
+    'Expensive interface flux near flagged elements, Rusanov flux elsewhere'
+
+    # ========================================================================
+    def __init__(self, expensive, cheap=None):
+
+        self.expensive = expensive
+        self.cheap = riemann_rusanov if cheap is None else cheap
+
+        # Number of interfaces with the expensive flux and in total
+        self.lock = threading.Lock()
+        self.counts = [0, 0]
+
+    # ========================================================================
+    def __call__(self, ul, ur, out=None, sensors=None, speeds=None,
+                 wl=None, wr=None, layout='interleaved'):
+        """Returns the hybrid interface flux
+
+        sensors are the element sensors starting at the element on the
+        left of the first interface. The expensive flux is used at the
+        interfaces next to an element with a non-zero sensor (and
+        everywhere if there are no sensors). wl and wr are the
+        primitive variables of ul and ur (computed here if not given).
+        """
+
+        if sensors is None:
+            return self.expensive(ul, ur, out, wl, wr, speeds, layout)
+
+        # The primitive variables are shared by both fluxes
+        if wl is None:
+            wl = primitives(helpers.split_fields(ul, 3, layout))
+        if wr is None:
+            wr = primitives(helpers.split_fields(ur, 3, layout))
+
+        # Cheap flux everywhere
+        F = self.cheap(ul, ur, out, wl, wr, speeds, layout)
+
+        # Flagged interfaces
+        fl, fr, fF = [helpers.split_fields(a, 3, layout) for a in (ul, ur, F)]
+        n = fl[0].shape[-1]
+        flagged = (sensors[..., :n] != 0) | (sensors[..., 1:n + 1] != 0)
+        idx = np.nonzero(flagged)
+        k = len(idx[-1])
+        with self.lock:
+            self.counts[0] += k
+            self.counts[1] += flagged.size
+        if k == 0:
+            return F
+
+        # Compact the states at the flagged interfaces, evaluate the
+        # expensive flux there, and scatter it back
+        shape = (3, k) if layout == 'field_major' else (3 * k,)
+        ulc = np.empty(shape, dtype=ul.dtype)
+        urc = np.empty(shape, dtype=ur.dtype)
+        for f, fc in zip(fl + fr, helpers.split_fields(ulc, 3, layout) + helpers.split_fields(urc, 3, layout)):
+            fc[...] = f[idx]
+        Fc = self.expensive(ulc, urc, wl=[w[idx] for w in wl],
+                            wr=[w[idx] for w in wr], layout=layout)
+        for f, fc in zip(fF, helpers.split_fields(Fc, 3, layout)):
+            f[idx] = fc
+
+        return F
+
+    # ========================================================================
+    def report(self):
+        """Prints the fraction of interfaces with the expensive flux"""
+        print("\texpensive flux at {0:6.2f}% of the interfaces".format(
+            100.0 * self.counts[0] / max(self.counts[1], 1)))
 
-    # Primitive variables
-    rho = ug[:, 0::3]
-    v = ug[:, 1::3] / rho
-    E = ug[:, 2::3]
-    p = (constants.gamma - 1) * (E - 0.5 * rho * v * v)
 
-    # Flux in x-direction
-    F[:, 0::3] = ug[:, 1::3]
-    F[:, 1::3] = rho * v * v + p
-    F[:, 2::3] = (E + p) * v
+# ========================================================================
+def interior_flux(ug, out=None, w=None, layout='interleaved'):
+    """Returns the interior flux for the Euler equations
+
+    w are the primitive variables of ug (computed here if not given).
+    """
 
+    # Initialize (unless we were given storage)
+    F = np.zeros(ug.shape) if out is None else out
+    physical_flux(helpers.split_fields(ug, 3, layout),
+                  helpers.split_fields(F, 3, layout), w)
     return F
 
+
+# ========================================================================
+def physical_flux(fields, fF, w=None):
+    """Stores the physical flux of the fields in fF
+
+    The operations are done in place in the flux storage (the
+    velocity and pressure go in the energy and density flux until
+    they are no longer needed, unless they are given in the primitive
+    variables w), so there are no temporaries.
+    """
+
+    rho, rhou, E = fields
+    F0, F1, F2 = fF
+
+    # Flux in x-direction: rho*u, rho*u*u+p, (E+p)*u
+    if w is not None:
+        v, p = w[1:3]
+        np.multiply(rho, v, out=F1)
+        F1 *= v
+        F1 += p
+        np.add(p, E, out=F2)
+        F2 *= v
+        F0[...] = rhou
+        return
+
+    # Primitive variables: v = rhou / rho (in F2) and
+    # p = (gamma-1) * (E - 0.5 * rho * v * v) (in F0)
+    np.divide(rhou, rho, out=F2)
+    np.multiply(rho, 0.5, out=F0)
+    F0 *= F2
+    F0 *= F2
+    np.subtract(E, F0, out=F0)
+    F0 *= constants.gamma - 1
+
+    np.multiply(rho, F2, out=F1)
+    F1 *= F2
+    F1 += F0
+    F0 += E
+    F2 *= F0
+    F0[...] = rhou
+
+# ========================================================================
+
+
+def positivity(fields, points, eps=1e-13):
+    """Scales cell solutions so that their density and pressure stay positive
+
+    X. Zhang, C.-W. Shu, On positivity-preserving high order
+    discontinuous Galerkin schemes for compressible Euler equations on
+    rectangular meshes, Journal of Computational Physics, 229,
+    pp. 8918-8934, 2010.
+
+    fields are the density, momentum and energy Legendre coefficients
+    (modified in place). The high order modes of a cell are scaled
+    towards its cell average until the density and the pressure are
+    at least eps at the points (points evaluates a cell solution
+    there). Returns the cells that were scaled.
+    """
+
+    rho = fields[0]
+    rhobar, mbar, Ebar = [f[..., 0, :] for f in fields]
+    pbar = (constants.gamma - 1) * (Ebar - 0.5 * mbar * mbar / rhobar)
+    eps = np.minimum(np.minimum(rhobar, pbar), eps)
+    scaled = np.zeros(rhobar.shape, dtype=bool)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        # Density: scale its modes so that the smallest density is eps
+        rhomin = np.min(np.matmul(points, rho), axis=-2)
+        low = rhomin < eps
+        if np.any(low):
+            theta = np.where(low, (rhobar - eps) / (rhobar - rhomin), 1)
+            rho[..., 1:, :] *= theta[..., np.newaxis, :]
+            scaled |= low
+
+        # Pressure: at each point with a pressure below eps, the
+        # pressure of (1-t) Ubar + t U(x) is eps where g(t) = (E(t) -
+        # eps/(gamma-1)) rho(t) - m(t)^2/2 = a t^2 + b t + c vanishes
+        # (a single root in [0,1] since g(0) > 0 > g(1), found with
+        # the stable form of the quadratic formula). All the modes are
+        # scaled by the smallest t.
+        rhoq, mq, Eq = [np.matmul(points, f) for f in fields]
+        low = (constants.gamma - 1) * (Eq - 0.5 * mq * mq / rhoq) < \
+            eps[..., np.newaxis, :]
+        if np.any(low):
+            r, m, E0 = [f[..., 0:1, :] for f in fields]
+            e = E0 - eps[..., np.newaxis, :] / (constants.gamma - 1)
+            drho = rhoq - r
+            dm = mq - m
+            dE = Eq - E0
+            a = dE * drho - 0.5 * dm * dm
+            b = e * drho + dE * r - m * dm
+            c = e * r - 0.5 * m * m
+            q = -0.5 * (b + np.copysign(np.sqrt(np.maximum(b * b - 4 * a * c, 0)), b))
+            t = c / q
+            t = np.where((t >= 0) & (t <= 1), t, q / a)
+
+            # (the cell average if there is no admissible root)
+            t = np.where((t >= 0) & (t <= 1), t, 0)
+            theta = np.min(np.where(low, t, 1), axis=-2)
+            for f in fields:
+                f[..., 1:, :] *= theta[..., np.newaxis, :]
+            scaled |= np.any(low, axis=-2)
+
+    return scaled
+
 # ========================================================================
 
 
@@ -364,24 +1107,10 @@ def sensing(sensors, thresholds, solution):
 
     """
 
-    # left/right solution
-    ul = solution.u[0, :-solution.N_F]
-    ur = solution.u[0, solution.N_F:]
-
-    # physical variables on the left and right
-    rhoL = ul[0::3]
-    vL = ul[1::3] / rhoL
-    EL = ul[2::3]
-    pL = (constants.gamma - 1) * (EL - 0.5 * rhoL * vL * vL)
-    aL = np.sqrt(constants.gamma * pL / rhoL)
-    HL = (EL + pL) / rhoL
-
-    rhoR = ur[0::3]
-    vR = ur[1::3] / rhoR
-    ER = ur[2::3]
-    pR = (constants.gamma - 1) * (ER - 0.5 * rhoR * vR * vR)
-    aR = np.sqrt(constants.gamma * pR / rhoR)
-    HR = (ER + pR) / rhoR
+    # physical variables of the cell averages on the left and right
+    w = solution.average_primitives()
+    rhoL, vL, pL, aL, HL = [x[..., :-1] for x in w]
+    rhoR, vR, pR, aR, HR = [x[..., 1:] for x in w]
 
     # Roe averages
     RT = np.sqrt(rhoR / rhoL)
@@ -397,14 +1126,13 @@ def sensing(sensors, thresholds, solution):
     # Discontinuity sensor
     xsi = np.fabs(dV2) / (rhoL + rhoR)
     XSI = 2 * xsi / ((1 + xsi) * (1 + xsi))
-    idx = np.array(np.where(XSI > thresholds[0]))
-    sensors[idx] = 1
-    sensors[idx + 1] = 1
+    idx = XSI > thresholds[0]
+    sensors[..., :-1][idx] = 1
+    sensors[..., 1:][idx] = 1
 
     # Shock sensor
     phi = np.fabs(dp) / (pL + pR)
     PHI = 2 * phi / ((1 + phi) * (1 + phi))
-    idx = np.array(np.where((PHI > thresholds[1]) & (
-        vL - aL > v - a) & (v - a > vR - aR)))
-    sensors[idx] = 2
-    sensors[idx + 1] = 2
+    idx = (PHI > thresholds[1]) & (vL - aL > v - a) & (v - a > vR - aR)
+    sensors[..., :-1][idx] = 2
+    sensors[..., 1:][idx] = 2
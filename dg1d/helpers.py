@@ -4,6 +4,19 @@
 #
 # ========================================================================
 import os
+import threading
+import numpy as np
+
+# ========================================================================
+#
+# Global variables
+#
+# ========================================================================
+
+# Scratch arrays of each thread (see scratch) and the number of shapes
+# each thread keeps
+local = threading.local()
+SCRATCH_SHAPES = 8
 
 # ========================================================================
 #
@@ -21,3 +34,43 @@ def makedir(directory):
     """
     if not os.path.exists(directory):
         os.makedirs(directory)
+
+# ========================================================================
+
+
+def split_fields(u, N_F, layout='interleaved'):
+    """Returns a list of views on each field of a solution array.
+
+    In the interleaved layout, the fields alternate along the last
+    axis, i.e. (N_s, N_E*N_F). In the field_major layout, the fields
+    are the leading axis, i.e. (N_F, N_s, N_E). Either way, each view
+    has the elements along its last axis.
+    """
+    if layout == 'field_major':
+        return [u[f] for f in range(N_F)]
+    else:
+        return [u[..., f::N_F] for f in range(N_F)]
+
+# ========================================================================
+
+
+def scratch(shape, count, dtype):
+    """Returns count scratch arrays of a given shape for this thread
+
+    The storage is kept between calls for the last few shapes, so
+    the kernels that work in it do not allocate anything once they
+    have run on arrays of that shape.
+    """
+    pools = getattr(local, 'pools', None)
+    if pools is None:
+        pools = local.pools = {}
+
+    key = (tuple(shape), np.dtype(dtype))
+    pool = pools.get(key)
+    if pool is None or pool.shape[0] < count:
+        pools.pop(key, None)
+        if len(pools) >= SCRATCH_SHAPES:
+            del pools[next(iter(pools))]
+        pool = np.empty((count,) + tuple(shape), dtype=dtype)
+        pools[key] = pool
+    return [pool[i] for i in range(count)]
@@ -4,6 +4,8 @@
 #
 # ========================================================================
 import numpy as np
+import dg1d.parallel as parallel
+import dg1d.sensor as sensor
 
 # ========================================================================
 #
@@ -16,18 +18,34 @@ class Limiter:
     'Generate the limiter'
 
     # ========================================================================
-    def __init__(self, limiting_type, solution):
+    def __init__(self, limiting_type, solution, sensing='stage',
+                 positivity='', filtering=''):
 
         print("Setting up the limiter:")
 
         # Pre-allocate depending on limiting type
-        self.keywords = {'type': None}
+        self.keywords = {'type': None, 'filter': None, 'positivity': None}
+
+        # Number of cells limited and scaled to stay positive by the
+        # last call (on this rank)
+        self.limited = 0
+        self.scaled = 0
+
+        # When to evaluate the sensors: at every stage (stage), once
+        # per step (step, the stages reuse the flags spread to the
+        # neighboring elements), or only near the elements whose cell
+        # averages changed by more than a tolerance (incremental TOL)
+        params = sensing.split() or ['stage']
+        self.sensing = params[0]
+        self.tolerance = float(params[1]) if len(params) > 1 else 0.0
+        self.flags = None
+        self.averages = None
+        if solution.issensing and self.sensing != 'stage':
+            print('\tSensing policy: {0:s}'.format(' '.join(params)))
 
         if limiting_type == 'adaptive_hr':
             print('\tAdaptive limiting with hierarchical reconstruction')
-            self.keywords = {'type': self.adaptive_hr}
-
-            self.ulim = np.zeros(solution.u.shape)
+            self.keywords['type'] = self.adaptive_hr
 
             # Pre-allocate basis transforms. We don't use the builtin
             # python ones because they are slow!
@@ -57,43 +75,285 @@ class Limiter:
                         self.integral_monomial_derivative_bounds_13[
                             m - 1, n] = integrate_monomial_derivative_bounds(m - 1, n, 1, 3)
 
+            # Use the hierarchical reconstruction kernel of the
+            # solution kernel backend (if it has one)
+            hr = solution.kernels.get('hr')
+            if hr is not None:
+                integrals = (self.integral_monomial_derivative,
+                             self.integral_monomial_derivative_bounds_31,
+                             self.integral_monomial_derivative_bounds_13)
+                self.hr = lambda uc, ul, ur: hr(uc, ul, ur, self.L2M, self.M2L,
+                                                integrals)
+
+        elif limiting_type.startswith('moment'):
+            # TVB constant (0, i.e. TVD, by default), as M dx^2
+            params = limiting_type.split()[1:]
+            M = float(params[0]) if params else 0.0
+            print('\tMoment limiting (TVB constant M = {0:g})'.format(M))
+            self.keywords['type'] = self.moment
+            self.tvb = M * solution.dx**2
+
+        elif limiting_type.startswith('artificial_viscosity'):
+            print('\tNo limiting (artificial viscosity in the residual).')
+
         # By default, do not limit
         else:
             print('\tNo limiting.')
 
+        # Modal filter (after limiting): exponential [s [cutoff
+        # [strength]]] [flagged], only on the elements flagged by the
+        # sensors with flagged
+        if filtering:
+            params = filtering.split()
+            self.filter_flagged = 'flagged' in params
+            values = [float(x) for x in params[1:] if x != 'flagged']
+            if params[0] != 'exponential':
+                print('\tUnknown filter {0:s}, ignoring it.'.format(params[0]))
+            else:
+                print('\tExponential filter ({0:s})'.format(' '.join(params[1:])))
+                self.keywords['filter'] = self.exponential_filter
+                self.sigma = exponential_filter(solution.basis.p, *values).astype(
+                    solution.u.dtype)[:, np.newaxis]
+
+        # Positivity preserving scaling (after limiting), at the
+        # Gaussian nodes and the cell edges
+        if positivity:
+            params = positivity.split()
+            self.eps = float(params[1]) if len(params) > 1 else 1e-13
+            if params[0] != 'zhang_shu':
+                print('\tUnknown positivity preservation {0:s}, ignoring it.'.format(
+                    params[0]))
+            elif solution.kernels.get('positivity') is None:
+                print('\tNo positivity preservation for this system.')
+            else:
+                print('\tZhang-Shu positivity preservation (eps = {0:g})'.format(
+                    self.eps))
+                self.keywords['positivity'] = self.positivity_preserving
+                self.points = np.vstack((solution.basis.phi, solution.basis.psi))
+
+        # Whether limiting evaluates the sensors (the hybrid flux then
+        # reuses them, see sense_hybrid)
+        self.senses = solution.issensing and (
+            self.keywords['type'] is not None or
+            (self.keywords['filter'] is not None and self.filter_flagged))
+
     # ========================================================================
-    def limit(self, solution):
-        """Limit a solution"""
+    def limit(self, solution, stage=False):
+        """Limit a solution
 
+        stage is True for the intermediate solutions of a time
+        step. Returns the number of limited cells (on this rank).
+        """
+
+        self.limited = 0
         if self.keywords['type'] is not None:
-            self.keywords['type'](solution)
+            self.limited = self.keywords['type'](solution, stage)
+        if self.keywords['filter'] is not None:
+            self.keywords['filter'](solution, stage)
+        if self.keywords['positivity'] is not None:
+            self.scaled = self.keywords['positivity'](solution)
+        return self.limited
 
     # ========================================================================
-    def adaptive_hr(self, solution):
+    def adaptive_hr(self, solution, stage=False):
         """Limit a solution in the domain using adaptive hierarchical reconstruction"""
+        return self.limit_flagged(solution, self.hr, stage)
 
-        # Decide where to do limiting
-        solution.sensors.sensing(solution)
+    # ========================================================================
+    def moment(self, solution, stage=False):
+        """Limit a solution in the domain with the moment limiter"""
+        return self.limit_flagged(solution, self.limit_moments, stage)
+
+    # ========================================================================
+    def exponential_filter(self, solution, stage=False):
+        """Damp the high order modes of a solution (or of its flagged elements)"""
+
+        # Everywhere (ghost cells included) in a single multiply
+        if not (self.filter_flagged and solution.issensing):
+            solution.u *= self.sigma
+            solution.invalidate()
+            return
+
+        # Only the flagged elements (already sensed by the limiter,
+        # if there is one)
+        if self.keywords['type'] is None:
+            solution.exchange_halo()
+            self.sense(solution, stage)
+        flagged = solution.sensors.sensors[..., np.newaxis, 1:-1] != 0
+        for f in solution.split_fields(solution.u):
+            np.multiply(f[..., 1:-1], self.sigma, out=f[..., 1:-1],
+                        where=flagged)
+
+        if parallel.global_max(solution.comm, np.count_nonzero(flagged)) > 0:
+            solution.apply_bc()
+
+    # ========================================================================
+    def positivity_preserving(self, solution):
+        """Scale the cell solutions so that they stay physical
+
+        Returns the number of scaled cells (on this rank).
+        """
+
+        fields = [f[..., 1:-1] for f in solution.split_fields(solution.u)]
+        scaled = solution.kernels['positivity'](fields, self.points, self.eps)
+        k = np.count_nonzero(scaled)
 
-        # loop over all the interior elements
-        self.ulim = np.copy(solution.u)
-        for e in range(1, solution.N_E + 1):
+        # The ghost cells (and the primitive variables) only need an
+        # update if a cell was scaled on some rank
+        if parallel.global_max(solution.comm, k) > 0:
+            solution.apply_bc()
+        return k
 
-            if solution.sensors.sensors[e] != 0:
+    # ========================================================================
+    def sense(self, solution, stage=False):
+        """Evaluate the sensors of a solution following the sensing policy
+
+        The flags are kept by the limiter between calls since each
+        stage of a time step is a different solution.
+        """
+        sensors = solution.sensors
+
+        if self.sensing == 'step' and stage and self.flags is not None:
+            np.copyto(sensors.sensors, self.flags)
+
+        elif self.sensing == 'step':
+            sensors.sensing(solution)
+            self.flags = sensor.dilate(sensors.sensors)
+            if solution.halo is not None:
+                solution.halo.exchange(self.flags, 1)
+
+        elif self.sensing == 'incremental' and self.flags is not None:
+            averages = solution.u[..., 0, :]
+            exceeded = np.fabs(averages - self.averages) > self.tolerance
+            changed = np.logical_or.reduce(solution.split_fields(exceeded))
+            np.copyto(sensors.sensors, self.flags)
+            sensors.resensing(solution, changed)
+            for average, reference in zip(solution.split_fields(averages),
+                                          solution.split_fields(self.averages)):
+                np.copyto(reference, average, where=changed)
+            np.copyto(self.flags, sensors.sensors)
+
+        elif self.sensing == 'incremental':
+            sensors.sensing(solution)
+            self.averages = np.copy(solution.u[..., 0, :])
+            self.flags = np.copy(sensors.sensors)
+
+        else:
+            sensors.sensing(solution)
+
+    # ========================================================================
+    def sense_hybrid(self, solution, stage=False):
+        """Evaluate the sensors of the hybrid flux before a residual evaluation
+
+        The hybrid flux picks its Riemann solver from the sensors of
+        the solution it is evaluated on, so they follow the sensing
+        policy at every stage. Limiting already evaluated them for the
+        intermediate stages, and at the end of the last time step for
+        the first stage (which starts from the same solution).
+        """
+        if not (solution.hybrid and solution.issensing):
+            return
+        if self.senses and stage:
+            return
+
+        # The sensors look at the ghost cells
+        solution.apply_bc()
+        self.sense(solution, stage or self.senses)
+
+    # ========================================================================
+    def limit_flagged(self, solution, kernel, stage=False):
+        """Limit the elements flagged by the sensors (all of them without sensors)
+
+        kernel limits the Legendre coefficients of several cells at
+        once, given those of their neighbors (see hr). Only the flagged
+        elements are touched: their limited coefficients are written
+        directly into the solution. Returns the number of limited
+        cells.
+        """
 
-                # loop over the fields and call HR
-                for f in range(0, solution.N_F):
-                    self.ulim[:, e * solution.N_F + f] = self.hr(solution.u[:, e * solution.N_F + f],
-                                                                 solution.u[
-                                                                     :, (e - 1) * solution.N_F + f],
-                                                                 solution.u[:, (e + 1) * solution.N_F + f])
+        # The neighbors on other ranks must be up to date
+        solution.exchange_halo()
 
-        solution.u = np.copy(self.ulim)
+        # Decide where to do limiting
+        if solution.issensing:
+            self.sense(solution, stage)
+            flags = solution.sensors.sensors
+        else:
+            flags = np.ones(solution.ensemble_shape + (solution.N_E + 2,))
+
+        # Flagged interior elements (m are the ensemble members, empty
+        # if there is no ensemble, and e the elements)
+        idx = np.nonzero(flags)
+        interior = (1 <= idx[-1]) & (idx[-1] <= solution.N_E)
+        m = tuple(i[interior] for i in idx[:-1])
+        e = idx[-1][interior]
+        k = len(e)
+
+        # Nothing to do if no element is flagged on any rank (the
+        # solution, its ghost cells and its primitive variables stay
+        # the same)
+        if parallel.global_max(solution.comm, k) == 0:
+            return 0
+
+        # Limit all the flagged elements (and fields) at once: one
+        # column per element and field, the modes along the rows. All
+        # the neighbors are gathered before anything is written.
+        if k > 0:
+            fields = [np.moveaxis(f, -2, 0)
+                      for f in solution.split_fields(solution.u)]
+            uc, ul, ur = [np.hstack([f[(slice(None),) + m + (e + o,)]
+                                     for f in fields])
+                          for o in (0, -1, 1)]
+            ulim = kernel(uc, ul, ur)
+
+            for f, field in enumerate(fields):
+                field[(slice(None),) + m + (e,)] = ulim[:, f * k:(f + 1) * k]
+
+        # (the ghost cells are shared with other ranks, so this is done
+        # on all the ranks)
         solution.apply_bc()
+        return k
+
+    # ========================================================================
+    def limit_moments(self, uc, ul, ur):
+        """Limit cell solutions with the moment limiter
+
+        R. Biswas, K. D. Devine, J. E. Flaherty, Parallel, adaptive finite element methods for conservation laws, Applied Numerical Mathematics, 14, pp. 255-283, 1994.
+
+        L. Krivodonova, Limiters for high-order discontinuous Galerkin methods, Journal of Computational Physics, 226, pp. 879-896, 2007.
+
+        Each Legendre coefficient is limited with the differences of
+        the coefficient one order lower with the neighbors, from the
+        highest order down. A cell stops being limited once one of its
+        coefficients is left unchanged. With a TVB constant M,
+        coefficients smaller than M dx^2 are left unchanged. Works on
+        several cells at once (one per column).
+        """
+
+        ulim = np.array(uc, dtype=np.result_type(uc, np.float32))
+        active = np.ones(np.shape(uc)[1:], dtype=bool)
+        for k in range(len(uc) - 1, 0, -1):
+            alpha = 0.5 / (2 * k - 1)
+            c = minmod(uc[k],
+                       alpha * (ur[k - 1] - uc[k - 1]),
+                       alpha * (uc[k - 1] - ul[k - 1]))
+            c = np.where(np.fabs(uc[k]) <= self.tvb, uc[k], c)
+
+            ulim[k] = np.where(active, c, uc[k])
+            active &= c != uc[k]
+            if not np.any(active):
+                break
+
+        return ulim
 
     # ========================================================================
     def hr(self, uc, ul, ur):
-        """Limit a cell solution with hierarchical reconstruction"""
+        """Limit a cell solution with hierarchical reconstruction
+
+        The Legendre coefficients of the cell (uc) and its neighbors
+        (ul, ur) are along the first axis. Several cells can be
+        limited at once (one per column).
+        """
 
         # Legendre -> monomial transform
         uc = self.legendre_to_monomial(uc)
@@ -120,7 +380,10 @@ class Limiter:
 
     # ========================================================================
     def limit_monomial(self, ac, al, ar):
-        """Limit a monomial cell solution with hierarchical reconstruction"""
+        """Limit a monomial cell solution with hierarchical reconstruction
+
+        Works on several cells at once (one per column).
+        """
 
         alim = np.zeros(np.shape(ac))
 
@@ -162,7 +425,7 @@ class Limiter:
             c2 = 0.5 * (avgLR - avgLC)
 
             # Limited value
-            alim[m] = scalar_minmod(c1, c2)
+            alim[m] = minmod(c1, c2)
 
         # preserve cell average
         alim[0] = avgLC
@@ -199,6 +462,34 @@ def integrate_monomial_derivative_bounds(k, n, a, b):
 # ========================================================================
 
 
+def exponential_filter(p, s=16, cutoff=0.0, strength=36.0):
+    r"""The exponential filter of the Legendre modes of a p order solution
+
+    Returns :math:`\sigma_k = e^{-\alpha \left(\frac{\eta_k - \eta_c}{1 - \eta_c}\right)^s}`
+    for :math:`\eta_k = k/p > \eta_c` (the cutoff), 1 otherwise. The
+    default strength :math:`\alpha = 36` damps the highest mode to
+    machine precision (J. S. Hesthaven, T. Warburton, Nodal
+    discontinuous Galerkin methods, Springer, 2008).
+    """
+    eta = np.arange(p + 1) / max(p, 1)
+    sigma = np.exp(-strength * (np.clip(eta - cutoff, 0, None) / (1 - cutoff))**s)
+    return np.where(eta > cutoff, sigma, 1.0)
+
+# ========================================================================
+
+
+def minmod(*args):
+    """Minmod function for arrays
+
+    0 where their signs differ, the one with the smallest magnitude
+    otherwise (i.e. the median of a, b and 0 for two arrays).
+    """
+    return np.maximum(np.minimum.reduce(args), 0) + \
+        np.minimum(np.maximum.reduce(args), 0)
+
+# ========================================================================
+
+
 def scalar_minmod(a, b):
     """Minmod function for two scalars
 
@@ -27,6 +27,7 @@ import dg1d.solution as solution
 import dg1d.rk as rk
 import dg1d.dg as dg
 import dg1d.limiting as limiting
+import dg1d.parallel as parallel
 
 # ========================================================================
 #
@@ -52,8 +53,17 @@ if __name__ == '__main__':
         description='A simple one-dimensional Discontinuous Galerkin solver.')
     parser.add_argument(
         '-d', '--deck', help='Name of input deck file', default="deck.inp")
+    parser.add_argument(
+        '-t', '--threads', type=int,
+        help='Number of threads for the residual (overrides the deck)')
     args = parser.parse_args()
 
+    # ========================================================================
+    # Distributed run (only the first rank talks)
+    comm = parallel.get_communicator()
+    if comm is not None and comm.Get_rank() > 0:
+        sys.stdout = open(os.devnull, 'w')
+
     # ========================================================================
     # Problem setup
     start = time.time()
@@ -62,17 +72,21 @@ if __name__ == '__main__':
     # Parse the deck
     deck = deck.Deck()
     deck.parser(args.deck)
+    if args.threads is not None:
+        deck.threads = args.threads
 
     # Generate the solution and apply the boundary conditions
-    sol = solution.Solution(deck.ic, deck.system, deck.order,
-                            deck.riemann, deck.enhance, deck.sensor_thresholds)
+    sol = solution.Solution(deck.ensemble or deck.ic, deck.system, deck.order,
+                            deck.riemann, deck.enhance, deck.sensor_thresholds,
+                            deck.layout, deck.precision, comm, deck.kernels)
     sol.apply_bc()
 
     # Initialize the DG solver
-    dgsolver = dg.DG(sol)
+    dgsolver = dg.DG(sol, deck.residual, deck.threads, deck.limiting)
 
     # Initialize the limiter and limit solution if necessary
-    limiter = limiting.Limiter(deck.limiting, sol)
+    limiter = limiting.Limiter(deck.limiting, sol, deck.sensing,
+                                deck.positivity, deck.filter)
     limiter.limit(sol)
 
     # ========================================================================
@@ -0,0 +1,453 @@
+# ========================================================================
+#
+# Imports
+#
+# ========================================================================
+import sys
+import numpy as np
+import dg1d.constants as constants
+import dg1d.helpers as helpers
+
+# Numba is optional (without it, the numpy kernels are used, see
+# backends)
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# ========================================================================
+#
+# Function definitions
+#
+# ========================================================================
+
+
+def jit(f):
+    """Compiles a kernel (if numba is available)
+
+    The kernels release the GIL so that the threaded residual runs
+    them concurrently. The compiled code is cached on disk (next to
+    this module) so that only the first run pays for the compilation.
+    """
+    if numba is None:
+        return f
+    return numba.njit(nogil=True, cache=True)(f)
+
+
+# ========================================================================
+def members(shape):
+    """Returns the indices of the ensemble members (() if there is no ensemble)"""
+    return np.ndindex(shape)
+
+
+# ========================================================================
+#
+# Compiled kernels (scalar loops over the interfaces or nodes)
+#
+# ========================================================================
+@jit
+def primitive(rho, rhou, E, g):
+    """Returns the velocity, pressure and sound speed of a state"""
+    v = rhou / rho
+    p = (g - 1) * (E - 0.5 * rho * v * v)
+    return v, p, np.sqrt(g * p / rho)
+
+
+# ========================================================================
+@jit
+def minmod(a, b):
+    """Minmod function for two scalars (median of a, b and 0)"""
+    return max(min(a, b), min(max(a, b), 0.0))
+
+
+# ========================================================================
+@jit
+def rusanov_kernel(rhoL, rhouL, EL, rhoR, rhouR, ER, F0, F1, F2, speeds, g):
+    """Rusanov flux at each interface"""
+    for i in range(F0.shape[0]):
+        vL, pL, aL = primitive(rhoL[i], rhouL[i], EL[i], g)
+        vR, pR, aR = primitive(rhoR[i], rhouR[i], ER[i], g)
+        maxvap = max(abs(vL) + aL, abs(vR) + aR)
+        speeds[i] = maxvap
+
+        F0[i] = 0.5 * (rhoL[i] * vL + rhoR[i] * vR -
+                       maxvap * (rhoR[i] - rhoL[i]))
+        F1[i] = 0.5 * (rhoL[i] * vL * vL + pL + rhoR[i] * vR * vR +
+                       pR - maxvap * (rhoR[i] * vR - rhoL[i] * vL))
+        F2[i] = 0.5 * ((EL[i] + pL) * vL + (ER[i] + pR) * vR -
+                       maxvap * (ER[i] - EL[i]))
+
+
+# ========================================================================
+@jit
+def roe_kernel(rhoL, rhouL, EL, rhoR, rhouR, ER, F0, F1, F2, speeds, g):
+    """Roe flux (with entropy fix) at each interface"""
+    for i in range(F0.shape[0]):
+        vL, pL, aL = primitive(rhoL[i], rhouL[i], EL[i], g)
+        vR, pR, aR = primitive(rhoR[i], rhouR[i], ER[i], g)
+        HL = (EL[i] + pL) / rhoL[i]
+        HR = (ER[i] + pR) / rhoR[i]
+
+        # Roe averages
+        RT = np.sqrt(rhoR[i] / rhoL[i])
+        rho = RT * rhoL[i]
+        v = (vL + RT * vR) / (1 + RT)
+        H = (HL + RT * HR) / (1 + RT)
+        a = np.sqrt((g - 1) * (H - 0.5 * v * v))
+        dp = pR - pL
+
+        # Absolute value of Roe eigenvalues
+        ws0 = abs(v - a)
+        ws1 = abs(v)
+        ws2 = abs(v + a)
+        speeds[i] = max(ws0, ws2)
+
+        # Entropy fix
+        Da = max(0.0, 4 * ((vR - aR) - (vL - aL)))
+        if ws0 < 0.5 * Da:
+            ws0 = ws0 * ws0 / Da + 0.25 * Da
+        Da = max(0.0, 4 * ((vR + aR) - (vL + aL)))
+        if ws2 < 0.5 * Da:
+            ws2 = ws2 * ws2 / Da + 0.25 * Da
+
+        # Absolute value of Roe eigenvalues * Roe waves strengths
+        ws0_dV0 = ws0 * (dp - rho * a * (vR - vL)) / (2 * a * a)
+        ws1_dV1 = ws1 * ((rhoR[i] - rhoL[i]) - dp / (a * a))
+        ws2_dV2 = ws2 * (dp + rho * a * (vR - vL)) / (2 * a * a)
+
+        F0[i] = 0.5 * (rhoL[i] * vL + rhoR[i] * vR) \
+            - 0.5 * (ws0_dV0 + ws1_dV1 + ws2_dV2)
+        F1[i] = 0.5 * (rhoL[i] * vL * vL + pL + rhoR[i] * vR * vR + pR) \
+            - 0.5 * (ws0_dV0 * (v - a) + ws1_dV1 * v + ws2_dV2 * (v + a))
+        F2[i] = 0.5 * ((EL[i] + pL) * vL + (ER[i] + pR) * vR) \
+            - 0.5 * (ws0_dV0 * (H - v * a) + ws1_dV1 * 0.5 * v * v +
+                     ws2_dV2 * (H + v * a))
+
+
+# ========================================================================
+@jit
+def massflux(r, c, pQ, pm, g):
+    """Mass flux used for Godunov's flux (see euler_physics.massflux)"""
+    gam1 = 0.5 * (g + 1) / g
+    gam2 = 0.5 * (g - 1) / g
+    if pm / pQ >= 1 - 1.0e-15:
+        return r * c * np.sqrt(1 + gam1 * (pm / pQ - 1))
+    return r * c * gam2 * (1 - pm / pQ) / (1 - (pm / pQ)**gam2)
+
+
+# ========================================================================
+@jit
+def sonic(u1, c1, P1, u2, c2, a1, a2, g):
+    """Solution at sonic points (see euler_physics.sonic)"""
+    R1 = a2 / (a2 - a1)
+    R2 = -a1 / (a2 - a1)
+    us = R1 * u1 + R2 * u2
+    cs = R1 * c1 + R2 * c2
+    Ps = (cs / c1)**(2.0 * g / (g - 1)) * P1
+    rs = g * Ps / (cs * cs)
+    return rs, rs * us, Ps / (g - 1) + 0.5 * rs * us * us
+
+
+# ========================================================================
+@jit
+def godunov_kernel(rhoL, rhouL, EL, rhoR, rhouR, ER, F0, F1, F2, speeds, g):
+    """Godunov flux at each interface (see euler_physics.riemann_godunov_loop)
+
+    Returns False if a star pressure iteration did not converge.
+    """
+    tol = 1e-6
+    kmax = 100
+    for i in range(F0.shape[0]):
+        vL, pL, aL = primitive(rhoL[i], rhouL[i], EL[i], g)
+        vR, pR, aR = primitive(rhoR[i], rhouR[i], ER[i], g)
+        speeds[i] = max(abs(vL) + aL, abs(vR) + aR)
+
+        # Supersonic flow to the right
+        if vL / aL >= 1.0:
+            F0[i] = rhoL[i] * vL
+            F1[i] = rhoL[i] * vL * vL + pL
+            F2[i] = (EL[i] + pL) * vL
+            continue
+
+        # Supersonic flow to the left
+        if vR / aR <= -1.0:
+            F0[i] = rhoR[i] * vR
+            F1[i] = rhoR[i] * vR * vR + pR
+            F2[i] = (ER[i] + pR) * vR
+            continue
+
+        # Initial solution: intersection of two linearized integral curves
+        pm1 = ((0.5 * (vL - vR) * (g - 1) + aL + aR) /
+               (aL * pL**((1 - g) / g * 0.5) +
+                aR * pR**((1 - g) / g * 0.5)))**(2 * g / (g - 1))
+
+        # Fixed-point iteration on the pressure in the middle
+        pm2 = pm1
+        converged = False
+        for k in range(kmax + 1):
+            mL = massflux(rhoL[i], aL, pL, pm1, g)
+            mR = massflux(rhoR[i], aR, pR, pm1, g)
+            pm2 = (mL * pR + mR * pL - mL * mR * (vR - vL)) / (mL + mR)
+            if abs(pm2 - pm1) < tol:
+                converged = True
+                break
+            pm1 = pm2
+        if not converged:
+            return False
+
+        mL = massflux(rhoL[i], aL, pL, pm2, g)
+        mR = massflux(rhoR[i], aR, pR, pm2, g)
+        vm = (mL * vL + mR * vR - (pR - pL)) / (mL + mR)
+
+        # Density in the middle
+        gam = (g + 1) / (g - 1)
+        if pm2 / pL >= 1:
+            rmL = rhoL[i] * (1 + gam * pm2 / pL) / (gam + pm2 / pL)
+        else:
+            rmL = rhoL[i] * (pm2 / pL)**(1.0 / g)
+        if pm2 / pR >= 1:
+            rmR = rhoR[i] * (1 + gam * pm2 / pR) / (gam + pm2 / pR)
+        else:
+            rmR = rhoR[i] * (pm2 / pR)**(1.0 / g)
+
+        # Contact wave to the right or left?
+        rmI = rmL if vm >= 0 else rmR
+
+        # Wave speeds at the interface, x/t = 0
+        amL = np.sqrt(g * pm2 / rmL)
+        amR = np.sqrt(g * pm2 / rmR)
+        SmL = vm - amL
+        SmR = vm + amR
+
+        # Sonic case and rarefaction fans through the interface
+        Um2 = rmI * vm
+        Um3 = pm2 / (g - 1) + 0.5 * rmI * vm * vm
+        if (SmL <= 0) and (SmR >= 0):
+            pass
+        elif (SmL > 0) and (vL - aL < 0):
+            rmI, Um2, Um3 = sonic(vL, aL, pL, vm, amL, vL - aL, SmL, g)
+        elif (SmR < 0) and (vR + aR > 0):
+            rmI, Um2, Um3 = sonic(vR, aR, pR, vm, amR, vR + aR, SmR, g)
+
+        # Physical flux at the interface
+        pm = (g - 1) * (Um3 - 0.5 * Um2 * Um2 / rmI)
+        F0[i] = Um2
+        F1[i] = Um2 * Um2 / rmI + pm
+        F2[i] = (Um3 + pm) * Um2 / rmI
+
+    return True
+
+
+# ========================================================================
+@jit
+def interior_flux_kernel(rho, rhou, E, F0, F1, F2, g):
+    """Euler flux at each node of each element"""
+    for j in range(F0.shape[0]):
+        for i in range(F0.shape[1]):
+            v = rhou[j, i] / rho[j, i]
+            p = (g - 1) * (E[j, i] - 0.5 * rho[j, i] * v * v)
+            F0[j, i] = rhou[j, i]
+            F1[j, i] = rho[j, i] * v * v + p
+            F2[j, i] = (E[j, i] + p) * v
+
+
+# ========================================================================
+@jit
+def max_wave_speed_kernel(rho, rhou, E, g):
+    """Maximum of |v| + a over the cell averages"""
+    speed = 0.0
+    for i in range(rho.shape[0]):
+        v, p, a = primitive(rho[i], rhou[i], E[i], g)
+        speed = max(speed, abs(v) + a)
+    return speed
+
+
+# ========================================================================
+@jit
+def sensing_kernel(rho, v, p, a, H, sensors, threshold0, threshold1, g):
+    """Discontinuity (1) and shock (2) sensors (see euler_physics.sensing)"""
+
+    # Discontinuity sensor (the shock sensor has precedence)
+    for shock in range(2):
+        for i in range(rho.shape[0] - 1):
+            RT = np.sqrt(rho[i + 1] / rho[i])
+            vr = (v[i] + RT * v[i + 1]) / (1 + RT)
+            Hr = (H[i] + RT * H[i + 1]) / (1 + RT)
+            ar = np.sqrt((g - 1) * (Hr - 0.5 * vr * vr))
+            dp = p[i + 1] - p[i]
+
+            if shock == 0:
+                xsi = abs(rho[i + 1] - rho[i] - dp / (ar * ar)) / (rho[i] + rho[i + 1])
+                if 2 * xsi / ((1 + xsi) * (1 + xsi)) > threshold0:
+                    sensors[i] = 1
+                    sensors[i + 1] = 1
+            else:
+                phi = abs(dp) / (p[i] + p[i + 1])
+                if (2 * phi / ((1 + phi) * (1 + phi)) > threshold1 and
+                        v[i] - a[i] > vr - ar and vr - ar > v[i + 1] - a[i + 1]):
+                    sensors[i] = 2
+                    sensors[i + 1] = 2
+
+
+# ========================================================================
+@jit
+def hr_kernel(uc, ul, ur, L2M, M2L, I, I31, I13, out):
+    """Hierarchical reconstruction of each column (see Limiter.limit_monomial)"""
+    N_s = uc.shape[0]
+    N = N_s - 1
+    ac = np.zeros(N_s)
+    al = np.zeros(N_s)
+    ar = np.zeros(N_s)
+    alim = np.zeros(N_s)
+    for c in range(uc.shape[1]):
+
+        # Legendre -> monomial transform
+        for i in range(N_s):
+            ac[i] = 0.0
+            al[i] = 0.0
+            ar[i] = 0.0
+            for j in range(N_s):
+                ac[i] += L2M[i, j] * uc[j, c]
+                al[i] += L2M[i, j] * ul[j, c]
+                ar[i] += L2M[i, j] * ur[j, c]
+            alim[i] = 0.0
+
+        # Limit the derivatives, from the highest one
+        avgLC = ac[0]
+        for m in range(N, 0, -1):
+            avgdUL = 0.0
+            avgdUC = 0.0
+            avgdUR = 0.0
+            avgRL = 0.0
+            avgRC = 0.0
+            avgRR = 0.0
+            for n in range(m - 1, N + 1):
+                integral = I[m - 1, n]
+                avgdUL += al[n] * integral
+                avgdUC += ac[n] * integral
+                avgdUR += ar[n] * integral
+                if n >= m + 1:
+                    avgRL += alim[n] * I31[m - 1, n]
+                    avgRC += alim[n] * integral
+                    avgRR += alim[n] * I13[m - 1, n]
+
+            avgLL = 0.5 * (avgdUL - avgRL)
+            avgLC = 0.5 * (avgdUC - avgRC)
+            avgLR = 0.5 * (avgdUR - avgRR)
+            alim[m] = minmod(0.5 * (avgLC - avgLL), 0.5 * (avgLR - avgLC))
+
+        # preserve cell average
+        alim[0] = avgLC
+
+        # monomial -> Legendre transform
+        for i in range(N_s):
+            out[i, c] = 0.0
+            for j in range(N_s):
+                out[i, c] += M2L[i, j] * alim[j]
+
+
+# ========================================================================
+#
+# Kernels with the same signatures as the numpy ones
+#
+# ========================================================================
+def riemann(kernel, ul, ur, out, speeds, layout):
+    """Calls a compiled Riemann kernel on each ensemble member"""
+
+    # Initialize (unless we were given storage)
+    F = np.zeros(ul.shape) if out is None else out
+
+    fl = helpers.split_fields(ul, 3, layout)
+    fr = helpers.split_fields(ur, 3, layout)
+    fF = helpers.split_fields(F, 3, layout)
+    if speeds is None:
+        speeds = np.empty(fl[0].shape)
+
+    # (only the Godunov kernel can fail)
+    for m in members(fl[0].shape[:-1]):
+        if kernel(*[f[m] for f in fl + fr + fF], speeds[m], constants.gamma) is False:
+            sys.exit("Godunov fixed-point iteration did not converge. Exiting.")
+
+    return F
+
+
+# ========================================================================
+def riemann_rusanov(ul, ur, out=None, wl=None, wr=None, speeds=None,
+                    layout='interleaved'):
+    """Returns the Rusanov interface flux for the Euler equations
+
+    The primitive variables (wl, wr) are recomputed in the kernel.
+    """
+    return riemann(rusanov_kernel, ul, ur, out, speeds, layout)
+
+
+# ========================================================================
+def riemann_roe(ul, ur, out=None, wl=None, wr=None, speeds=None,
+                layout='interleaved'):
+    """Returns the Roe interface flux for the Euler equations"""
+    return riemann(roe_kernel, ul, ur, out, speeds, layout)
+
+
+# ========================================================================
+def riemann_godunov(ul, ur, out=None, wl=None, wr=None, speeds=None,
+                    layout='interleaved'):
+    """Returns the Godunov interface flux for the Euler equations"""
+    return riemann(godunov_kernel, ul, ur, out, speeds, layout)
+
+
+# ========================================================================
+def interior_flux(ug, out=None, w=None, layout='interleaved'):
+    """Returns the interior flux for the Euler equations
+
+    The primitive variables (w) are recomputed in the kernel.
+    """
+
+    # Initialize (unless we were given storage)
+    F = np.zeros(ug.shape) if out is None else out
+
+    fg = helpers.split_fields(ug, 3, layout)
+    fF = helpers.split_fields(F, 3, layout)
+    for m in members(fg[0].shape[:-2]):
+        interior_flux_kernel(*[f[m] for f in fg + fF], constants.gamma)
+
+    return F
+
+
+# ========================================================================
+def max_wave_speed(u, w=None, layout='interleaved'):
+    """Returns the maximum wave speed for the Euler system
+
+    The primitive variables w are recomputed in the kernel.
+    """
+    fields = [f[..., 0, :] for f in helpers.split_fields(u, 3, layout)]
+    speed = np.empty(fields[0].shape[:-1])
+    for m in members(speed.shape):
+        speed[m] = max_wave_speed_kernel(*[f[m] for f in fields],
+                                         constants.gamma)
+    return speed[()]
+
+
+# ========================================================================
+def sensing(sensors, thresholds, solution):
+    """Discontinuity and shock sensors for the Euler equations"""
+    w = solution.average_primitives()
+    for m in members(sensors.shape[:-1]):
+        sensing_kernel(*[x[m] for x in w], sensors[m],
+                       thresholds[0], thresholds[1], constants.gamma)
+
+
+# ========================================================================
+def hr(uc, ul, ur, L2M, M2L, integrals):
+    """Limits cell solutions with hierarchical reconstruction
+
+    uc, ul and ur hold the Legendre coefficients of the cells and of
+    their neighbors along their first axis (one cell per column, or a
+    single cell). integrals are the monomial derivative integrals of
+    the Limiter.
+    """
+    shape = np.shape(uc)
+    uc, ul, ur = [np.asarray(x, dtype=np.float64).reshape(shape[0], -1)
+                  for x in (uc, ul, ur)]
+    out = np.empty(uc.shape)
+    hr_kernel(uc, ul, ur, L2M, M2L, *integrals, out)
+    return out.reshape(shape)
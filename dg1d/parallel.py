@@ -0,0 +1,133 @@
+# ========================================================================
+#
+# Imports
+#
+# ========================================================================
+import numpy as np
+
+# MPI is optional (only needed for distributed runs)
+try:
+    from mpi4py import MPI
+except ImportError:
+    MPI = None
+
+# ========================================================================
+#
+# Function definitions
+#
+# ========================================================================
+
+
+def get_communicator():
+    """Returns the MPI communicator if running on more than one rank, None otherwise"""
+    if MPI is None or MPI.COMM_WORLD.Get_size() == 1:
+        return None
+    return MPI.COMM_WORLD
+
+
+# ========================================================================
+def decompose(N_E, rank, size):
+    """Returns the first and last+1 elements owned by a rank
+
+    Each rank owns a contiguous slab of elements. The first N_E % size
+    ranks get one more element than the others.
+    """
+    counts = N_E // size + (np.arange(size) < N_E % size)
+    start = np.sum(counts[:rank])
+    return start, start + counts[rank]
+
+
+# ========================================================================
+def global_min(comm, a):
+    """Returns the minimum of a (scalar or array) over all the ranks"""
+    if comm is None:
+        return a
+    a = np.asarray(a, dtype=np.float64)
+    out = np.empty_like(a)
+    comm.Allreduce(a, out, op=MPI.MIN)
+    return out[()]
+
+
+# ========================================================================
+def global_max(comm, a):
+    """Returns the maximum of a (scalar or array) over all the ranks"""
+    if comm is None:
+        return a
+    a = np.asarray(a, dtype=np.float64)
+    out = np.empty_like(a)
+    comm.Allreduce(a, out, op=MPI.MAX)
+    return out[()]
+
+
+# ========================================================================
+def gather(comm, a):
+    """Concatenates the rows of a from all the ranks on the first one
+
+    Returns None on the other ranks.
+    """
+    if comm is None:
+        return a
+    parts = comm.gather(a, root=0)
+    if comm.Get_rank() == 0:
+        return np.concatenate(parts)
+    return None
+
+
+# ========================================================================
+#
+# Class definitions
+#
+# ========================================================================
+class Halo:
+    'Exchange of the ghost elements between neighboring ranks'
+
+    # ========================================================================
+    def __init__(self, comm, periodic):
+
+        self.comm = comm
+        rank = comm.Get_rank()
+        size = comm.Get_size()
+
+        # Neighboring ranks (None at a physical boundary)
+        self.left = rank - 1 if rank > 0 else None
+        self.right = rank + 1 if rank < size - 1 else None
+        if periodic:
+            self.left = (rank - 1) % size
+            self.right = (rank + 1) % size
+
+        # Contiguous send/receive buffers (allocated on the first
+        # exchange of each kind of array)
+        self.buffers = {}
+
+    # ========================================================================
+    def exchange(self, u, s):
+        """Fills the ghost elements of u with the data of the neighboring ranks
+
+        s is the offset between neighboring elements along the last
+        axis of u.
+        """
+
+        shape = u[..., 0:s].shape
+        key = (shape, u.dtype.str)
+        if key not in self.buffers:
+            self.buffers[key] = [np.empty(shape, dtype=u.dtype)
+                                 for _ in range(4)]
+        send_l, send_r, recv_l, recv_r = self.buffers[key]
+
+        # Non-blocking sends and receives (the tag is the direction
+        # the data is going)
+        requests = []
+        if self.left is not None:
+            send_l[...] = u[..., s:2 * s]
+            requests.append(self.comm.Irecv(recv_l, source=self.left, tag=1))
+            requests.append(self.comm.Isend(send_l, dest=self.left, tag=0))
+        if self.right is not None:
+            send_r[...] = u[..., -2 * s:-s]
+            requests.append(self.comm.Irecv(recv_r, source=self.right, tag=0))
+            requests.append(self.comm.Isend(send_r, dest=self.right, tag=1))
+        MPI.Request.Waitall(requests)
+
+        if self.left is not None:
+            u[..., 0:s] = recv_l
+        if self.right is not None:
+            u[..., -s:] = recv_r
@@ -5,7 +5,10 @@
 # ========================================================================
 import sys
 import numpy as np
+import scipy.linalg
+import scipy.sparse.linalg as splinalg
 import dg1d.rk_coeffs as rkc
+import dg1d.parallel as parallel
 
 # ========================================================================
 #
@@ -22,36 +25,54 @@ def integrate(solution, deck, dgsolver, limiter):
     if deck.rk == 'low_storage_rk4':
         low_storage_rk4(solution, deck, dgsolver, limiter)
 
+    elif (deck.rk == 'expm' and solution.keywords['system'] == 'advection' and
+          solution.comm is None):
+        exponential(solution, deck, dgsolver, limiter)
+
     else:
-        if deck.rk == 'rk3':
-            coeffs, alphas, betas = rkc.get_rk3_coefficients()
+        coeffs, alphas, betas = get_coefficients(deck.rk)
+        classic_rk(solution, deck, dgsolver, limiter, coeffs, alphas, betas)
+
+
+# ========================================================================
+def get_coefficients(scheme):
+    """Returns the coefficients of a classic RK scheme (RK4 by default)
 
-        elif deck.rk == 'rk4':
-            coeffs, alphas, betas = rkc.get_rk4_coefficients()
+    The expm scheme only gets here if it cannot be used (it is only
+    available for serial linear advection).
+    """
 
-        elif deck.rk == 'rk5':
-            coeffs, alphas, betas = rkc.get_rk5_coefficients()
+    if scheme == 'rk3':
+        return rkc.get_rk3_coefficients()
 
-        elif deck.rk == 'rk6':
-            coeffs, alphas, betas = rkc.get_rk6_coefficients()
+    elif scheme == 'rk4':
+        return rkc.get_rk4_coefficients()
 
-        elif deck.rk == 'rk8':
-            coeffs, alphas, betas = rkc.get_rk8_coefficients()
+    elif scheme == 'rk5':
+        return rkc.get_rk5_coefficients()
 
-        elif deck.rk == 'rk10':
-            coeffs, alphas, betas = rkc.get_rk10_coefficients()
+    elif scheme == 'rk6':
+        return rkc.get_rk6_coefficients()
 
-        elif deck.rk == 'rk12':
-            coeffs, alphas, betas = rkc.get_rk12_coefficients()
+    elif scheme == 'rk8':
+        return rkc.get_rk8_coefficients()
 
-        elif deck.rk == 'rk14':
-            coeffs, alphas, betas = rkc.get_rk14_coefficients()
+    elif scheme == 'rk10':
+        return rkc.get_rk10_coefficients()
 
-        else:
-            print('Unrecognized RK option, default to RK4')
-            coeffs, alphas, betas = rkc.get_rk4_coefficients()
+    elif scheme == 'rk12':
+        return rkc.get_rk12_coefficients()
 
-        classic_rk(solution, deck, dgsolver, limiter, coeffs, alphas, betas)
+    elif scheme == 'rk14':
+        return rkc.get_rk14_coefficients()
+
+    elif scheme == 'expm':
+        print('The expm scheme is only available for serial linear advection, default to RK4')
+        return rkc.get_rk4_coefficients()
+
+    else:
+        print('Unrecognized RK option, default to RK4')
+        return rkc.get_rk4_coefficients()
 
 
 # ========================================================================
@@ -59,13 +80,18 @@ def classic_rk(solution, deck, dgsolver, limiter, coeffs, alphas, betas):
     """Integrate in time using the classic RK4 scheme"""
 
     # Initialize storage variables
-    K = [np.zeros(solution.u.shape) for _ in range(len(coeffs))]
-    us = solution.copy()
+    K = [np.zeros(solution.u.shape, dtype=solution.u.dtype)
+         for _ in range(len(coeffs))]
     uk = solution.copy()
+    accumulate_in_double(solution)
+    us = solution.copy()
+    tmp = np.zeros(solution.u.shape, dtype=solution.u.dtype)
 
-    # Output time array (ignore the start time)
+    # Output time array (ignore the start time, the same for all
+    # ensemble members)
     nout = 0
-    tout_array = iter(np.linspace(solution.t, deck.finaltime, deck.nout)[1:])
+    tout_array = iter(np.linspace(
+        np.min(solution.t), deck.finaltime, deck.nout)[1:])
 
     # Flags
     done = False
@@ -80,7 +106,9 @@ def classic_rk(solution, deck, dgsolver, limiter, coeffs, alphas, betas):
 
         # Get the next time step
         dt, output, done = get_next_time_step(
-            solution, tout, deck.cfl, deck.finaltime)
+            solution, tout, deck.cfl * dgsolver.cfl_scale, deck.finaltime,
+            deck.ensemble_dt,
+            wave_speed(solution, deck, dgsolver))
 
         # Store the solution at the previous step: us = u
         us.copy_data_only(solution)
@@ -93,19 +121,22 @@ def classic_rk(solution, deck, dgsolver, limiter, coeffs, alphas, betas):
             # t_k = t_0 + \alpha_k \Delta t
             uk.copy_data_only(us)
             for j, beta in enumerate(betas[k, :k]):
-                uk.smart_axpy(beta, K[j])
+                uk.smart_axpy(beta, K[j], tmp)
             uk.t += alpha * dt
 
-            # Limit solution if necessary
+            # Limit solution if necessary (and evaluate the sensors of
+            # the hybrid flux)
             if k > 0:
-                limiter.limit(uk)
+                limiter.limit(uk, stage=True)
+            limiter.sense_hybrid(uk, stage=k > 0)
 
             # Evaluate and store the solution increment: K_k = \Delta t  f(t_k,
             # u_k)
-            K[k] = dt * dgsolver.residual(uk)
+            np.multiply(dgsolver.residual(uk), solution.per_member(dt),
+                        out=K[k])
 
             # Weighted sum of the residuals
-            solution.smart_axpy(c, K[k])
+            solution.smart_axpy(c, K[k], tmp)
 
         # Update the current time and make sure the boundary elements
         # are correct
@@ -116,6 +147,11 @@ def classic_rk(solution, deck, dgsolver, limiter, coeffs, alphas, betas):
         # Limit solution if necessary
         limiter.limit(solution)
 
+        # Ensemble members waiting for the others at the output time
+        # keep their solution
+        if np.ndim(dt) > 0:
+            solution.copy_members(us, dt == 0)
+
         # Output the solution if necessary
         if output:
             solution.printer(nout, dt)
@@ -129,13 +165,17 @@ def low_storage_rk4(solution, deck, dgsolver, limiter):
     """Integrate in time using the classic RK4 scheme with low storage algorithm"""
 
     # Initialize storage variables
-    us = solution.copy()
     ustar = solution.copy()
-    du = np.zeros(solution.u.shape)
+    du = np.zeros(solution.u.shape, dtype=solution.u.dtype)
+    accumulate_in_double(solution)
+    us = solution.copy()
+    tmp = np.zeros(solution.u.shape, dtype=solution.u.dtype)
 
-    # Output time array (ignore the start time)
+    # Output time array (ignore the start time, the same for all
+    # ensemble members)
     nout = 0
-    tout_array = iter(np.linspace(solution.t, deck.finaltime, deck.nout)[1:])
+    tout_array = iter(np.linspace(
+        np.min(solution.t), deck.finaltime, deck.nout)[1:])
 
     # Flags
     done = False
@@ -154,7 +194,9 @@ def low_storage_rk4(solution, deck, dgsolver, limiter):
 
         # Get the next time step
         dt, output, done = get_next_time_step(
-            solution, tout, deck.cfl, deck.finaltime)
+            solution, tout, deck.cfl * dgsolver.cfl_scale, deck.finaltime,
+            deck.ensemble_dt,
+            wave_speed(solution, deck, dgsolver))
 
         # Store the solution at the previous step: us = u
         us.copy_data_only(solution)
@@ -164,18 +206,21 @@ def low_storage_rk4(solution, deck, dgsolver, limiter):
 
             # Calculate the star quantities
             ustar.copy_data_only(us)
-            ustar.smart_axpy(beta, du)
+            ustar.smart_axpy(beta, du, tmp)
             ustar.t += beta * dt
 
-            # Limit solution if necessary
+            # Limit solution if necessary (and evaluate the sensors of
+            # the hybrid flux)
             if k > 0:
-                limiter.limit(ustar)
+                limiter.limit(ustar, stage=True)
+            limiter.sense_hybrid(ustar, stage=k > 0)
 
             # Calculate the solution increment (=dt*residual)
-            du = dt * dgsolver.residual(ustar)
+            np.multiply(dgsolver.residual(ustar), solution.per_member(dt),
+                        out=du)
 
             # Update the solution
-            solution.smart_axpy(gamma, du)
+            solution.smart_axpy(gamma, du, tmp)
 
         # Update the current time and make sure the boundary elements
         # are correct
@@ -186,6 +231,11 @@ def low_storage_rk4(solution, deck, dgsolver, limiter):
         # Limit solution if necessary
         limiter.limit(solution)
 
+        # Ensemble members waiting for the others at the output time
+        # keep their solution
+        if np.ndim(dt) > 0:
+            solution.copy_members(us, dt == 0)
+
         # Output the solution if necessary
         if output:
             solution.printer(nout, dt)
@@ -195,11 +245,102 @@ def low_storage_rk4(solution, deck, dgsolver, limiter):
 
 
 # ========================================================================
-def get_next_time_step(solution, tout, cfl, tf):
-    """Returns the next time step and output/done flags"""
+def accumulate_in_double(solution):
+    """In mixed precision, promote the solution to double precision
+
+    The stage solutions and residuals stay in single precision but
+    the solution accumulates the increments in double precision.
+    """
+    if solution.precision == 'mixed':
+        solution.u = solution.u.astype(np.float64)
+        solution.invalidate()
+
+
+# ========================================================================
+def exponential(solution, deck, dgsolver, limiter):
+    """Integrate in time with the exponential of the assembled operator
+
+    The semi-discrete system du/dt = L u of a linear problem is
+    advanced exactly from one output time to the next, without any
+    CFL restriction. With the block diagonalized operator (periodic
+    domains), the exponential of each block is taken directly.
+    """
+
+    # Get the assembled operator
+    if dgsolver.Lhat is None and dgsolver.L is None:
+        print('\tAssembling the residual operator.')
+        dgsolver.L = dgsolver.assemble(solution)
+
+    if limiter.keywords['type'] is not None:
+        print('\tLimiting is ignored by the exponential integrator.')
+
+    # Output time array (ignore the start time)
+    tout_array = np.linspace(
+        np.min(solution.t), deck.finaltime, deck.nout)[1:]
+
+    # Write the initial condition to file
+    solution.printer(0, 0.0)
+
+    # Jump from one output time to the next
+    for nout, tout in enumerate(tout_array, 1):
+        dt = tout - np.min(solution.t)
+        if dgsolver.Lhat is not None:
+            spectral_advance(solution, dgsolver, dt)
+        else:
+            expm_advance(solution, dgsolver.L, dt)
+        solution.printer(nout, dt)
+
+
+# ========================================================================
+def expm_advance(solution, L, dt):
+    """Advance the solution exactly by dt given the assembled operator L
+
+    Uses the truncated Taylor series with scaling of scipy's
+    expm_multiply (so exp(L dt) is never formed).
+    """
+
+    # One column per ensemble member
+    U = np.reshape(solution.u, (-1, L.shape[1])).T
+    U = splinalg.expm_multiply(L * dt, U)
+    solution.u[...] = np.reshape(U.T, solution.u.shape)
+
+    # Update the current time and make sure the boundary elements
+    # are correct
+    solution.t += dt
+    solution.n += 1
+    solution.apply_bc()
+
+
+# ========================================================================
+def spectral_advance(solution, dgsolver, dt):
+    """Advance the solution exactly by dt given the block diagonalized operator
+
+    """
+
+    P = scipy.linalg.expm(dgsolver.Lhat * dt)
+    dgsolver.spectral_multiply(solution, P, solution.u)
+
+    # Update the current time and make sure the boundary elements
+    # are correct
+    solution.t += dt
+    solution.n += 1
+    solution.apply_bc()
+
+
+# ========================================================================
+def get_next_time_step(solution, tout, cfl, tf, ensemble_dt='shared', speed=None):
+    """Returns the next time step and output/done flags
+
+    For an ensemble of solutions, the members either share the
+    smallest time step or each take their own ('independent'). speed
+    is the maximum wave speed (computed from the cell averages if not
+    given).
+    """
 
     # Time step from CFL
-    dt = cfl_time_step(solution, cfl)
+    dt = cfl_time_step(solution, cfl, speed)
+    if ensemble_dt == 'shared':
+        dt = np.min(dt)
 
     # Sanity check for this timestep
     sanity_check_dt(dt, solution.n, solution.t)
@@ -209,32 +350,55 @@ def get_next_time_step(solution, tout, cfl, tf):
 
 
 # ========================================================================
-def cfl_time_step(solution, cfl):
+def cfl_time_step(solution, cfl, speed=None):
     """Given the solution and the CFL condition, determine the next time step size
 
     """
 
-    # Get the maximum wave speed in the domain
-    v = solution.max_wave_speed()
+    # Get the maximum wave speed in the domain (unless we were given it)
+    v = solution.max_wave_speed() if speed is None else speed
 
-    # Return the time step
-    return solution.dx * cfl / (v * (2 * solution.basis.p + 1))
+    # Return the time step (the smallest one over all the ranks)
+    dt = solution.dx * cfl / (v * (2 * solution.basis.p + 1))
+    return parallel.global_min(solution.comm, dt)
     # return (solution.dx**2)*cfl/( v * (2*solution.basis.p+1) )
 
 
+# ========================================================================
+def wave_speed(solution, deck, dgsolver):
+    """Returns the maximum wave speed for the next time step
+
+    With the 'riemann' wave speed option, this is the largest signal
+    speed found by the Riemann solver in the last residual evaluation
+    (so there is no separate pass over the solution), times a safety
+    factor. It is recomputed from the cell averages every k steps (if
+    k > 0) and whenever the Riemann solver has not run yet. Returns
+    None when it has to be recomputed.
+    """
+    if deck.wave_speed != 'riemann':
+        return None
+
+    k = deck.wave_speed_every
+    speed = dgsolver.max_speed()
+    if speed is None or (k > 0 and solution.n % k == 0):
+        return None
+
+    return deck.wave_speed_safety * speed
+
+
 # ========================================================================
 def sanity_check_dt(dt, n, t):
     """Make sure the next time step is not absurd
 
     """
 
-    if dt < 1e-14:
+    if np.min(dt) < 1e-14:
         sys.exit(
-            "Next time step is too small ({0:e}<1e-14). Exiting at step {1:7d} and time {2:e}.\n".format(dt, n, t))
+            "Next time step is too small ({0:e}<1e-14). Exiting at step {1:7d} and time {2:e}.\n".format(np.min(dt), n, np.min(t)))
 
-    if np.isnan(dt):
+    if np.any(np.isnan(dt)):
         sys.exit(
-            "Time step is NaN. Exiting at step {0:7d} and time {1:e}.\n".format(n, t))
+            "Time step is NaN. Exiting at step {0:7d} and time {1:e}.\n".format(n, np.min(t)))
 
 # ========================================================================
 
@@ -243,9 +407,20 @@ def adjust_for_output(dt, t, tf, tout):
     """Returns a new time step and true output flag if you need to output
     (also checks if you are done with the time integration)
 
+    For an ensemble, the members that reach the output time wait
+    there (zero time step) until all the others have reached it too.
+
     """
     #eps = 1e-14
 
+    # Ensemble of solutions
+    if np.ndim(dt) > 0 or np.ndim(t) > 0:
+        reached = dt > tout - t
+        dt = np.where(reached, tout - t, dt)
+        dt[np.fabs(tout - t) < 1e-14] = 0.0
+        output = bool(np.all(reached))
+        return dt, output, output and tout >= tf
+
     # If we reached the final time (or almost)
     if dt > tf - t:
         return tf - t, True, True
@@ -5,6 +5,16 @@
 # ========================================================================
 import numpy as np
 
+# ========================================================================
+#
+# Global variables
+#
+# ========================================================================
+
+# Fraction of the interfaces to evaluate again above which all of
+# them are evaluated at once
+FULL_FRACTION = 0.05
+
 # ========================================================================
 #
 # Class definitions
@@ -35,3 +45,103 @@ class Sensor:
 
         # Calculate the sensors
         solution.keywords['sensing'](self.sensors, self.thresholds, solution)
+
+        # The ghost elements shared with other ranks get the sensors
+        # of their owner
+        if solution.halo is not None:
+            solution.halo.exchange(self.sensors, 1)
+
+    # ========================================================================
+    def resensing(self, solution, changed):
+        """Find where limiting needs to be done near some elements only
+
+        changed flags the elements (ghosts included) whose cell
+        averages changed since the sensors were last evaluated. Only
+        the sensors of these elements and of their neighbors are
+        evaluated again (from the interfaces around them), the others
+        are kept.
+        """
+
+        # Elements whose sensors may change, and all their interfaces
+        stale = dilate(changed)
+        stale_interfaces = stale[..., :-1] | stale[..., 1:]
+        count = np.count_nonzero(stale_interfaces)
+
+        # Evaluating everything at once is cheaper when much of the
+        # domain changed
+        if count > FULL_FRACTION * stale_interfaces.size:
+            fresh = np.zeros(self.sensors.shape, dtype=int)
+            solution.keywords['sensing'](fresh, self.thresholds, solution)
+            np.copyto(self.sensors, fresh, where=stale)
+
+        elif count > 0:
+
+            # Evaluate the sensors of each interface on its own
+            idx = np.nonzero(stale_interfaces)
+            interfaces = Interfaces(solution, idx)
+            sensors = np.zeros(interfaces.ensemble_shape + (2,), dtype=int)
+            solution.keywords['sensing'](sensors, self.thresholds, interfaces)
+            flags = np.zeros(stale_interfaces.shape, dtype=int)
+            flags[idx] = np.max(sensors, axis=-1)
+
+            # The sensor of an element is the largest of its
+            # interfaces (the shock sensor has precedence)
+            fresh = np.zeros(self.sensors.shape, dtype=int)
+            fresh[..., :-1] = flags
+            np.maximum(fresh[..., 1:], flags, out=fresh[..., 1:])
+            np.copyto(self.sensors, fresh, where=stale)
+
+        # The ghost elements shared with other ranks get the sensors
+        # of their owner
+        if solution.halo is not None:
+            solution.halo.exchange(self.sensors, 1)
+
+
+# ========================================================================
+class Interfaces:
+    """The cell averages on both sides of some interfaces of a solution
+
+    Looks like a solution to the sensing functions: each interface is
+    an ensemble member with two elements.
+    """
+
+    # ========================================================================
+    def __init__(self, solution, idx):
+
+        m, j = idx[:-1], idx[-1]
+        self.ensemble_shape = j.shape
+        self.keywords = solution.keywords
+        self.fields = [np.stack([f[..., 0, :][m + (j,)],
+                                 f[..., 0, :][m + (j + 1,)]], axis=-1)
+                       for f in solution.split_fields(solution.u)]
+
+        # (fields, ensemble members, modes, elements)
+        self.u = np.stack(self.fields)[:, :, np.newaxis, :]
+
+    # ========================================================================
+    def split_fields(self, u):
+        """Returns a list of views on each field of u"""
+        return list(u)
+
+    # ========================================================================
+    def average_primitives(self):
+        """Returns the primitive variables of the cell averages"""
+        return self.keywords['primitives'](self.fields)
+
+
+# ========================================================================
+#
+# Function definitions
+#
+# ========================================================================
+
+
+def dilate(sensors):
+    """Returns the sensors spread to the neighboring elements
+
+    An element gets the largest sensor of itself and its neighbors.
+    """
+    dilated = np.copy(sensors)
+    np.maximum(dilated[..., 1:], sensors[..., :-1], out=dilated[..., 1:])
+    np.maximum(dilated[..., :-1], sensors[..., 1:], out=dilated[..., :-1])
+    return dilated
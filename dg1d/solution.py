@@ -10,10 +10,12 @@ import copy
 
 import dg1d.basis as basis
 import dg1d.enhance as enhance
-import dg1d.advection_physics as advection_physics
 import dg1d.euler_physics as euler_physics
+import dg1d.backends as backends
 import dg1d.constants as constants
 import dg1d.sensor as sensor
+import dg1d.helpers as helpers
+import dg1d.parallel as parallel
 
 # ========================================================================
 #
@@ -27,17 +29,30 @@ class Solution:
 
     # ========================================================================
     def __init__(self, icline, system, order, riemann_solver='',
-                 enhancement_type='', sensor_thresholds=[]):
+                 enhancement_type='', sensor_thresholds=[],
+                 layout='interleaved', precision='float64', comm=None,
+                 kernels='numpy'):
 
         print("Generating the solution.")
 
+        # Floating point precision (float64, float32 or mixed). In
+        # mixed precision, the solution is in single precision but the
+        # time integration accumulates it in double precision.
+        self.precision = precision
+        if precision in ('float32', 'mixed'):
+            self.dtype = np.float32
+        else:
+            self.dtype = np.float64
+
         # A solution contains a basis
-        self.basis = basis.Basis(order)
+        self.basis = basis.Basis(order, self.dtype)
 
         # It also contains initial condition information
-        # parse the input parameters: name and extra parameters
-        self.icname = icline.split()[0]
-        self.params = icline.split()[1:]
+        # parse the input parameters: name and extra parameters. A
+        # list of initial conditions makes an ensemble of solutions.
+        iclines = [icline] if isinstance(icline, str) else icline
+        self.icname = iclines[0].split()[0]
+        self.params = iclines[0].split()[1:]
 
         # And, of course, the solution information itself
         self.t = 0
@@ -49,48 +64,100 @@ class Solution:
         self.dx = 0
         self.u = np.empty([self.basis.N_s, self.N_E * self.N_F])
         self.scaled_minv = np.empty([self.basis.N_s])
+        self.scaled_dphi_w = np.empty([self.basis.N_s, self.basis.N_G])
+
+        # Shape of the ensemble of solutions, () if there is only one
+        self.ensemble_shape = ()
 
         # Initialize some global constants
         constants.init()
 
+        # Storage layout of the solution (interleaved or field_major)
+        self.layout = layout
+
         # Manipulation functions
-        self.set_manipulation_functions(system, riemann_solver)
+        self.set_manipulation_functions(system, riemann_solver, kernels)
+
+        # Offset between neighboring elements along the last axis of u
+        if self.layout == 'field_major':
+            self.stride = 1
+        else:
+            self.stride = self.N_F
 
         # Boundary condition type (left/right)
         # set in initial condition function
         self.bc_l = ''
         self.bc_r = ''
 
-        # Apply the initial condition
-        try:
-            self.keywords[self.icname]()
-        except Exception as e:
-            print("Invalid initial condition. This will be an empty solution.\n", e)
+        # MPI communicator for distributed runs (each rank owns a
+        # slab of elements, the ghost elements at the boundaries
+        # between ranks are exchanged by the halo)
+        self.comm = comm
+        self.halo = None
+
+        # Primitive variables shared by the physics kernels (see
+        # primitives)
+        self.cache = {}
+
+        # Apply the initial condition (for each ensemble member)
+        members = []
+        for line in iclines:
+            self.icname = line.split()[0]
+            self.params = line.split()[1:]
+            try:
+                self.keywords[self.icname]()
+            except Exception as e:
+                print("Invalid initial condition. This will be an empty solution.\n", e)
+            members.append(self.u)
+
+        if not isinstance(icline, str):
+            self.make_ensemble(members)
 
         # Enhancement (if necessary)
         if (enhancement_type is not ''):
             self.keywords['evaluate_face_solution'] = self.enhanced_faces
             self.enhance = enhance.Enhance(
-                order, enhancement_type, self.u.shape[1])
+                order, enhancement_type, self.u.shape[-1], self.u.shape[:-2],
+                self.dtype)
 
         # Sensors
         self.issensing = False
         if sensor_thresholds:
             self.issensing = True
-            self.sensors = sensor.Sensor(sensor_thresholds, self.N_E + 2)
+            self.sensors = sensor.Sensor(
+                sensor_thresholds, self.ensemble_shape + (self.N_E + 2,))
+
+            # The hybrid flux needs the sensors before the first step
+            if self.hybrid:
+                self.apply_bc()
+                self.sensors.sensing(self)
 
     # ========================================================================
-    def set_manipulation_functions(self, system, riemann_solver):
-        """Define a dictionary containing the necessary functions"""
+    def set_manipulation_functions(self, system, riemann_solver,
+                                   kernels='numpy'):
+        """Define a dictionary containing the necessary functions
+
+        kernels is the backend of the physics kernels (numpy, fused or
+        numba, see backends).
+        """
+
+        # Kernels of the backend (the numpy ones where it has none)
+        self.kernels = backends.get_kernels(kernels, system)
+
+        # The kernels take the primitive variables of the face and
+        # node values (see face_primitives) unless they compute their own
+        self.share_primitives = self.kernels.get('primitives') is not None
 
         # Default
+        self.hybrid = False
         self.keywords = {
             'system': system,
             'fields': ['u'],
-            'riemann': advection_physics.riemann_upwinding,
-            'interior_flux': advection_physics.interior_flux,
-            'max_wave_speed': advection_physics.max_wave_speed,
-            'sensing': advection_physics.sensing,
+            'riemann': self.kernels['riemann'],
+            'interior_flux': self.kernels['interior_flux'],
+            'max_wave_speed': self.kernels['max_wave_speed'],
+            'sensing': self.kernels['sensing'],
+            'primitives': None,
             'sinewave': self.sinewave,
             'simplew': self.simplew,
             'entrpyw': self.entrpyw,
@@ -104,18 +171,26 @@ class Solution:
         # Modify some of these if solving Euler PDEs
         if system == 'euler':
             self.keywords['fields'] = ['rho', 'rhou', 'E']
-            self.keywords['interior_flux'] = euler_physics.interior_flux
-            self.keywords['max_wave_speed'] = euler_physics.max_wave_speed
-            self.keywords['sensing'] = euler_physics.sensing
+            self.keywords['primitives'] = euler_physics.primitives
             self.N_F = 3
 
-            # Set the Riemann solver
-            if riemann_solver == 'rusanov':
-                self.keywords['riemann'] = euler_physics.riemann_rusanov
-            elif riemann_solver == 'godunov':
-                self.keywords['riemann'] = euler_physics.riemann_godunov
-            else:
-                self.keywords['riemann'] = euler_physics.riemann_roe
+            # Set the Riemann solver (hybrid_<solver> uses it only
+            # next to the elements flagged by the sensors). Unknown
+            # solvers default to Roe.
+            self.hybrid = riemann_solver.startswith('hybrid_')
+            if self.hybrid:
+                riemann_solver = riemann_solver[len('hybrid_'):]
+            riemann = self.kernels.get('riemann_' + riemann_solver,
+                                       self.kernels['riemann'])
+
+            # the warm start needs the same interfaces at each call
+            if riemann is euler_physics.riemann_godunov and not self.hybrid:
+                riemann = euler_physics.WarmGodunov()
+
+            if self.hybrid:
+                riemann = euler_physics.HybridRiemann(
+                    riemann, self.kernels['riemann_rusanov'])
+            self.keywords['riemann'] = riemann
 
     # ========================================================================
     def printer(self, nout, dt):
@@ -125,44 +200,56 @@ class Solution:
         """
 
         print("Solution written to file at step {0:7d} and time {1:e} (current time step:{2:e}).".format(
-            self.n, self.t, dt))
+            self.n, np.min(self.t), np.min(dt)))
 
-        # output file names
-        fnames = self.format_fnames(nout, self.keywords['fields'])
+        # Riemann solver diagnostics (if it has any)
+        if hasattr(self.keywords['riemann'], 'report'):
+            self.keywords['riemann'].report()
 
-        # Descriptive header
-        hline = 'n={0:d}, t={1:.18e}, bc_l={2:s}, bc_r={3:s}\nxc'.format(
-            self.n, self.t, self.bc_l, self.bc_r)
-        for i in range(self.basis.N_s):
-            hline += ', u{0:d}'.format(i)
+        # loop on the ensemble members (only one if there is no ensemble)
+        fields = self.split_fields(self.u)
+        t = np.broadcast_to(self.t, self.ensemble_shape)
+        for m in np.ndindex(self.ensemble_shape):
 
-        # loop on all the fields
-        for field, fname in enumerate(fnames):
+            # output file names
+            fnames = self.format_fnames(nout, self.keywords['fields'], m)
+
+            # Descriptive header
+            hline = 'n={0:d}, t={1:.18e}, bc_l={2:s}, bc_r={3:s}\nxc'.format(
+                self.n, t[m], self.bc_l, self.bc_r)
+            for i in range(self.basis.N_s):
+                hline += ', u{0:d}'.format(i)
 
-            # Concatenate element centroids with the solution (ignore ghost
-            # cells)
-            start = self.N_F + field
-            end = -2 * self.N_F + 1 + field
-            step = self.N_F
-            xc_u = np.c_[self.xc, self.u[:, start:end:step].transpose()]
+            # loop on all the fields
+            for field, fname in enumerate(fnames):
 
-            # Save the data to a file
-            np.savetxt(fname, xc_u, fmt='%.18e', delimiter=',', header=hline)
+                # Concatenate element centroids with the solution (ignore
+                # ghost cells)
+                xc_u = np.c_[self.xc, fields[field][m][:, 1:-1].transpose()]
 
-        # Output the sensors if necessary
-        if (self.issensing):
-            fname = self.format_fnames(nout, ['sensor'])
+                # Save the data to a file (collected on the first rank)
+                xc_u = parallel.gather(self.comm, xc_u)
+                if xc_u is not None:
+                    np.savetxt(fname, xc_u, fmt='%.18e',
+                               delimiter=',', header=hline)
 
-            # Concatenate sensor with element centroids
-            xc_sen = np.c_[self.xc, self.sensors.sensors[1:-1]]
+            # Output the sensors if necessary
+            if (self.issensing):
+                fname = self.format_fnames(nout, ['sensor'], m)
 
-            # Quick diagnostic of how many sensors are on
-            print("\tsensors on in {0:6.2f}% of the domain".format(
-                np.count_nonzero(xc_sen[:, 1]) / xc_sen.shape[0] * 100))
+                # Concatenate sensor with element centroids
+                xc_sen = np.c_[self.xc, self.sensors.sensors[m][1:-1]]
+                xc_sen = parallel.gather(self.comm, xc_sen)
+                if xc_sen is None:
+                    continue
 
-            # Save the data to a file
-            np.savetxt(fname[0], xc_sen, fmt='%.18e, %.0d',
-                       delimiter=',', header=hline)
+                # Quick diagnostic of how many sensors are on
+                print("\tsensors on in {0:6.2f}% of the domain".format(
+                    np.count_nonzero(xc_sen[:, 1]) / xc_sen.shape[0] * 100))
+
+                # Save the data to a file
+                np.savetxt(fname[0], xc_sen, fmt='%.18e, %.0d',
+                           delimiter=',', header=hline)
 
     # ========================================================================
     def loader(self, step):
@@ -205,8 +292,9 @@ class Solution:
         #
         # Read solution data from all the files
         #
-        self.u = np.zeros((N_s, self.N_E * self.N_F))
+        self.u = self.zeros(self.N_E)
         self.add_ghosts()
+        fields = self.split_fields(self.u)
         for field, fname in enumerate(fnames):
             print(fname)
 
@@ -214,14 +302,17 @@ class Solution:
             dat = np.loadtxt(fname, delimiter=',')
 
             # Store the data
-            start = self.N_F + field
-            end = -2 * self.N_F + 1 + field
-            step = self.N_F
-            self.u[:, start:end:step] = dat[:, 1::].transpose()
+            fields[field][:, 1:-1] = dat[:, 1::].transpose()
 
     # ========================================================================
-    def format_fnames(self, step, fields):
-        """Returns a list of file names for a given step"""
+    def format_fnames(self, step, fields, member=()):
+        """Returns a list of file names for a given step
+
+        Ensemble members get their index appended to the file names.
+        """
+        if member:
+            return [field + '{0:010d}_{1:04d}.dat'.format(step, member[0])
+                    for field in fields]
         return [field + '{0:010d}.dat'.format(step) for field in fields]
 
     # ========================================================================
@@ -481,13 +572,22 @@ class Solution:
         # Discretize the domain, get the element edges and the element
         # centroids
         self.x, self.dx = np.linspace(A, B, self.N_E + 1, retstep=True)
+
+        # In a distributed run, only keep the elements of this rank
+        if self.comm is not None:
+            start, stop = parallel.decompose(
+                self.N_E, self.comm.Get_rank(), self.comm.Get_size())
+            self.x = self.x[start:stop + 1]
+            self.N_E = stop - start
+            self.halo = parallel.Halo(self.comm, self.bc_l == 'periodic')
+
         self.xc = (self.x[1:] + self.x[:-1]) * 0.5
         # self.xg = np.zeros((self.basis.N_G,self.N_E))
         # for e in range(self.N_E):
         #     self.xg[:,e] = self.basis.shifted_xgauss(self.x[e],self.x[e+1])
 
         # Initialize the initial condition
-        self.u = np.zeros([self.basis.p + 1, self.N_E * self.N_F])
+        self.u = self.zeros(self.N_E)
 
         # Populate the solution
         self.populate(f)
@@ -496,7 +596,10 @@ class Solution:
         self.add_ghosts()
 
         # Scale the inverse mass matrix
-        self.scaled_minv = self.basis.minv * 2.0 / self.dx
+        self.scaled_minv = (self.basis.minv * 2.0 / self.dx).astype(self.dtype)
+
+        # Fold it into the interior flux integration operator
+        self.scaled_dphi_w = self.scaled_minv[:, np.newaxis] * self.basis.dphi_w
 
     # ========================================================================
     def populate(self, f):
@@ -505,6 +608,7 @@ class Solution:
         f is a list of functions, one value for each field
         """
 
+        fields = self.split_fields(self.u)
         for e in range(self.N_E):
 
             # bounds of the element
@@ -513,84 +617,244 @@ class Solution:
 
             for field in range(self.N_F):
                 # solution coefficients
-                self.u[:, e * self.N_F +
-                       field] = self.basis.projection(a, b, f, field)
+                fields[field][:, e] = self.basis.projection(a, b, f, field)
+
+    # ========================================================================
+    def zeros(self, N):
+        """Returns an array of zeros for N elements in the solution layout"""
+        if self.layout == 'field_major':
+            return np.zeros((self.N_F,) + self.ensemble_shape + (self.basis.N_s, N),
+                            dtype=self.dtype)
+        else:
+            return np.zeros(self.ensemble_shape + (self.basis.N_s, N * self.N_F),
+                            dtype=self.dtype)
+
+    # ========================================================================
+    def make_ensemble(self, members):
+        """Stack the solutions of the ensemble members together
+
+        The ensemble axis comes first, after the fields in the
+        field_major layout.
+        """
+        if any(m.shape != members[0].shape for m in members):
+            sys.exit("Ensemble members must have the same mesh. Exiting.")
+
+        axis = 1 if self.layout == 'field_major' else 0
+        self.u = np.stack(members, axis=axis)
+        self.ensemble_shape = (len(members),)
+        self.t = np.zeros(self.ensemble_shape)
+
+    # ========================================================================
+    def per_member(self, a):
+        """Returns a per ensemble member array ready to broadcast against u"""
+        if np.ndim(a) == 0:
+            return a
+        return np.reshape(a, np.shape(a) + (1, 1))
+
+    # ========================================================================
+    def split_fields(self, u):
+        """Returns a list of views on each field of u (elements on the last axis)"""
+        return helpers.split_fields(u, self.N_F, self.layout)
 
     # ========================================================================
     def add_ghosts(self):
         """Add ghost cells to the solution vector"""
-        self.u = np.c_[np.zeros((self.basis.N_s, self.N_F)),
-                       self.u, np.zeros((self.basis.N_s, self.N_F))]
+        pad = [(0, 0)] * (self.u.ndim - 1) + [(self.stride, self.stride)]
+        self.u = np.pad(self.u, pad, 'constant')
 
     # ========================================================================
     def apply_bc(self):
         """Populates the ghost cells with the correct data depending on the BC"""
+        self.invalidate()
+        self.fill_ghosts(self.u)
+
+    # ========================================================================
+    def fill_ghosts(self, u):
+        """Populates the ghost cells of an array laid out like u depending on the BC"""
+
+        # Offset between elements
+        s = self.stride
+
+        # Boundaries shared with other ranks
+        shared_l = shared_r = False
+        if self.halo is not None:
+            self.halo.exchange(u, s)
+            shared_l = self.halo.left is not None
+            shared_r = self.halo.right is not None
 
         # On the left side of the domain
-        if self.bc_l is 'periodic':
-            self.u[:, 0:self.N_F] = self.u[:, -2 * self.N_F:-self.N_F]
+        if shared_l:
+            pass
+        elif self.bc_l is 'periodic':
+            u[..., 0:s] = u[..., -2 * s:-s]
         elif self.bc_l is 'zerograd':
-            self.u[:, 0:self.N_F] = self.u[:, self.N_F:2 * self.N_F]
+            u[..., 0:s] = u[..., s:2 * s]
         else:
             print("{0:s} is an invalid boundary condition. Exiting.".format(self.bc_l))
 
         # On the right side of the domain
-        if self.bc_r is 'periodic':
-            self.u[:, -self.N_F:] = self.u[:, self.N_F:2 * self.N_F]
+        if shared_r:
+            pass
+        elif self.bc_r is 'periodic':
+            u[..., -s:] = u[..., s:2 * s]
         elif self.bc_r is 'zerograd':
-            self.u[:, -self.N_F:] = self.u[:, -2 * self.N_F:-self.N_F]
+            u[..., -s:] = u[..., -2 * s:-s]
         else:
             print("{0:s} is an invalid boundary condition. Exiting.".format(self.bc_r))
 
+    # ========================================================================
+    def exchange_halo(self):
+        """Populates the ghost cells shared with other ranks (if any)"""
+        if self.halo is not None:
+            self.halo.exchange(self.u, self.stride)
+            self.invalidate()
+
     # ========================================================================
     def copy(self):
-        """Returns a deep copy of a solution"""
-        return copy.deepcopy(self)
+        """Returns a deep copy of a solution
+
+        The copy shares the MPI communicator and the Riemann solver
+        (which may keep data between calls).
+        """
+        riemann = self.keywords['riemann']
+        return copy.deepcopy(self, {id(self.comm): self.comm,
+                                    id(riemann): riemann})
 
     # ========================================================================
     def copy_data_only(self, other):
         """Copy data u from other solution into the self"""
-        self.u = np.copy(other.u)
+        np.copyto(self.u, other.u)
+        self.invalidate()
 
     # ========================================================================
-    def smart_axpy(self, a, x):
-        """Adds a*x to u only if a is non-zero"""
+    def copy_members(self, other, members):
+        """Copy data u from other solution into the self for some ensemble members"""
+        axis = 1 if self.layout == 'field_major' else 0
+        idx = (slice(None),) * axis + (members,)
+        self.u[idx] = other.u[idx]
+        self.invalidate()
+
+    # ========================================================================
+    def smart_axpy(self, a, x, tmp=None):
+        """Adds a*x to u only if a is non-zero
+
+        If tmp is given, it is used as storage for a*x (so no
+        temporary array is created).
+        """
         if np.fabs(a) > 1e-15:
-            self.u += a * x
+            if tmp is None:
+                self.u += a * x
+            else:
+                np.multiply(x, a, out=tmp)
+                self.u += tmp
+            self.invalidate()
 
     # ========================================================================
-    def riemann(self, ul, ur):
-        """Returns the flux at an interface by calling the right Riemann solver"""
-        return self.keywords['riemann'](ul, ur)
+    def riemann(self, ul, ur, out=None, first=0, speeds=None, wl=None,
+                wr=None):
+        """Returns the flux at an interface by calling the right Riemann solver
+
+        first is the index of the first interface in ul and ur (the
+        hybrid flux needs to know which elements they are next to). If
+        speeds is given, the largest signal speed at each interface is
+        stored in it. wl and wr are the primitive variables of ul and
+        ur (see face_primitives), computed by the solver if not given.
+        """
+        if self.hybrid and self.issensing:
+            return self.keywords['riemann'](ul, ur, out,
+                                            self.sensors.sensors[..., first:],
+                                            speeds=speeds, wl=wl, wr=wr,
+                                            layout=self.layout)
+        return self.keywords['riemann'](ul, ur, out, wl=wl, wr=wr,
+                                        speeds=speeds, layout=self.layout)
 
     # ========================================================================
-    def interior_flux(self, ug):
-        """Returns the interio flux given the solution at the Gaussian nodes"""
-        return self.keywords['interior_flux'](ug)
+    def interior_flux(self, ug, out=None, w=None):
+        """Returns the interio flux given the solution at the Gaussian nodes
+
+        w are the primitive variables of ug (see node_primitives).
+        """
+        return self.keywords['interior_flux'](ug, out, w=w, layout=self.layout)
 
     # ========================================================================
     def max_wave_speed(self):
         """Returns the maximum wave speed in the domain (based on the cell averages)"""
-        return self.keywords['max_wave_speed'](self.u)
+        if self.keywords['primitives'] is None:
+            return self.keywords['max_wave_speed'](self.u, layout=self.layout)
+        return self.keywords['max_wave_speed'](self.u, self.average_primitives(),
+                                               layout=self.layout)
+
+    # ========================================================================
+    def primitives(self, name, fields, enthalpy=True):
+        """Returns the primitive variables of some fields of the solution
+
+        They are computed once and shared by all the kernels that ask
+        for the same name until the next call to invalidate. The
+        storage is kept between invalidations.
+        """
+        w, valid = self.cache.get(name, (None, False))
+        if not valid:
+            w = self.keywords['primitives'](fields, w, enthalpy)
+            self.cache[name] = (w, True)
+        return w
+
+    # ========================================================================
+    def face_primitives(self, uf, name='faces'):
+        """Returns the primitive variables on the left and right of the interfaces
+
+        uf are the solution values at the faces of consecutive
+        elements (see evaluate_faces). They are cached under name (the
+        threaded residual has one per chunk). Returns None, None if the
+        kernels compute their own.
+        """
+        if not self.share_primitives:
+            return None, None
+        w = self.primitives(name, self.split_fields(uf))
+        return [x[..., 1, :-1] for x in w], [x[..., 0, 1:] for x in w]
+
+    # ========================================================================
+    def node_primitives(self, ug, name='nodes'):
+        """Returns the primitive variables at the Gaussian nodes
+
+        ug are the solution values at the nodes of consecutive
+        elements (see collocate). Cached under name like the face
+        ones, without the enthalpy. Returns None if the kernels
+        compute their own.
+        """
+        if not self.share_primitives:
+            return None
+        return self.primitives(name, self.split_fields(ug), enthalpy=False)
+
+    # ========================================================================
+    def average_primitives(self):
+        """Returns the primitive variables of the cell averages"""
+        return self.primitives('averages',
+                               [f[..., 0, :] for f in self.split_fields(self.u)])
+
+    # ========================================================================
+    def invalidate(self):
+        """Marks the primitive variables as stale (to call whenever u changes)"""
+        for name, (w, valid) in self.cache.items():
+            self.cache[name] = (w, False)
 
     # ========================================================================
-    def collocate(self):
+    def collocate(self, out=None):
         """Collocate the solution to the Gaussian quadrature nodes"""
-        return np.dot(self.basis.phi, self.u)
+        return np.matmul(self.basis.phi, self.u, out=out)
 
     # ========================================================================
-    def evaluate_faces(self):
+    def evaluate_faces(self, out=None):
         """Evaluate the solution at the cell edges/faces"""
 
         # Call the correct face evaluation procedure
-        return self.keywords['evaluate_face_solution']()
+        return self.keywords['evaluate_face_solution'](out)
 
     # ========================================================================
-    def collocate_faces(self):
+    def collocate_faces(self, out=None):
         """Collocate the solution to the cell edges/faces"""
-        return np.dot(self.basis.psi, self.u)
+        return np.matmul(self.basis.psi, self.u, out=out)
 
     # ========================================================================
-    def enhanced_faces(self):
+    def enhanced_faces(self, out=None):
         """Get the value of the enhanced solution at the faces"""
-        return self.enhance.face_value(self.u, self.N_F)
+        return self.enhance.face_value(self.u, self.stride, out)
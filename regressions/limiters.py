@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Cost and accuracy of the limiters
+
+Runs the regression problems with each limiter and reports the run
+time and the L1 error of the cell averages of the density, velocity
+and pressure with the exact solution.
+"""
+
+# ========================================================================
+#
+# Imports
+#
+# ========================================================================
+import os
+import re
+import shutil
+import tempfile
+import time
+from regressions import runcode
+from riemann_solvers import exact_errors
+
+
+# ========================================================================
+#
+# Main
+#
+# ========================================================================
+if __name__ == '__main__':
+
+    regdir = os.path.dirname(os.path.realpath(__file__))
+    codedir = os.path.join(os.path.dirname(regdir), 'dg1d')
+    cases = ['sodtube', 'sodtube_modified', '123_problem', 'blast_wave',
+             'strong_shocks', 'stationary_contact']
+    limiters = ['adaptive_hr', 'moment', 'moment 10', 'moment 100']
+
+    print('{0:20s} {1:14s} {2:>10s} {3:>10s} {4:>10s} {5:>8s}'.format(
+        'problem', 'limiter', 'rho', 'u', 'p', 'time (s)'))
+    for case in cases:
+        golddir = os.path.join(regdir, case)
+        for limiter in limiters:
+
+            # Run the problem in a scratch directory
+            workdir = tempfile.mkdtemp(dir=golddir)
+            with open(os.path.join(golddir, 'deck.inp')) as f:
+                deck = f.read()
+            with open(os.path.join(workdir, 'deck.inp'), 'w') as f:
+                f.write(re.sub(r'(#limiting\n).*',
+                               r'\g<1>' + limiter, deck))
+
+            start = time.time()
+            runcode(workdir, 'deck.inp', codedir, False)
+            elapsed = time.time() - start
+
+            # A run that crashed (e.g. negative pressures) has no output
+            try:
+                errors = exact_errors(workdir, golddir)
+                print('{0:20s} {1:14s} {2:10.3e} {3:10.3e} {4:10.3e} {5:8.2f}'.format(
+                    case, limiter, *errors, elapsed))
+            except OSError:
+                print('{0:20s} {1:14s} {2:>32s} {3:8.2f}'.format(
+                    case, limiter, 'failed', elapsed))
+
+            shutil.rmtree(workdir)
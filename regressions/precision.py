@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Accuracy cost of the reduced precision modes
+
+Runs the regression problems in each precision and reports the
+largest difference with the gold results.
+"""
+
+# ========================================================================
+#
+# Imports
+#
+# ========================================================================
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from regressions import runcode
+
+
+# ========================================================================
+#
+# Function definitions
+#
+# ========================================================================
+def gold_errors(workdir, golddir):
+    """Returns the maximum absolute difference with the golds for each field"""
+    errors = []
+    for field in ['rho', 'rhou', 'E']:
+        fname = field + '0000000001'
+        dat = np.loadtxt(os.path.join(workdir, fname + '.dat'), delimiter=',')
+        gold = np.loadtxt(os.path.join(golddir, fname + '.gold'), delimiter=',')
+        errors.append(np.max(np.fabs(dat - gold)))
+    return errors
+
+
+# ========================================================================
+#
+# Main
+#
+# ========================================================================
+if __name__ == '__main__':
+
+    regdir = os.path.dirname(os.path.realpath(__file__))
+    codedir = os.path.join(os.path.dirname(regdir), 'dg1d')
+    cases = ['sodtube', 'sodtube_modified', '123_problem', 'blast_wave',
+             'strong_shocks', 'stationary_contact']
+
+    print('{0:20s} {1:8s} {2:>10s} {3:>10s} {4:>10s} {5:>8s}'.format(
+        'problem', 'precision', 'rho', 'rhou', 'E', 'time (s)'))
+    for case in cases:
+        golddir = os.path.join(regdir, case)
+        for precision in ['float64', 'float32', 'mixed']:
+
+            # Run the problem in a scratch directory
+            workdir = tempfile.mkdtemp(dir=golddir)
+            with open(os.path.join(golddir, 'deck.inp')) as f:
+                deck = f.read().rstrip()
+            with open(os.path.join(workdir, 'deck.inp'), 'w') as f:
+                f.write(deck + '\n#precision\n' + precision + '\n')
+
+            start = time.time()
+            runcode(workdir, 'deck.inp', codedir, False)
+            elapsed = time.time() - start
+
+            errors = gold_errors(workdir, golddir)
+            print('{0:20s} {1:8s} {2:10.3e} {3:10.3e} {4:10.3e} {5:8.2f}'.format(
+                case, precision, *errors, elapsed))
+
+            shutil.rmtree(workdir)
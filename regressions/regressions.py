@@ -5,6 +5,7 @@
 # ========================================================================
 import os
 import glob
+import shutil
 import subprocess as sp
 import unittest
 import numpy as np
@@ -16,11 +17,12 @@ import numpy.testing as npt
 # Function definitions
 #
 # ========================================================================
-def runcode(workdir, deck, codedir, background=True):
+def runcode(workdir, deck, codedir, background=True, launcher=''):
     """Run the DG code (in background by default) given the input deck
 
     If background is False, then wait for the process to finish and
-    give me a return code.
+    give me a return code. The launcher (e.g. 'mpirun -n 4') is put
+    in front of the command.
     """
 
     cwd = os.getcwd()
@@ -28,7 +30,7 @@ def runcode(workdir, deck, codedir, background=True):
 
     # Launch the code
     log = open('logfile', "w")
-    proc = sp.Popen(codedir + '/main.py -d ' + deck,
+    proc = sp.Popen(launcher + ' ' + codedir + '/main.py -d ' + deck,
                     shell=True, stdout=log, stderr=sp.PIPE)
     retcode = 0
 
@@ -87,12 +89,12 @@ class RegressionsTestCase(unittest.TestCase):
 
     # ========================================================================
     # Execute a test
-    def launch(self, workdir):
+    def launch(self, workdir, launcher=''):
         """Execute the sequence of command to run a test"""
 
         # Run code
         [os.remove(f) for f in glob.glob(os.path.join(workdir, '*.dat'))]
-        runcode(workdir, 'deck.inp', self.codedir, False)
+        runcode(workdir, 'deck.inp', self.codedir, False, launcher)
 
         # Test with gold
         compare_with_golds(workdir)
@@ -162,6 +164,37 @@ class RegressionsTestCase(unittest.TestCase):
         workdir = self.regdir + '/stationary_contact'
         self.launch(workdir)
 
+    # ========================================================================
+    # Sod shock tube on several ranks
+    @unittest.skipUnless(shutil.which('mpirun'), 'requires mpirun')
+    def test_sodtube_mpi(self):
+        """Is the Sod shock tube problem correct when distributed on 4 ranks?"""
+        try:
+            import mpi4py
+        except ImportError:
+            self.skipTest('requires mpi4py')
+        workdir = self.regdir + '/sodtube'
+        self.launch(workdir, 'mpirun -n 4')
+
+    # ========================================================================
+    # Sod shock tube with artificial viscosity
+    def test_sodtube_viscosity(self):
+        """Is the Sod shock tube problem correct with artificial viscosity?"""
+        workdir = self.regdir + '/sodtube_viscosity'
+        self.launch(workdir)
+
+    # ========================================================================
+    # Sod shock tube with artificial viscosity on several ranks
+    @unittest.skipUnless(shutil.which('mpirun'), 'requires mpirun')
+    def test_sodtube_viscosity_mpi(self):
+        """Is the artificial viscosity the same when distributed on 4 ranks?"""
+        try:
+            import mpi4py
+        except ImportError:
+            self.skipTest('requires mpi4py')
+        workdir = self.regdir + '/sodtube_viscosity'
+        self.launch(workdir, 'mpirun -n 4')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Cost and accuracy of the Riemann solvers
+
+Runs the regression problems with each Riemann solver and reports the
+run time and the L1 error of the cell averages of the density,
+velocity and pressure with the exact solution.
+"""
+
+# ========================================================================
+#
+# Imports
+#
+# ========================================================================
+import os
+import re
+import shutil
+import tempfile
+import time
+import numpy as np
+from regressions import runcode
+
+
+# ========================================================================
+#
+# Function definitions
+#
+# ========================================================================
+def exact_errors(workdir, golddir, gamma=1.4):
+    """Returns the L1 error of the density, velocity and pressure with the exact solution"""
+
+    # Cell averages of the conserved variables
+    xc, rho = np.loadtxt(os.path.join(workdir, 'rho0000000001.dat'),
+                         delimiter=',', usecols=(0, 1), unpack=True)
+    rhou = np.loadtxt(os.path.join(workdir, 'rhou0000000001.dat'),
+                      delimiter=',', usecols=1)
+    E = np.loadtxt(os.path.join(workdir, 'E0000000001.dat'),
+                   delimiter=',', usecols=1)
+    u = rhou / rho
+    p = (gamma - 1) * (E - 0.5 * rho * u * u)
+
+    # Exact solution at the cell centers
+    exact = np.loadtxt(os.path.join(golddir, 'exact.txt'), delimiter=',')
+    dx = xc[1] - xc[0]
+    return [np.sum(np.fabs(num - np.interp(xc, exact[:, 0], exact[:, k]))) * dx
+            for k, num in enumerate([rho, u, p], start=1)]
+
+
+# ========================================================================
+#
+# Main
+#
+# ========================================================================
+if __name__ == '__main__':
+
+    regdir = os.path.dirname(os.path.realpath(__file__))
+    codedir = os.path.join(os.path.dirname(regdir), 'dg1d')
+    cases = ['sodtube', 'sodtube_modified', '123_problem', 'blast_wave',
+             'strong_shocks', 'stationary_contact']
+    solvers = ['rusanov', 'hll', 'hllc', 'roe', 'godunov',
+               'hybrid_roe', 'hybrid_godunov']
+
+    print('{0:20s} {1:14s} {2:>10s} {3:>10s} {4:>10s} {5:>8s}'.format(
+        'problem', 'solver', 'rho', 'u', 'p', 'time (s)'))
+    for case in cases:
+        golddir = os.path.join(regdir, case)
+        for solver in solvers:
+
+            # Run the problem in a scratch directory
+            workdir = tempfile.mkdtemp(dir=golddir)
+            with open(os.path.join(golddir, 'deck.inp')) as f:
+                deck = f.read()
+            with open(os.path.join(workdir, 'deck.inp'), 'w') as f:
+                f.write(re.sub(r'(#riemann solver\n)\S+',
+                               r'\g<1>' + solver, deck))
+
+            start = time.time()
+            runcode(workdir, 'deck.inp', codedir, False)
+            elapsed = time.time() - start
+
+            # A run that crashed (e.g. negative pressures) has no output
+            try:
+                errors = exact_errors(workdir, golddir)
+                print('{0:20s} {1:14s} {2:10.3e} {3:10.3e} {4:10.3e} {5:8.2f}'.format(
+                    case, solver, *errors, elapsed))
+            except OSError:
+                print('{0:20s} {1:14s} {2:>32s} {3:8.2f}'.format(
+                    case, solver, 'failed', elapsed))
+
+            shutil.rmtree(workdir)
@@ -11,7 +11,7 @@ config = {
     'download_url': 'https://github.com/marchdf/dg1d',
     'author_email': 'marchdf@umich.edu',
     'version': '0.1',
-    'install_requires': ['nose', 'numpy', 'sphinx', 'matplotlib'],
+    'install_requires': ['nose', 'numpy', 'scipy', 'sphinx', 'matplotlib'],
     'packages': ['dg1d'],
     'scripts': [],
     'name': 'dg1d'
@@ -9,6 +9,11 @@ import dg1d.enhance as enhance
 import dg1d.constants as constants
 import dg1d.dg as dg
 import dg1d.euler_physics as euler_physics
+import dg1d.euler_fused as euler_fused
 import dg1d.limiting as limiting
 import dg1d.rk as rk
 import dg1d.sensor as sensor
+import dg1d.parallel as parallel
+import dg1d.deck as deck
+import dg1d.backends as backends
+import dg1d.numba_kernels as numba_kernels
@@ -0,0 +1,138 @@
+# =========================================================================
+#
+# Imports
+#
+# =========================================================================
+import unittest
+from .context import constants
+from .context import solution
+from .context import limiting
+from .context import euler_physics
+from .context import euler_fused
+from .context import backends
+from .context import numba_kernels
+import numpy as np
+import numpy.testing as npt
+
+# =========================================================================
+#
+# Class definitions
+#
+# =========================================================================
+
+
+class BackendsTestCase(unittest.TestCase):
+    """Tests for `backends.py`."""
+
+    # =========================================================================
+    def setUp(self):
+
+        # initialize gamma (needed in flux calculations)
+        constants.init()
+        constants.gamma = 1.4
+
+        # Random left/right states (density, velocity, pressure) for
+        # an ensemble of 2 members and 50 interfaces
+        np.random.seed(2)
+        shape = (2, 50)
+
+        def state():
+            rho = np.random.uniform(0.5, 2, shape)
+            v = np.random.uniform(-1, 1, shape)
+            p = np.random.uniform(0.5, 2, shape)
+            u = np.zeros((2, 150))
+            u[:, 0::3] = rho
+            u[:, 1::3] = rho * v
+            u[:, 2::3] = p / (constants.gamma - 1) + 0.5 * rho * v * v
+            return u
+
+        self.ul = state()
+        self.ur = state()
+
+    # =========================================================================
+    def test_get_kernels(self):
+        """Are the missing kernels of a backend the numpy ones?"""
+
+        numpy = backends.get_kernels('numpy', 'euler')
+        self.assertIs(numpy['riemann'], euler_physics.riemann_roe)
+        self.assertIs(numpy['riemann_hllc'], euler_physics.riemann_hllc)
+        self.assertNotIn('hr', numpy)
+
+        fused = backends.get_kernels('fused', 'euler')
+        self.assertIs(fused['riemann_roe'], euler_fused.riemann_roe)
+        self.assertIs(fused['riemann_hllc'], euler_physics.riemann_hllc)
+        self.assertIs(fused['sensing'], euler_physics.sensing)
+
+        # Unknown backends and systems without kernels
+        self.assertEqual(backends.get_kernels('unknown', 'euler'), numpy)
+        self.assertEqual(backends.get_kernels('fused', 'advection'),
+                         backends.get_kernels('numpy', 'advection'))
+
+    # =========================================================================
+    @unittest.skipIf(numba_kernels.numba is None, "numba is not installed")
+    def test_numba(self):
+        """Is the numba backend registered when numba is installed?"""
+        kernels = backends.get_kernels('numba', 'euler')
+        self.assertIs(kernels['riemann_godunov'], numba_kernels.riemann_godunov)
+        self.assertIs(kernels['hr'], numba_kernels.hr)
+
+    # =========================================================================
+    def test_riemann(self):
+        """Do the Riemann solvers of all the backends match the numpy ones?"""
+
+        numpy = backends.get_kernels('numpy', 'euler')
+        for backend in backends.registry:
+            kernels = backends.get_kernels(backend, 'euler')
+            for name in ['riemann_rusanov', 'riemann_roe', 'riemann_godunov',
+                         'riemann_hll', 'riemann_hllc']:
+                speeds = np.zeros((2, 50))
+                kspeeds = np.zeros((2, 50))
+                F = numpy[name](self.ul, self.ur, speeds=speeds)
+                npt.assert_array_almost_equal(
+                    kernels[name](self.ul, self.ur, speeds=kspeeds), F,
+                    decimal=10, err_msg=backend + ' ' + name)
+                npt.assert_array_almost_equal(kspeeds, speeds, decimal=12)
+
+    # =========================================================================
+    def test_interior_flux(self):
+        """Do the interior fluxes and wave speeds of all the backends match the numpy ones?"""
+
+        numpy = backends.get_kernels('numpy', 'euler')
+        ug = np.array([self.ul, self.ur]).transpose(1, 0, 2)
+        for backend in backends.registry:
+            kernels = backends.get_kernels(backend, 'euler')
+            npt.assert_array_almost_equal(kernels['interior_flux'](ug),
+                                          numpy['interior_flux'](ug),
+                                          decimal=12, err_msg=backend)
+            npt.assert_array_almost_equal(kernels['max_wave_speed'](ug),
+                                          numpy['max_wave_speed'](ug),
+                                          decimal=12, err_msg=backend)
+            self.assertEqual(np.shape(kernels['max_wave_speed'](ug[0])), ())
+
+    # =========================================================================
+    def test_sensing_and_limiting(self):
+        """Do the sensors and the limiter of all the backends match the numpy ones?"""
+
+        # Sod shock tube (contact) and modified one (shock)
+        iclines = ['scktube 40 0.0 1.0 0.0 1.0 0.125 0.0 0.1',
+                   'scktube 40 0.0 1.0 0.75 1.0 0.125 0.0 0.1']
+
+        def limit(backend):
+            sol = solution.Solution(iclines, 'euler', 2, '', '', [0.01, 0.01],
+                                    kernels=backend)
+            sol.apply_bc()
+            sol.sensors.sensing(sol)
+            sensors = np.copy(sol.sensors.sensors)
+            limiting.Limiter('adaptive_hr', sol).limit(sol)
+            return sensors, sol.u
+
+        sensors, u = limit('numpy')
+        self.assertTrue(np.any(sensors == 1) and np.any(sensors == 2))
+        for backend in backends.registry:
+            bsensors, bu = limit(backend)
+            npt.assert_array_equal(bsensors, sensors, err_msg=backend)
+            npt.assert_array_almost_equal(bu, u, decimal=12, err_msg=backend)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@
 #
 # =========================================================================
 import unittest
+import tracemalloc
 from .context import solution
 from .context import dg
 import numpy as np
@@ -35,7 +36,7 @@ class DGTestCase(unittest.TestCase):
             (self.dgsolver.F.shape[0], self.dgsolver.F.shape[1] - 2))
 
         # Call the function that we are testing
-        self.dgsolver.add_interior_face_fluxes(1)
+        self.dgsolver.add_interior_face_fluxes(1, np.ones(4))
 
         npt.assert_array_almost_equal(self.dgsolver.F, np.array([[0.,   0.,   1.,   2.,   3.,   5.],
                                                                  [6.,   6.,   5.,
@@ -45,24 +46,229 @@ class DGTestCase(unittest.TestCase):
                                                                  [18.,  18.,  17.,  16.,  15.,  23.]]), decimal=13)
 
     # =========================================================================
-    def test_inverse_mass_matrix_multiply(self):
-        """Is the mass matrix multiplication correct?"""
+    def test_add_interior_face_fluxes_lift(self):
+        """Is the lifted face flux addition the same as the mass matrix multiplication?"""
 
-        # Modification to the data for easy testing
-        self.dgsolver.F = 1.0 * np.arange(25).reshape(5, 5)
-        minv = np.arange(5)
+        np.random.seed(0)
+        F = np.random.rand(4, 6)
+        self.dgsolver.q = np.random.rand(5)
+        self.dgsolver.Q = np.zeros((4, 4))
+        minv = np.arange(1, 5)
 
-        # Call the function that we are testing
-        self.dgsolver.inverse_mass_matrix_multiply(minv)
-
-        npt.assert_array_almost_equal(self.dgsolver.F, np.array([[0,  0,  0,  0,  0],
-                                                                 [5,  6,  7,
-                                                                     8,  9],
-                                                                 [20, 22, 24,
-                                                                     26, 28],
-                                                                 [45, 48, 51,
-                                                                     54, 57],
-                                                                 [80, 84, 88, 92, 96]]), decimal=13)
+        # Unscaled addition followed by the multiplication
+        self.dgsolver.F = np.copy(F)
+        self.dgsolver.add_interior_face_fluxes(1, np.ones(4))
+        self.dgsolver.F[:, 1:-1] *= minv[:, np.newaxis]
+        expected = np.copy(self.dgsolver.F[:, 1:-1])
+
+        # Scaled addition (the interior fluxes already include minv)
+        self.dgsolver.F = F * minv[:, np.newaxis]
+        self.dgsolver.add_interior_face_fluxes(1, minv)
+
+        npt.assert_array_almost_equal(self.dgsolver.F[:, 1:-1], expected,
+                                      decimal=13)
+
+    # =========================================================================
+    def test_residual_field_major(self):
+        """Is the residual the same for the interleaved and field_major layouts?"""
+
+        # Same Euler problem in both layouts
+        sol = solution.Solution(
+            'scktube 10 0.0 1.0 0.0 1.0 0.125 0.0 0.1', 'euler', 2)
+        res = dg.DG(sol).residual(sol)
+        solfm = solution.Solution('scktube 10 0.0 1.0 0.0 1.0 0.125 0.0 0.1',
+                                  'euler', 2, layout='field_major')
+        resfm = dg.DG(solfm).residual(solfm)
+
+        # Transform the interleaved residual to (N_F, N_s, N_E+2)
+        res = res.reshape(sol.basis.N_s, -1, sol.N_F).transpose(2, 0, 1)
+
+        self.assertTrue(solfm.u.flags['C_CONTIGUOUS'])
+        npt.assert_array_almost_equal(resfm, res, decimal=13)
+
+        # The layout belongs to each solution (building the field_major
+        # one does not change the interleaved one)
+        npt.assert_array_almost_equal(dg.DG(sol).residual(sol).reshape(
+            sol.basis.N_s, -1, sol.N_F).transpose(2, 0, 1), res, decimal=13)
+
+    # =========================================================================
+    def test_residual_allocations(self):
+        """Does the time stepping allocate new arrays after the first stage?"""
+
+        # The ufuncs on strided views (the Euler fields) use fixed
+        # size buffers, keep them small
+        self.addCleanup(np.setbufsize, np.setbufsize(256))
+
+        # Advection and Euler
+        icline = 'entrpyw 2000'
+        for args in [('sinewave 1000', 'advection', 3),
+                     (icline, 'euler', 3),
+                     (icline, 'euler', 3, 'rusanov', '', 'field_major')]:
+            sol = solution.Solution(*args)
+            dgsolver = dg.DG(sol)
+            K = np.zeros(sol.u.shape)
+            tmp = np.zeros(sol.u.shape)
+            dgsolver.residual(sol)
+
+            # A few stages in steady state
+            tracemalloc.start()
+            for k in range(3):
+                np.multiply(dgsolver.residual(sol), 0.1 * sol.dx, out=K)
+                sol.smart_axpy(0.5, K, tmp)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            # Only small python objects (e.g. array views) are allowed
+            self.assertLess(peak, sol.u.nbytes / 10, msg=args)
+
+    # =========================================================================
+    def test_residual_ensemble(self):
+        """Is the residual of an ensemble the residual of each member?"""
+
+        iclines = ['scktube 10 0.0 1.0 0.0 1.0 0.125 0.0 0.1',
+                   'scktube 10 0.2 1.0 0.75 1.0 0.125 0.0 0.1']
+        for layout, axis in [('interleaved', 0), ('field_major', 1)]:
+            sol = solution.Solution(iclines, 'euler', 2, layout=layout)
+            res = np.copy(dg.DG(sol).residual(sol))
+            for m, icline in enumerate(iclines):
+                member = solution.Solution(icline, 'euler', 2, layout=layout)
+                npt.assert_array_almost_equal(np.take(res, m, axis=axis),
+                                              dg.DG(member).residual(member),
+                                              decimal=13)
+
+    # =========================================================================
+    def test_assembled_residual(self):
+        """Is the assembled residual the same as the matrix-free one?"""
+
+        np.random.seed(0)
+        for icline in ['sinewave 7', 'scktube 8 0.0 1.0 0.0 1.0 0.125 0.0 0.1']:
+            sol = solution.Solution(icline, 'advection', 3)
+            sol.u = np.random.rand(*sol.u.shape)
+            res = np.copy(dg.DG(sol).residual(sol))
+            dgsolver = dg.DG(sol, 'assembled')
+
+            npt.assert_array_almost_equal(dgsolver.residual(sol)[:, 1:-1],
+                                          res[:, 1:-1], decimal=12)
+
+    # =========================================================================
+    def test_spectral_residual(self):
+        """Is the spectral residual the same as the matrix-free one?"""
+
+        np.random.seed(0)
+        for icline in ['sinewave 1', 'sinewave 2', 'sinewave 7', 'sinewave 8',
+                       ['sinewave 6', 'sinewave 6']]:
+            sol = solution.Solution(icline, 'advection', 3)
+            sol.u = np.random.rand(*sol.u.shape)
+            res = np.copy(dg.DG(sol).residual(sol))
+            dgsolver = dg.DG(sol, 'spectral')
+
+            npt.assert_array_almost_equal(dgsolver.residual(sol)[..., 1:-1],
+                                          res[..., 1:-1], decimal=12)
+
+    # =========================================================================
+    def test_residual_float32(self):
+        """Is the single precision residual close to the double precision one?"""
+
+        icline = 'scktube 10 0.0 1.0 0.0 1.0 0.125 0.0 0.1'
+        sol = solution.Solution(icline, 'euler', 2)
+        res = dg.DG(sol).residual(sol)
+        sol32 = solution.Solution(icline, 'euler', 2, precision='float32')
+        res32 = dg.DG(sol32).residual(sol32)
+
+        self.assertEqual(res32.dtype, np.float32)
+        npt.assert_allclose(res32, res, rtol=1e-5, atol=1e-5)
+
+    # =========================================================================
+    def test_threaded_residual(self):
+        """Is the threaded residual the same as the matrix-free one?"""
+
+        # Small chunks so that there are many of them
+        self.addCleanup(setattr, dg, 'CHUNK_BYTES', dg.CHUNK_BYTES)
+        dg.CHUNK_BYTES = 256
+
+        icline = 'scktube 13 0.0 1.0 0.0 1.0 0.125 0.0 0.1'
+        for layout in ['interleaved', 'field_major']:
+            for enhancement in ['', 'icb 0']:
+                for ic in [icline, [icline, icline]]:
+                    sol = solution.Solution(ic, 'euler', 2, 'roe', enhancement,
+                                            layout=layout)
+                    serial = dg.DG(sol)
+                    res = np.copy(serial.residual(sol))
+                    dgsolver = dg.DG(sol, threads=3)
+
+                    self.assertGreater(len(dgsolver.chunks), 3)
+                    npt.assert_array_almost_equal(dgsolver.residual(sol), res,
+                                                  decimal=13)
+                    npt.assert_array_almost_equal(dgsolver.max_speed(),
+                                                  serial.max_speed(), decimal=13)
+
+        # Advection (the interior flux is the solution itself) with
+        # periodic boundaries
+        for layout in ['interleaved', 'field_major']:
+            sol = solution.Solution('sinewave 40', 'advection', 2,
+                                    layout=layout)
+            res = np.copy(dg.DG(sol).residual(sol))
+            dgsolver = dg.DG(sol, threads=2)
+
+            self.assertGreater(len(dgsolver.chunks), 3)
+            npt.assert_array_almost_equal(dgsolver.residual(sol), res,
+                                          decimal=13)
+
+    # =========================================================================
+    def test_max_speed(self):
+        """Is the largest signal speed recorded by the residual correct?"""
+        sol = solution.Solution('scktube 10 0.0 1.0 0.0 1.0 0.125 0.0 0.1',
+                                'euler', 2, 'rusanov')
+        dgsolver = dg.DG(sol)
+        self.assertIsNone(dgsolver.max_speed())
+
+        # Largest |v|+a of the face values
+        dgsolver.residual(sol)
+        rho, rhou, E = sol.split_fields(dgsolver.uf)
+        v = rhou / rho
+        a = np.sqrt(1.4 * 0.4 * (E / rho - 0.5 * v * v))
+        self.assertAlmostEqual(dgsolver.max_speed(), np.max(np.fabs(v) + a))
+
+    # =========================================================================
+    def test_artificial_viscosity(self):
+        """Does the artificial viscosity add nu d2u/dx2 to the residual?"""
+        sol = solution.Solution('sinewave 40', 'advection', 3)
+        sol.apply_bc()
+        self.assertEqual(self.dgsolver.cfl_scale, 1.0)
+
+        res = np.copy(dg.DG(sol).residual(sol))
+        for scheme, tol in [('br1', 5e-3), ('ldg', 2e-2)]:
+            dgsolver = dg.DG(sol, limiting='artificial_viscosity ' + scheme)
+            self.assertLess(dgsolver.cfl_scale, 1.0)
+
+            # The viscosity is constant without sensors, and the
+            # second derivative of sin(2 pi x) is -(2 pi)^2 sin(2 pi x)
+            diff = dgsolver.residual(sol)[..., 1:-1] - res[..., 1:-1]
+            nu = dgsolver.nu[..., 1]
+            npt.assert_array_almost_equal(dgsolver.nu, nu)
+            exact = -nu * (2 * np.pi)**2 * sol.u[..., 1:-1]
+            self.assertLess(np.max(np.fabs(diff - exact)),
+                            tol * np.max(np.fabs(exact)))
+
+        # The threaded residual is not used with artificial viscosity
+        self.addCleanup(setattr, dg, 'CHUNK_BYTES', dg.CHUNK_BYTES)
+        dg.CHUNK_BYTES = 256
+        dgsolver = dg.DG(sol, threads=3, limiting='artificial_viscosity')
+        npt.assert_array_almost_equal(
+            dgsolver.residual(sol),
+            dg.DG(sol, limiting='artificial_viscosity').residual(sol),
+            decimal=13)
+
+        # No new arrays after the first evaluation
+        sol = solution.Solution('sinewave 1000', 'advection', 3)
+        dgsolver = dg.DG(sol, limiting='artificial_viscosity')
+        dgsolver.residual(sol)
+        tracemalloc.start()
+        for k in range(3):
+            dgsolver.residual(sol)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.assertLess(peak, sol.u.nbytes / 10)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+# =========================================================================
+#
+# Imports
+#
+# =========================================================================
+import unittest
+from .context import constants
+from .context import euler_physics
+from .context import euler_fused
+import numpy as np
+import numpy.testing as npt
+
+# =========================================================================
+#
+# Class definitions
+#
+# =========================================================================
+
+
+class EulerFusedTestCase(unittest.TestCase):
+    """Tests for `euler_fused.py`."""
+
+    # =========================================================================
+    def setUp(self):
+
+        # initialize gamma (needed in flux calculations)
+        constants.init()
+        constants.gamma = 1.4
+
+        # Small blocks so that the arrays span several of them
+        self.block = euler_fused.BLOCK
+        euler_fused.BLOCK = 4
+
+        # Random left/right states (density, velocity, pressure) for
+        # an ensemble of 2 members and 11 interfaces
+        np.random.seed(1)
+        shape = (2, 11)
+
+        def state():
+            rho = np.random.uniform(0.1, 2, shape)
+            v = np.random.uniform(-2, 2, shape)
+            p = np.random.uniform(0.1, 3, shape)
+            return [rho, rho * v, p / (constants.gamma - 1) + 0.5 * rho * v * v]
+
+        self.fl = state()
+        self.fr = state()
+
+    # =========================================================================
+    def tearDown(self):
+        euler_fused.BLOCK = self.block
+
+    # =========================================================================
+    def interleave(self, fields, layout):
+        """Returns the fields in a storage layout"""
+        if layout == 'field_major':
+            return np.array(fields)
+        return np.stack(fields, axis=-1).reshape(fields[0].shape[:-1] + (-1,))
+
+    # =========================================================================
+    def test_riemann(self):
+        """Are the fused Riemann solvers the same as the numpy ones?"""
+
+        for layout in ['interleaved', 'field_major']:
+            ul = self.interleave(self.fl, layout)
+            ur = self.interleave(self.fr, layout)
+            for name in ['riemann_rusanov', 'riemann_roe']:
+                solver = getattr(euler_physics, name)
+                fused = getattr(euler_fused, name)
+
+                speeds = np.zeros(self.fl[0].shape)
+                fspeeds = np.zeros(self.fl[0].shape)
+                F = solver(ul, ur, speeds=speeds, layout=layout)
+                npt.assert_array_equal(
+                    fused(ul, ur, speeds=fspeeds, layout=layout), F)
+                npt.assert_array_equal(fspeeds, speeds)
+
+                # with the primitive variables given and storage
+                wl = euler_physics.primitives(self.fl)
+                wr = euler_physics.primitives(self.fr)
+                out = np.zeros(ul.shape)
+                fused(ul, ur, out, wl, wr, layout=layout)
+                npt.assert_array_equal(out, F)
+
+    # =========================================================================
+    def test_interior_flux(self):
+        """Is the fused interior flux the same as the numpy one?"""
+
+        for layout in ['interleaved', 'field_major']:
+            ug = self.interleave(self.fl, layout)
+            npt.assert_array_equal(euler_fused.interior_flux(ug, layout=layout),
+                                   euler_physics.interior_flux(ug, layout=layout))
+            w = euler_physics.primitives(self.fl, enthalpy=False)
+            npt.assert_array_equal(euler_fused.interior_flux(ug, w=w, layout=layout),
+                                   euler_physics.interior_flux(ug, layout=layout))
+
+        # integer data
+        u = np.arange(1, 12 * 3 + 1).reshape((3, 12))
+        npt.assert_array_equal(euler_fused.interior_flux(u),
+                               euler_physics.interior_flux(u))
+
+
+if __name__ == '__main__':
+    unittest.main()
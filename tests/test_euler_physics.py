@@ -128,6 +128,52 @@ class EulerPhysicsTestCase(unittest.TestCase):
                                                 0.0000000000000000, 1.0000000000000000, 0.0000000000000000]),
                                       decimal=6)
 
+    # =========================================================================
+    def test_riemann_godunov_loop(self):
+        """Is the vectorized Godunov Riemann solver the same as the loop?"""
+
+        # Random states (subsonic and supersonic)
+        np.random.seed(0)
+        N = 200
+        rho = np.random.uniform(0.1, 2.0, (2, N))
+        v = np.random.uniform(-3.0, 3.0, (2, N))
+        p = np.random.uniform(0.1, 2.0, (2, N))
+        u = np.zeros((2, 3 * N))
+        u[:, 0::3] = rho
+        u[:, 1::3] = rho * v
+        u[:, 2::3] = p / (constants.gamma - 1) + 0.5 * rho * v * v
+
+        F = euler_physics.riemann_godunov(u[0], u[1])
+        Floop = euler_physics.riemann_godunov_loop(u[0], u[1])
+        npt.assert_array_almost_equal(F, Floop, decimal=12)
+
+    # =========================================================================
+    def test_warm_godunov(self):
+        """Does the warm started Godunov solver converge in one iteration on the same states?"""
+
+        solver = euler_physics.WarmGodunov()
+        out = np.zeros(self.ul.shape)
+        F = solver(self.ul, self.ur, out)
+        npt.assert_array_almost_equal(F, euler_physics.riemann_godunov(self.ul, self.ur),
+                                      decimal=13)
+
+        # The strong pressure jumps start from the previous solution
+        # (for the same storage only)
+        solver(self.ul, self.ur)
+        solver(self.ul, self.ur, np.zeros(self.ul.shape))
+        self.assertEqual(solver.counts['warm'], [0, 0])
+        F = solver(self.ul, self.ur, out)
+        nw, kw = solver.counts['warm']
+        self.assertGreater(nw, 0)
+        self.assertEqual(kw, nw)
+        npt.assert_array_almost_equal(F, euler_physics.riemann_godunov(self.ul, self.ur),
+                                      decimal=6)
+
+        # The guesses go away with the storage
+        self.assertEqual(len(solver.guesses), 1)
+        del F, out
+        self.assertEqual(len(solver.guesses), 0)
+
     # =========================================================================
     def test_riemann_roe(self):
         """Is the Roe Riemann solver correct?"""
@@ -145,6 +191,103 @@ class EulerPhysicsTestCase(unittest.TestCase):
                                                 0.0000000000e+00,   1.0000000000e+00,   0.0000000000e+00]),
                                       decimal=6)
 
+    # =========================================================================
+    def test_riemann_hll(self):
+        """Is the HLL Riemann solver correct?"""
+
+        # Get the flux
+        F = euler_physics.riemann_hll(self.ul, self.ur)
+
+        # test
+        npt.assert_array_almost_equal(F,
+                                      np.array([5.1071370316e-01,   5.4396419800e-01,   1.3132638081e+00,
+                                                9.4632112692e-01,   1.5164973047e+00,   3.2296781106e+00,
+                                                0.0000000000e+00,  -1.0966629547e+00,   0.0000000000e+00,
+                                                0.0000000000e+00,   4.1422063342e+02,   3.8745856906e+04,
+                                                9.4172392646e+01,   2.7703857581e+03,   5.0851933786e+04,
+                                                2.2669607301e-01,   1.0000000000e+00,   0.0000000000e+00]),
+                                      decimal=6)
+
+        # Consistency with the physical flux
+        npt.assert_array_almost_equal(euler_physics.riemann_hll(self.ul, self.ul),
+                                      euler_physics.riemann_rusanov(self.ul, self.ul),
+                                      decimal=10)
+
+    # =========================================================================
+    def test_riemann_hllc(self):
+        """Is the HLLC Riemann solver correct?"""
+
+        # Get the flux
+        F = euler_physics.riemann_hllc(self.ul, self.ur)
+
+        # test (the stationary contact in the last interface is exact)
+        npt.assert_array_almost_equal(F,
+                                      np.array([4.3106716261e-01,   4.8995445483e-01,   1.1628640656e+00,
+                                                9.0626669846e-01,   1.4676174294e+00,   3.1680088531e+00,
+                                                0.0000000000e+00,  -1.0966629547e+00,   0.0000000000e+00,
+                                                1.1037407936e+01,   5.8701801066e+02,   3.2165441946e+04,
+                                                9.9793021519e+01,   2.8167131608e+03,   4.9294577953e+04,
+                                                0.0000000000e+00,   1.0000000000e+00,   0.0000000000e+00]),
+                                      decimal=6)
+
+        # Consistency with the physical flux
+        npt.assert_array_almost_equal(euler_physics.riemann_hllc(self.ul, self.ul),
+                                      euler_physics.riemann_rusanov(self.ul, self.ul),
+                                      decimal=10)
+
+    # =========================================================================
+    def test_primitives(self):
+        """Are the primitive variables correct?"""
+
+        rho, v, p, a, H = euler_physics.primitives(
+            [self.ul[0::3], self.ul[1::3], self.ul[2::3]])
+        npt.assert_array_almost_equal(rho, [1, 1, 1, 1, 5.99924, 1.4])
+        npt.assert_array_almost_equal(v, [0, 0.75, -2.0, 0, 19.5975, 0])
+        npt.assert_array_almost_equal(p, [1, 1, 0.4, 1000, 460.894, 1])
+        npt.assert_array_almost_equal(a, np.sqrt(1.4 * p / rho))
+        npt.assert_array_almost_equal(H, (self.ul[2::3] + p) / rho)
+
+        # The Riemann solvers give the same flux with the primitive
+        # variables given
+        wl = euler_physics.primitives([self.ul[0::3], self.ul[1::3], self.ul[2::3]])
+        wr = euler_physics.primitives([self.ur[0::3], self.ur[1::3], self.ur[2::3]])
+        for solver in [euler_physics.riemann_rusanov, euler_physics.riemann_roe,
+                       euler_physics.riemann_godunov, euler_physics.riemann_hllc]:
+            npt.assert_array_equal(solver(self.ul, self.ur, wl=wl, wr=wr),
+                                   solver(self.ul, self.ur))
+
+    # =========================================================================
+    def test_hybrid_riemann(self):
+        """Is the hybrid Riemann solver using the expensive flux in the right places?"""
+
+        solver = euler_physics.HybridRiemann(euler_physics.riemann_roe)
+        rusanov = euler_physics.riemann_rusanov(self.ul, self.ur)
+        roe = euler_physics.riemann_roe(self.ul, self.ur)
+
+        # No sensors: expensive flux everywhere
+        npt.assert_array_almost_equal(solver(self.ul, self.ur), roe, decimal=12)
+
+        # No flagged elements: cheap flux everywhere
+        sensors = np.zeros(7, dtype=int)
+        npt.assert_array_almost_equal(solver(self.ul, self.ur, sensors=sensors),
+                                      rusanov, decimal=12)
+
+        # Element 2 flagged: expensive flux on interfaces 1 and 2
+        sensors[2] = 2
+        F = solver(self.ul, self.ur, sensors=sensors)
+        expensive = np.zeros(6, dtype=bool)
+        expensive[1:3] = True
+        expensive = np.repeat(expensive, 3)
+        npt.assert_array_almost_equal(F[expensive], roe[expensive], decimal=12)
+        npt.assert_array_almost_equal(F[~expensive], rusanov[~expensive], decimal=12)
+        self.assertEqual(solver.counts, [2, 12])
+
+        # Same flux with the primitive variables given
+        wl = euler_physics.primitives([self.ul[0::3], self.ul[1::3], self.ul[2::3]])
+        wr = euler_physics.primitives([self.ur[0::3], self.ur[1::3], self.ur[2::3]])
+        npt.assert_array_equal(solver(self.ul, self.ur, sensors=sensors,
+                                      wl=wl, wr=wr), F)
+
     # =========================================================================
     def test_interior_flux(self):
         """Is the interior flux correct?"""
@@ -163,6 +306,41 @@ class EulerPhysicsTestCase(unittest.TestCase):
                                                 [26., 32.432, 33.68768, 29., 36.02857143, 37.27831633, 32., 39.62580645, 40.87075963, 35., 43.22352941, 44.46453287]]),
                                       decimal=7)
 
+        # Same flux from the primitive variables
+        w = euler_physics.primitives([u[:, 0::3], u[:, 1::3], u[:, 2::3]],
+                                     enthalpy=False)
+        npt.assert_array_equal(euler_physics.interior_flux(u, w=w), F)
+
+    # =========================================================================
+    def test_positivity(self):
+        """Does the positivity scaling keep the density and pressure positive?"""
+
+        # Quadratic cell solutions (one cell per column) evaluated at
+        # the cell edges and center. The first cell is fine, the
+        # second has a negative density, the third a negative
+        # pressure.
+        points = np.array([[1, -1, 1], [1, 0, -0.5], [1, 1, 1]])
+        rho = np.array([[1., 1, 1], [0.1, 1.5, 0.1], [0, 0, 0]])
+        rhou = np.array([[0., 0, 0.5], [0.1, 0, 0], [0, 0, 0]])
+        E = np.array([[2.5, 2.5, 2.5], [0.2, 0, 0], [0, 0, -3]])
+        fields = [rho, rhou, E]
+        original = [np.copy(f) for f in fields]
+
+        scaled = euler_physics.positivity(fields, points)
+        npt.assert_array_equal(scaled, [False, True, True])
+        for f, o in zip(fields, original):
+            npt.assert_array_equal(f[:, 0], o[:, 0])
+            npt.assert_array_equal(f[0, :], o[0, :])
+
+        rhoq, mq, Eq = [np.dot(points, f) for f in fields]
+        pq = (constants.gamma - 1) * (Eq - 0.5 * mq * mq / rhoq)
+        self.assertGreater(np.min(rhoq), 0)
+        self.assertGreater(np.min(pq), 0)
+
+        # The scaling is as small as possible
+        npt.assert_almost_equal(np.min(rhoq[:, 1]), 1e-13)
+        npt.assert_almost_equal(np.min(pq[:, 2]), 1e-13)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -6,6 +6,7 @@
 import unittest
 from .context import solution
 from .context import limiting
+from .context import sensor
 import numpy as np
 import numpy.testing as npt
 
@@ -59,6 +60,113 @@ class LimitingTestCase(unittest.TestCase):
                                             0., 0., 0., -0.03396299, -0.03396299, -0.0169815,
                                             -0.03396299, -0.03396299, -0.0169815]]))
 
+    # ======================================================================
+    def test_limited_cells(self):
+        """Does the limiter count the limited cells and only touch those?"""
+
+        # Limiting everywhere, in place
+        u = self.hr1.u
+        self.assertEqual(self.hr1_limiter.limit(self.hr1), self.hr1.N_E)
+        self.assertEqual(self.hr1_limiter.limited, self.hr1.N_E)
+        self.assertIs(self.hr1.u, u)
+
+        # Limiting nowhere: not even the ghost cells are updated
+        sol = solution.Solution('entrpyw 5', 'euler', 1, '', '', [1, 1])
+        sol.apply_bc()
+        sol.u[:, :3] = 7
+        u = np.copy(sol.u)
+        limiter = limiting.Limiter('adaptive_hr', sol)
+        self.assertEqual(limiter.limit(sol), 0)
+        npt.assert_array_equal(sol.u, u)
+
+    # ======================================================================
+    def test_sensing_policies(self):
+        """Do the stages reuse or update the sensors following the policy?"""
+        iclines = ['scktube 40 0.0 1.0 0.0 1.0 0.125 0.0 0.1',
+                   'scktube 40 0.0 1.0 0.75 1.0 0.125 0.0 0.1']
+        sol = solution.Solution(iclines, 'euler', 2, 'roe', '', [0.01, 0.01])
+        sol.apply_bc()
+        stage = sol.copy()
+
+        # Once per step: the stages get the flags of the step, spread
+        # to their neighbors
+        limiter = limiting.Limiter('adaptive_hr', sol, 'step')
+        limiter.limit(sol)
+        limiter.limit(stage, stage=True)
+        npt.assert_array_equal(stage.sensors.sensors,
+                               sensor.dilate(sol.sensors.sensors))
+
+        # Incremental: only near the elements that changed (without
+        # tolerance, every change counts)
+        stage = sol.copy()
+        stage.u[..., 0, 30:36] *= 1.01
+        stage.invalidate()
+        reference = stage.copy()
+        reference.sensors.sensing(reference)
+        limiter = limiting.Limiter('adaptive_hr', sol, 'incremental 0')
+        limiter.limit(sol)
+        full_fraction = sensor.FULL_FRACTION
+        sensor.FULL_FRACTION = 1
+        limiter.sense(stage, stage=True)
+        sensor.FULL_FRACTION = full_fraction
+        npt.assert_array_equal(stage.sensors.sensors,
+                               reference.sensors.sensors)
+
+    # ======================================================================
+    def test_positivity_preserving(self):
+        """Are the cells with negative pressures scaled after limiting?"""
+        sol = solution.Solution('scktube 10 0.0 1.0 0.0 1.0 0.125 0.0 0.1',
+                                'euler', 2, 'roe')
+        rho, rhou, E = sol.split_fields(sol.u)
+        E[2, 10] = -1
+        sol.apply_bc()
+
+        limiter = limiting.Limiter('', sol, positivity='zhang_shu 1e-10')
+        self.assertEqual(limiter.limit(sol), 0)
+        self.assertEqual(limiter.scaled, 1)
+        self.assertGreater(E[2, 10], -1)
+        npt.assert_array_equal(sol.u[..., -3:], sol.u[..., -6:-3])
+
+        # (only the Euler equations have it)
+        sol = solution.Solution('sinewave 10', 'advection', 2)
+        limiter = limiting.Limiter('', sol, positivity='zhang_shu')
+        self.assertIsNone(limiter.keywords['positivity'])
+
+    # ======================================================================
+    def test_filtering(self):
+        """Does the filter damp the high order modes (of the flagged elements)?"""
+        sigma = limiting.exponential_filter(4)[:, np.newaxis]
+
+        # Everywhere, without any limiting
+        u = np.copy(self.hr3.u)
+        limiter = limiting.Limiter('', self.hr3, filtering='exponential 16 0.5')
+        limiter.limit(self.hr3)
+        npt.assert_array_equal(
+            self.hr3.u, u * limiting.exponential_filter(3, 16, 0.5)[:, np.newaxis])
+
+        # Only in the flagged elements
+        sol = solution.Solution('scktube 10 0.0 1.0 0.0 1.0 0.125 0.0 0.1',
+                                'euler', 4, 'roe', '', [0.01, 0.01])
+        sol.u[1:] = 0.1
+        sol.apply_bc()
+        u = np.copy(sol.u)
+        limiter = limiting.Limiter('', sol, filtering='exponential flagged')
+        limiter.limit(sol)
+        flagged = np.repeat(sol.sensors.sensors != 0, 3)
+        self.assertEqual(np.count_nonzero(flagged[3:-3]), 6)
+        npt.assert_array_equal(sol.u[:, flagged], (u * sigma)[:, flagged])
+        npt.assert_array_equal(sol.u[:, 3:-3][:, ~flagged[3:-3]],
+                               u[:, 3:-3][:, ~flagged[3:-3]])
+
+    # =========================================================================
+    def test_exponential_filter(self):
+        """Is the exponential filter correct?"""
+        npt.assert_array_almost_equal(limiting.exponential_filter(3, 2, 0, 1),
+                                      np.exp([0, -1. / 9, -4. / 9, -1]))
+        npt.assert_array_almost_equal(limiting.exponential_filter(2, 16, 0.5),
+                                      [1, 1, np.exp(-36)])
+        npt.assert_array_equal(limiting.exponential_filter(0), [1])
+
     # ======================================================================
     def test_hr2_limiting_procedure(self):
         """Is the adaptive HR limiting for p = 2 procedure correct?"""
@@ -196,6 +304,51 @@ class LimitingTestCase(unittest.TestCase):
         npt.assert_array_almost_equal(alim, np.array(
             [-0.76388889, 0., 0.58333333, -0.5]))
 
+    # =========================================================================
+    def test_hr_columns(self):
+        """Is HR on several cells at once the same as one cell at a time?"""
+        np.random.seed(3)
+        uc, ul, ur = [np.random.uniform(-1, 1, (4, 7)) for _ in range(3)]
+        ulim = self.hr3_limiter.hr(uc, ul, ur)
+        for c in range(7):
+            npt.assert_array_almost_equal(
+                ulim[:, c], self.hr3_limiter.hr(uc[:, c], ul[:, c], ur[:, c]),
+                decimal=14)
+
+    # =========================================================================
+    def test_limit_moments(self):
+        """Is the moment limiting procedure correct?"""
+        limiter = limiting.Limiter('moment', self.hr2)
+
+        # One column per cell: the quadratic mode of the first one is
+        # limited but not its slope. The quadratic mode of the second
+        # one is not limited so its (steep) slope is not either.
+        uc = np.array([[1., 1], [0.5, 3], [0.3, 0.01]])
+        ul = np.array([[0., 0], [0.2, 2.9], [0, 0]])
+        ur = np.array([[2., 2], [0.2, 3.1], [0, 0]])
+        ulim = limiter.limit_moments(uc, ul, ur)
+        npt.assert_array_almost_equal(ulim, [[1, 1], [0.5, 3], [0, 0.01]])
+
+        # One cell at a time
+        for c in range(2):
+            npt.assert_array_equal(
+                ulim[:, c], limiter.limit_moments(uc[:, c], ul[:, c], ur[:, c]))
+
+        # Small enough coefficients are left alone with a TVB constant
+        limiter = limiting.Limiter('moment 50', self.hr2)
+        self.assertAlmostEqual(limiter.tvb, 50 * self.hr2.dx**2)
+        uc[2, 0] = 0.5 * limiter.tvb
+        npt.assert_array_equal(limiter.limit_moments(uc, ul, ur), uc)
+
+    # =========================================================================
+    def test_moment_limiting_procedure(self):
+        """Does the moment limiter preserve the cell averages?"""
+        u = np.copy(self.hr3.u)
+        limiter = limiting.Limiter('moment', self.hr3)
+        self.assertEqual(limiter.limit(self.hr3), self.hr3.N_E)
+        npt.assert_array_almost_equal(self.hr3.u[0], u[0])
+        self.assertTrue(np.all(np.fabs(self.hr3.u[1:]) <= np.fabs(u[1:])))
+
     # =========================================================================
     def test_integrate_monomial_derivative(self):
         """Is the integration of monomial derivative correct?"""
@@ -228,6 +381,17 @@ class LimitingTestCase(unittest.TestCase):
         npt.assert_equal(limiting.scalar_minmod(0.7, -0.5), 0)
         npt.assert_equal(limiting.scalar_minmod(-0.7, -0.2), -0.2)
 
+    # =========================================================================
+    def test_minmod(self):
+        """Is the minmod function correct?"""
+        npt.assert_equal(limiting.minmod(np.array([-1, 0.7, 0.7, -0.7]),
+                                         np.array([0.5, 0.5, -0.5, -0.2])),
+                         [0, 0.5, 0, -0.2])
+        npt.assert_equal(limiting.minmod(np.array([-1, 0.7, 0.7, -0.7]),
+                                         np.array([0.5, 0.5, 0.9, -0.2]),
+                                         np.array([2, 0.6, 0.1, -0.3])),
+                         [0, 0.5, 0.1, -0.2])
+
 
 if __name__ == '__main__':
     unittest.main()
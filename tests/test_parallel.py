@@ -0,0 +1,39 @@
+# =========================================================================
+#
+# Imports
+#
+# =========================================================================
+import unittest
+from .context import parallel
+import numpy as np
+import numpy.testing as npt
+
+# =========================================================================
+#
+# Class definitions
+#
+# =========================================================================
+
+
+class ParallelTestCase(unittest.TestCase):
+    """Tests for `parallel.py`."""
+
+    # =========================================================================
+    def test_decompose(self):
+        """Do the ranks own contiguous slabs covering all the elements?"""
+
+        slabs = [parallel.decompose(10, rank, 4) for rank in range(4)]
+        npt.assert_array_equal(slabs, [[0, 3], [3, 6], [6, 8], [8, 10]])
+
+    # =========================================================================
+    def test_serial_reductions(self):
+        """Are the reductions no-ops without a communicator?"""
+
+        dt = np.array([0.1, 0.2])
+        self.assertIs(parallel.global_min(None, dt), dt)
+        self.assertIs(parallel.global_max(None, dt), dt)
+        self.assertIs(parallel.gather(None, dt), dt)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,18 @@
 #
 # =========================================================================
 import unittest
+import os
+import io
+import contextlib
+import shutil
+import tempfile
 from .context import rk
+from .context import solution
+from .context import dg
+from .context import deck
+from .context import limiting
+import numpy as np
+import numpy.testing as npt
 
 # =========================================================================
 #
@@ -42,6 +53,122 @@ class RKTestCase(unittest.TestCase):
         self.assertAlmostEqual(dt, 0.001, places=7)
         self.assertListEqual([output, done], [True, True], msg=None)
 
+    # =========================================================================
+    def test_adjust_for_output_ensemble(self):
+        """Given an ensemble with dt=[0.1,0.2,0.1], t=[1,1,1.5], tf=2,
+        tout=1.5, does adjust_for_output do the right thing?
+        """
+        dt, output, done = rk.adjust_for_output(np.array([0.1, 0.2, 0.1]),
+                                                np.array([1, 1, 1.5]),
+                                                2, 1.5)
+        npt.assert_array_almost_equal(dt, [0.1, 0.2, 0.0])
+        self.assertListEqual([output, done], [False, False], msg=None)
+
+        dt, output, done = rk.adjust_for_output(np.array([0.6, 0.6]),
+                                                np.array([1.5, 1.9]),
+                                                2, 2)
+        npt.assert_array_almost_equal(dt, [0.5, 0.1])
+        self.assertListEqual([output, done], [True, True], msg=None)
+
+    # =========================================================================
+    def test_expm_advance(self):
+        """Does the exponential integrator advect a sine wave over one period?"""
+        sol = solution.Solution('sinewave 16', 'advection', 3)
+        u0 = np.copy(sol.u)
+        dgsolver = dg.DG(sol, 'assembled')
+
+        # Half a period, then the rest of the domain
+        rk.expm_advance(sol, dgsolver.L, 0.5)
+        npt.assert_array_almost_equal(sol.u[:, 1:-1], -u0[:, 1:-1], decimal=3)
+        rk.expm_advance(sol, dgsolver.L, 1.5)
+        npt.assert_array_almost_equal(sol.u[:, 1:-1], u0[:, 1:-1], decimal=3)
+        self.assertAlmostEqual(sol.t, 2.0)
+
+    # =========================================================================
+    def test_get_coefficients(self):
+        """Does expm fall back to RK4 with an explicit message where it cannot be used?"""
+        rk4 = rk.rkc.get_rk4_coefficients()
+        for scheme, message in [('rk4', ''),
+                                ('expm', 'only available for serial linear advection'),
+                                ('unknown', 'Unrecognized RK option')]:
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                coeffs = rk.get_coefficients(scheme)
+            self.assertIn(message, out.getvalue())
+            for a, b in zip(coeffs, rk4):
+                npt.assert_array_equal(a, b)
+
+    # =========================================================================
+    def test_spectral_advance(self):
+        """Is the spectral exponential integrator the same as the sparse one?"""
+        np.random.seed(0)
+        sol = solution.Solution('sinewave 10', 'advection', 2)
+        sol.u[...] = np.random.rand(*sol.u.shape)
+        sol.apply_bc()
+        other = sol.copy()
+
+        rk.spectral_advance(sol, dg.DG(sol, 'spectral'), 0.37)
+        rk.expm_advance(other, dg.DG(other, 'assembled').L, 0.37)
+        npt.assert_array_almost_equal(sol.u, other.u, decimal=10)
+
+    # =========================================================================
+    def test_wave_speed(self):
+        """Is the wave speed from the Riemann solver used when requested?"""
+        sol = solution.Solution('scktube 10 0.0 1.0 0.0 1.0 0.125 0.0 0.1',
+                                'euler', 2, 'rusanov')
+        dgsolver = dg.DG(sol)
+        inp = deck.Deck()
+
+        # Default: from the cell averages
+        dgsolver.residual(sol)
+        self.assertIsNone(rk.wave_speed(sol, inp, dgsolver))
+
+        # From the residual with a safety factor, except every 3 steps
+        inp.wave_speed, inp.wave_speed_safety, inp.wave_speed_every = 'riemann', 1.1, 3
+        sol.n = 4
+        self.assertAlmostEqual(rk.wave_speed(sol, inp, dgsolver),
+                               1.1 * dgsolver.max_speed())
+        sol.n = 6
+        self.assertIsNone(rk.wave_speed(sol, inp, dgsolver))
+
+        # The time step uses it
+        dt = rk.cfl_time_step(sol, 0.5, 2.0)
+        self.assertAlmostEqual(dt, sol.dx * 0.5 / (2.0 * 5))
+
+    # =========================================================================
+    def test_hybrid_sensing(self):
+        """Do the sensors of the hybrid flux follow a moving shock?"""
+        inp = deck.Deck()
+        inp.rk, inp.nout, inp.finaltime = 'rk4', 2, 0.15
+
+        cwd = os.getcwd()
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(workdir)
+
+        for sensing in ['stage', 'step', 'incremental 0.01']:
+            sol = solution.Solution('scktube 50 0.0 1.0 0.0 1.0 0.125 0.0 0.1',
+                                    'euler', 1, 'hybrid_roe', '', [0.01, 0.01])
+            dgsolver = dg.DG(sol)
+            limiter = limiting.Limiter('', sol, sensing)
+
+            # The sensors seen by every residual evaluation
+            flags = []
+            residual = dgsolver.residual
+
+            def recording(stage):
+                flags.append(np.copy(stage.sensors.sensors))
+                return residual(stage)
+            dgsolver.residual = recording
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                rk.integrate(sol, inp, dgsolver, limiter)
+
+            # The shock moved right (by about 6 elements)
+            first = np.max(np.nonzero(flags[0]))
+            last = np.max(np.nonzero(flags[-1]))
+            self.assertGreater(last, first + 3, msg=sensing)
 
 if __name__ == '__main__':
     unittest.main()
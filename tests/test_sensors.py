@@ -81,6 +81,46 @@ class SensorTestCase(unittest.TestCase):
         npt.assert_array_equal(sen.sensors,
                                np.array([0, 0, 0, 2, 2, 0, 0, 0, 0, 0, 1, 1, 0, 0]))
 
+    # =========================================================================
+    def test_resensing(self):
+        """Is sensing again near some elements the same as sensing everywhere?"""
+
+        sol = solution.Solution('scktube 40 0.0 1.0 0.0 1.0 0.125 0.0 0.1',
+                                'euler', 2, 'roe', '', [0.01, 0.01])
+        sol.apply_bc()
+        sol.sensors.sensing(sol)
+        sensors = np.copy(sol.sensors.sensors)
+
+        # Move the discontinuity by a few elements
+        rho, rhou, E = sol.split_fields(sol.u)
+        changed = np.zeros(sol.N_E + 2, dtype=bool)
+        changed[21:25] = True
+        rho[0, 21:25] = 1
+        E[0, 21:25] = 2.5
+        sol.invalidate()
+
+        sen = sensor.Sensor(sol.sensors.thresholds, sol.N_E + 2)
+        sen.sensing(sol)
+        self.assertTrue(np.all(sen.sensors[19:23] == 0))
+        self.assertTrue(np.any(sen.sensors[24:26] != 0))
+
+        # Interface by interface, or everything at once
+        full_fraction = sensor.FULL_FRACTION
+        for sensor.FULL_FRACTION in [1, 0]:
+            np.copyto(sol.sensors.sensors, sensors)
+            sol.sensors.resensing(sol, changed)
+            npt.assert_array_equal(sol.sensors.sensors, sen.sensors)
+        sensor.FULL_FRACTION = full_fraction
+
+    # =========================================================================
+    def test_dilate(self):
+        """Are the sensors spread to the neighboring elements?"""
+        npt.assert_array_equal(
+            sensor.dilate(np.array([[0, 0, 1, 0, 0, 0, 2, 0],
+                                    [1, 0, 0, 0, 0, 0, 1, 2]])),
+            [[0, 1, 1, 1, 0, 2, 2, 2],
+             [1, 1, 0, 0, 0, 1, 2, 2]])
+
 
 if __name__ == '__main__':
     unittest.main()
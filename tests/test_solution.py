@@ -5,6 +5,7 @@
 # =========================================================================
 import unittest
 from .context import solution
+from .context import euler_physics
 import numpy as np
 import numpy.testing as npt
 
@@ -69,6 +70,51 @@ class SolutionTestCase(unittest.TestCase):
         npt.assert_array_almost_equal(sol.scaled_minv, np.array(
             [1. / 2 * (2. / 1), 3. / 2 * (2. / 1), 5. / 2 * (2. / 1), 7. / 2 * (2. / 1)]), decimal=7)
 
+    # =========================================================================
+    def test_average_primitives(self):
+        """Are the cached primitive variables recomputed when the solution changes?"""
+        sol = solution.Solution('entrpyw 10', 'euler', 2)
+        sol.apply_bc()
+
+        w = sol.average_primitives()
+        self.assertIs(sol.average_primitives()[1], w[1])
+        self.assertTrue(np.all(np.isfinite(w[3])))
+        npt.assert_array_almost_equal(sol.max_wave_speed(),
+                                      np.max(np.fabs(w[1]) + w[3], axis=-1))
+
+        # the storage is reused but the values are updated
+        rho = np.copy(w[0])
+        sol.smart_axpy(1.0, sol.u)
+        w2 = sol.average_primitives()
+        self.assertIs(w2[1], w[1])
+        npt.assert_array_almost_equal(w2[0], 2 * rho)
+
+    # =========================================================================
+    def test_face_primitives(self):
+        """Are the primitive variables of the faces cached and given to the Riemann solver?"""
+        sol = solution.Solution('entrpyw 10', 'euler', 2, 'hllc')
+        sol.apply_bc()
+        uf = sol.evaluate_faces()
+        ul, ur = uf[..., 1, :-sol.N_F], uf[..., 0, sol.N_F:]
+
+        wl, wr = sol.face_primitives(uf)
+        self.assertIs(sol.face_primitives(uf)[0][1].base, wl[1].base)
+        npt.assert_array_equal(wl[2], euler_physics.primitives(
+            sol.split_fields(ul))[2])
+        npt.assert_array_equal(sol.riemann(ul, ur, wl=wl, wr=wr),
+                               sol.riemann(ul, ur))
+
+        # the storage is reused but the values are updated
+        p = np.copy(wr[2])
+        sol.smart_axpy(1.0, sol.u)
+        sol.evaluate_faces(out=uf)
+        w2 = sol.face_primitives(uf)[1]
+        self.assertIs(w2[2].base, wr[2].base)
+        npt.assert_array_almost_equal(w2[2], 2 * p)
+
+        # the advection kernels do not take them
+        sol = solution.Solution('sinewave 10', 'advection', 2)
+        self.assertEqual(sol.face_primitives(sol.evaluate_faces()), (None, None))
 
 if __name__ == '__main__':
     unittest.main()